@@ -0,0 +1,357 @@
+"""
+Open-loop HTTP load generator. Requests are issued at the times dictated by
+an arrival process (Poisson, constant, or bursty), no matter how fast the
+server responds, over a pool of keep-alive connections. Latency is measured
+from the time a request was due, so queueing caused by a slow server (or by
+the concurrency cap) is accounted for, and recorded into a log-linear
+(HDR-style) histogram, which is written out as JSON.
+
+Usage: python3 loadgen.py --host 10.0.0.1 --port 8080 --rate 1000 --duration 60 --output /tmp/latency.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of integer values (microseconds). Values below
+    `sub_bucket_count` are counted exactly, above that, each power of 2 range
+    is split into `sub_bucket_count / 2` buckets, so the relative error stays
+    below 10^-significant_digits
+    """
+
+    def __init__(self, significant_digits: int = 2, max_value: int = 3600 * 10 ** 6):
+        self.sub_bucket_count = 2 ** math.ceil(math.log2(2 * 10 ** significant_digits))
+        self.sub_bucket_half_count = self.sub_bucket_count // 2
+        self.max_value = max_value
+        self.counts = [0] * (self.get_index(max_value) + 1)
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def get_index(self, value: int) -> int:
+        if value < self.sub_bucket_count:
+            return value
+        bucket = value.bit_length() - self.sub_bucket_count.bit_length() + 1
+        sub_bucket = value >> bucket
+        return self.sub_bucket_count + (bucket - 1) * self.sub_bucket_half_count \
+                + sub_bucket - self.sub_bucket_half_count
+
+    def get_value_range(self, index: int) -> tuple:
+        """ Returns (lowest, highest) values counted by the bucket """
+        if index < self.sub_bucket_count:
+            return index, index
+        bucket = (index - self.sub_bucket_count) // self.sub_bucket_half_count + 1
+        sub_bucket = (index - self.sub_bucket_count) % self.sub_bucket_half_count \
+                + self.sub_bucket_half_count
+        return sub_bucket << bucket, ((sub_bucket + 1) << bucket) - 1
+
+    def record(self, value: int):
+        value = min(max(0, int(value)), self.max_value)
+        self.counts[self.get_index(value)] += 1
+        self.total += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def get_percentile(self, percentile: float) -> int:
+        """ Returns the highest value equivalent to the percentile's bucket """
+        if self.total == 0:
+            return 0
+        target = max(1, math.ceil(self.total * percentile / 100))
+        n = 0
+        for index, count in enumerate(self.counts):
+            n += count
+            if n >= target:
+                return min(self.get_value_range(index)[1], self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return dict(
+            unit="us",
+            total=self.total,
+            min=self.min,
+            max=self.max,
+            percentiles={str(p): self.get_percentile(p) for p in [50, 75, 90, 95, 99, 99.9, 99.99]},
+            # [lowest value of the bucket, count] for non-empty buckets
+            buckets=[[self.get_value_range(i)[0], c] for i, c in enumerate(self.counts) if c > 0],
+        )
+
+
+def get_arrivals(process: str, rate: float, rng: random.Random, burst_size: int = 10):
+    """
+    Yields inter-arrival times (s) of requests
+    - process: "poisson", "constant", or "bursty". Bursty process issues
+      `burst_size` requests at once, bursts are spaced evenly, so the average
+      rate is the same
+    """
+    if process == "poisson":
+        while True:
+            yield rng.expovariate(rate)
+    elif process == "constant":
+        while True:
+            yield 1.0 / rate
+    elif process == "bursty":
+        while True:
+            yield burst_size / rate
+            for _ in range(burst_size - 1):
+                yield 0.0
+    else:
+        raise ValueError(f"Unsupported arrival process \"{process}\"")
+
+
+class ConnectionPool:
+    """ Keep-alive connections to a single server, at most `size` of them """
+
+    def __init__(self, host: str, port: int, size: int):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle = list()
+        self.n_open = 0
+        self.n_opened = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            while len(self.idle) == 0 and self.n_open >= self.size:
+                await self.condition.wait()
+            if len(self.idle) > 0:
+                return self.idle.pop()
+            self.n_open += 1
+        try:
+            connection = await asyncio.open_connection(self.host, self.port)
+            self.n_opened += 1
+            return connection
+        except BaseException:
+            # Including cancellation on timeout, free the slot
+            await self.release(None)
+            raise
+
+    async def release(self, connection):
+        """ Returns the connection into the pool. None, if it has been closed """
+        async with self.condition:
+            if connection is None:
+                self.n_open -= 1
+            else:
+                self.idle.append(connection)
+            self.condition.notify()
+
+    async def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        for _, writer in self.idle:
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+        self.idle.clear()
+
+
+async def _read_response(reader) -> tuple:
+    """ Reads an HTTP/1.1 response. Returns (status, whether the connection can be reused) """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by the server")
+    version, status = status_line.decode("latin-1").split()[:2]
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in [b"\r\n", b"\n", b""]:
+            break
+        key, value = line.decode("latin-1").split(":", 1)
+        headers[key.strip().lower()] = value.strip().lower()
+    keep_alive = headers.get("connection") != "close" and version != "HTTP/1.0" \
+            or headers.get("connection") == "keep-alive"
+    if headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    else:
+        await reader.read()
+        keep_alive = False
+    return int(status), keep_alive
+
+
+class LoadGenerator:
+    def __init__(self, host: str, port: int, path: str = "/", rate: float = 100.0,
+                arrival: str = "poisson", duration: float = 10.0, concurrency: int = 256,
+                connections: int = 64, burst_size: int = 10, timeout: float = 10.0,
+                seed: int = None):
+        """
+        - rate: average number of requests per second
+        - concurrency: max. number of requests in flight. Requests above that
+          wait, and the wait counts into their latency
+        - connections: max. number of keep-alive connections
+        """
+        self.host = host
+        self.port = port
+        self.path = path
+        self.rate = rate
+        self.arrival = arrival
+        self.duration = duration
+        self.concurrency = concurrency
+        self.connections = connections
+        self.burst_size = burst_size
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.histogram = LatencyHistogram()
+        self.statuses = dict()
+        self.errors = dict()
+        self.n_sent = 0
+
+    def _count_error(self, error: Exception):
+        self.errors[type(error).__name__] = self.errors.get(type(error).__name__, 0) + 1
+
+    async def _request(self, pool: ConnectionPool, semaphore: asyncio.Semaphore, due: float):
+        request = (f"GET {self.path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                "Connection: keep-alive\r\n\r\n").encode("latin-1")
+        async with semaphore:
+            try:
+                connection = await asyncio.wait_for(pool.acquire(), self.timeout)
+            except Exception as e:
+                self._count_error(e)
+                return
+            reader, writer = connection
+            try:
+                writer.write(request)
+                status, keep_alive = await asyncio.wait_for(_read_response(reader), self.timeout)
+                self.histogram.record((time.perf_counter() - due) * 1e6)
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+            except Exception as e:
+                self._count_error(e)
+                keep_alive = False
+            if not keep_alive:
+                writer.close()
+                connection = None
+            await pool.release(connection)
+
+    async def run(self) -> dict:
+        pool = ConnectionPool(self.host, self.port, self.connections)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        t0 = time.perf_counter()
+        due = t0
+        for gap in get_arrivals(self.arrival, self.rate, self.rng, self.burst_size):
+            due += gap
+            if due - t0 >= self.duration:
+                break
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(self._request(pool, semaphore, due))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            self.n_sent += 1
+        if len(tasks) > 0:
+            await asyncio.wait(tasks)
+        elapsed = time.perf_counter() - t0
+        await pool.close()
+        n_ok = sum(self.statuses.values())
+        return dict(
+            target=f"http://{self.host}:{self.port}{self.path}",
+            arrival=self.arrival,
+            rate=self.rate,
+            duration=elapsed,
+            sent=self.n_sent,
+            completed=n_ok,
+            achieved_rate=n_ok / elapsed if elapsed > 0 else 0.0,
+            connections_opened=pool.n_opened,
+            statuses={str(k): v for k, v in self.statuses.items()},
+            errors=self.errors,
+            latency=self.histogram.to_dict(),
+        )
+
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="10.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--rate", type=float, default=100.0, help="Requests per second")
+    parser.add_argument("--arrival", choices=["poisson", "constant", "bursty"], default="poisson")
+    parser.add_argument("--burst-size", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds")
+    parser.add_argument("--concurrency", type=int, default=256, help="Max. requests in flight")
+    parser.add_argument("--connections", type=int, default=64, help="Max. keep-alive connections")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None, help="JSON report file. If not set, printed to stdout")
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_arguments()
+    generator = LoadGenerator(host=args.host, port=args.port, path=args.path, rate=args.rate,
+            arrival=args.arrival, duration=args.duration, concurrency=args.concurrency,
+            connections=args.connections, burst_size=args.burst_size, timeout=args.timeout,
+            seed=args.seed)
+    report = asyncio.run(generator.run())
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def test_histogram():
+    histogram = LatencyHistogram()
+    values = list(range(1, 100000, 7))
+    for i in values:
+        histogram.record(i)
+    for percentile in [50, 90, 99]:
+        exact = values[math.ceil(len(values) * percentile / 100) - 1]
+        assert abs(histogram.get_percentile(percentile) - exact) / exact < 0.01
+    for index in range(len(histogram.counts)):
+        low, high = histogram.get_value_range(index)
+        assert histogram.get_index(low) == index and histogram.get_index(high) == index
+
+
+def test_load_generator():
+    """ Requests go over a few keep-alive connections """
+
+    async def _test():
+        handlers = list()
+
+        async def handle(reader, writer):
+            handlers.append(asyncio.current_task())
+            while True:
+                try:
+                    await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break  # The client has closed the connection
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+                await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        generator = LoadGenerator("127.0.0.1", port, rate=2000, arrival="bursty",
+                duration=0.25, connections=4, seed=0)
+        report = await generator.run()
+        # The generator has closed its connections, so the handlers finish on their own
+        await asyncio.wait_for(asyncio.gather(*handlers), 5.0)
+        server.close()
+        await server.wait_closed()
+        return report, len(handlers)
+
+    report, n_connections = asyncio.run(_test())
+    assert report["sent"] == 490  # 49 bursts of 10 requests fit into 0.25 s
+    assert report["statuses"] == {"200": 490}
+    assert report["errors"] == {}
+    assert report["connections_opened"] == n_connections <= 4
+    assert report["latency"]["total"] == 490
+
+
+if __name__ == "__main__":
+    main()
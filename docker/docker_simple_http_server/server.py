@@ -1,28 +1,315 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
+"""
+HTTP test server w/ tunable synthetic work per request: CPU-bound busy loop,
+sleep, and response size. Defaults are set from the command line, and may be
+overridden per request w/ query parameters, e.g. `/?cpu_ms=5&sleep_ms=20&size=100000`.
 
-class RequestHandler(BaseHTTPRequestHandler):
-    connection_count = 0
+Modes:
+- threaded: a thread per connection (HTTP/1.1, keep-alive). CPU work of
+  concurrent requests is serialized by the GIL, as it would be in a
+  single-core container
+- asyncio: a single event loop. Sleeps do not occupy threads, so thousands
+  of slow requests may be in flight at once
+
+`/counters` returns JSON w/ the number of requests served, bytes sent, CPU
+time spent, and the number of requests in flight.
+
+Usage: python3 server.py --mode asyncio --port 8080 --cpu-ms 2 --size 10000
+"""
+
+import argparse
+import asyncio
+import functools
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+
+
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.cpu_seconds = 0.0
+        self.sleep_seconds = 0.0
+        self.in_flight = 0
+        self.t0 = time.monotonic()
+
+    def begin(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def end(self, bytes_sent: int, cpu_seconds: float, sleep_seconds: float):
+        """
+        - bytes_sent: None, if the response has not been sent (e.g. the client
+          has disconnected), the request is not counted then
+        """
+        with self.lock:
+            self.in_flight -= 1
+            self.cpu_seconds += cpu_seconds
+            self.sleep_seconds += sleep_seconds
+            if bytes_sent is not None:
+                self.requests += 1
+                self.bytes_sent += bytes_sent
+
+    def get_requests(self) -> int:
+        with self.lock:
+            return self.requests
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return dict(requests=self.requests, bytes_sent=self.bytes_sent,
+                    cpu_seconds=self.cpu_seconds, sleep_seconds=self.sleep_seconds,
+                    in_flight=self.in_flight, uptime=time.monotonic() - self.t0)
+
+
+class Work:
+    """ Synthetic work done for a request """
+
+    def __init__(self, cpu_ms: float = 0.0, sleep_ms: float = 0.0, size: int = 0):
+        self.cpu_ms = cpu_ms
+        self.sleep_ms = sleep_ms
+        self.size = size
+        """ Response body size, bytes. 0 -- a short greeting """
+
+    def override(self, query: str):
+        """ Returns a copy w/ parameters overridden by the query string """
+        params = urllib.parse.parse_qs(query)
+        get = lambda name, type_, default: type_(params[name][0]) if name in params else default
+        return Work(cpu_ms=get("cpu_ms", float, self.cpu_ms),
+                sleep_ms=get("sleep_ms", float, self.sleep_ms),
+                size=get("size", int, self.size))
+
+    def burn_cpu(self) -> float:
+        """ Spins until `cpu_ms` of CPU time is consumed by the thread. Returns seconds consumed """
+        t0 = time.thread_time()
+        deadline = t0 + self.cpu_ms / 1000
+        x = 0
+        while time.thread_time() < deadline:
+            for i in range(1000):
+                x += i * i
+        return time.thread_time() - t0
+
+
+@functools.lru_cache(maxsize=64)
+def _get_body(size: int) -> bytes:
+    return b"x" * size
+
+
+def _handle(path: str, work: Work, counters: Counters):
+    """
+    Returns (body, content type, synthetic work to do). Work is None for
+    requests that are not to be counted
+    """
+    parsed = urllib.parse.urlsplit(path)
+    if parsed.path == "/counters":
+        return json.dumps(counters.to_dict()).encode("utf8"), "application/json", None
+    work = work.override(parsed.query)
+    if work.size > 0:
+        return _get_body(work.size), "application/octet-stream", work
+    return bytes(f"Hello! This server has received {counters.get_requests() + 1} connections.", "utf8"), \
+            "text/html", work
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive
+    work = Work()
+    counters = Counters()
 
     def do_GET(self):
-        # Increment the connection count
-        RequestHandler.connection_count += 1
-        
-        # Send response status code
+        body, content_type, work = _handle(self.path, self.work, self.counters)
+        if work is None:
+            self._respond(body, content_type)
+            return
+        self.counters.begin()
+        bytes_sent, cpu_seconds = None, 0.0
+        try:
+            cpu_seconds = work.burn_cpu()
+            time.sleep(work.sleep_ms / 1000)
+            self._respond(body, content_type)
+            bytes_sent = len(body)
+        finally:
+            self.counters.end(bytes_sent, cpu_seconds, work.sleep_ms / 1000)
+
+    def _respond(self, body: bytes, content_type: str):
         self.send_response(200)
-        
-        # Send headers
-        self.send_header('Content-type', 'text/html')
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        
-        # Write response message
-        self.wfile.write(bytes(f"Hello! This server has received {RequestHandler.connection_count} connections.", "utf8"))
-        return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Logging each request would cap the throughput
+
+
+def make_threaded_server(port: int, work: Work, counters: Counters) -> http.server.ThreadingHTTPServer:
+    handler_class = type("_RequestHandler", (RequestHandler,), dict(work=work, counters=counters))
+    server = http.server.ThreadingHTTPServer(('', port), handler_class)
+    server.daemon_threads = True
+    return server
+
+
+async def _handle_connection(reader, writer, work: Work, counters: Counters):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, version = request_line.decode("latin-1").split()[:3]
+            keep_alive = version == "HTTP/1.1"
+            content_length = 0
+            while True:
+                line = await reader.readline()
+                if line in [b"\r\n", b"\n", b""]:
+                    break
+                key, value = line.decode("latin-1").split(":", 1)
+                key, value = key.strip().lower(), value.strip().lower()
+                if key == "connection":
+                    keep_alive = value == "keep-alive" or (keep_alive and value != "close")
+                elif key == "content-length":
+                    content_length = int(value)
+            if content_length > 0:
+                await reader.readexactly(content_length)
+            body, content_type, request_work = _handle(path, work, counters)
+            if request_work is not None:
+                counters.begin()
+            bytes_sent, cpu_seconds = None, 0.0
+            try:
+                if request_work is not None:
+                    cpu_seconds = request_work.burn_cpu()
+                    await asyncio.sleep(request_work.sleep_ms / 1000)
+                writer.write((f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\n"
+                        f"Content-Length: {len(body)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode("latin-1"))
+                writer.write(body)
+                await writer.drain()
+                bytes_sent = len(body)
+            finally:
+                # Also when the client disconnects, or the server shuts down
+                if request_work is not None:
+                    counters.end(bytes_sent, cpu_seconds, request_work.sleep_ms / 1000)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_asyncio(port: int, work: Work, counters: Counters, started: callable = None,
+            host: str = None):
+    """ Serves forever. `started` is called w/ the server once it is listening """
+    server = await asyncio.start_server(
+            lambda reader, writer: _handle_connection(reader, writer, work, counters),
+            host=host, port=port, backlog=4096)
+    if started is not None:
+        started(server)
+    async with server:
+        await server.serve_forever()
+
+
+def run(mode: str = "threaded", port: int = 8080, work: Work = None):
+    work = work or Work()
+    counters = Counters()
+    print(f'Starting {mode} httpd server on port {port}...')
+    if mode == "threaded":
+        make_threaded_server(port, work, counters).serve_forever()
+    elif mode == "asyncio":
+        asyncio.run(serve_asyncio(port, work, counters))
+    else:
+        raise ValueError(f"Unsupported mode \"{mode}\"")
+
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cpu-ms", type=float, default=0.0, help="CPU time burnt per request")
+    parser.add_argument("--sleep-ms", type=float, default=0.0, help="Time slept per request")
+    parser.add_argument("--size", type=int, default=0, help="Response size, bytes")
+    return parser.parse_args()
+
+
+def _fetch(connection, path: str) -> bytes:
+    connection.request("GET", path)
+    response = connection.getresponse()
+    assert response.status == 200
+    return response.read()
+
+
+def _check_server(port: int):
+    import http.client
+    import socket
+    import struct
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    assert _fetch(connection, "/").startswith(b"Hello!")
+    assert len(_fetch(connection, "/?size=100000")) == 100000
+    _fetch(connection, "/?cpu_ms=20&sleep_ms=10")
+    counters = json.loads(_fetch(connection, "/counters"))
+    assert counters["requests"] == 3
+    assert counters["bytes_sent"] > 100000
+    assert counters["cpu_seconds"] >= 0.02
+    assert counters["sleep_seconds"] >= 0.01
+    assert counters["in_flight"] == 0
+
+    # A client disconnecting before it gets the response does not leave the
+    # request in flight. The connection is reset, once the server has begun
+    # serving the request
+    def _wait_in_flight(n: int):
+        deadline = time.monotonic() + 5
+        while json.loads(_fetch(connection, "/counters"))["in_flight"] != n:
+            assert time.monotonic() < deadline
+            time.sleep(0.005)
+
+    client = socket.create_connection(("127.0.0.1", port))
+    client.sendall(b"GET /?sleep_ms=300&size=10000000 HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    _wait_in_flight(1)
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))  # Reset
+    client.close()
+    _wait_in_flight(0)
+    counters = json.loads(_fetch(connection, "/counters"))
+    assert counters["requests"] == 3
+    assert counters["sleep_seconds"] >= 0.31
+    connection.close()
+
+
+def test_threaded_server():
+    server = make_threaded_server(0, Work(), Counters())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        _check_server(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_asyncio_server():
+    ready = threading.Event()
+    state = dict()
+
+    def started(server):
+        state["server"] = server
+        state["loop"] = asyncio.get_running_loop()
+        ready.set()
+
+    def serve():
+        try:
+            asyncio.run(serve_asyncio(0, Work(), Counters(), started, "127.0.0.1"))
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    ready.wait(5)
+    try:
+        _check_server(state["server"].sockets[0].getsockname()[1])
+    finally:
+        state["loop"].call_soon_threadsafe(state["server"].close)
+        thread.join(5)
 
-def run(server_class=HTTPServer, handler_class=RequestHandler, port=8080):
-    server_address = ('', port)
-    httpd = server_class(server_address, handler_class)
-    print(f'Starting httpd server on port {port}...')
-    httpd.serve_forever()
 
 if __name__ == "__main__":
-    run()
+    args = _parse_arguments()
+    run(args.mode, args.port, Work(cpu_ms=args.cpu_ms, sleep_ms=args.sleep_ms, size=args.size))
@@ -2,7 +2,6 @@
 Generates a simple topology, and deploys it on a containernet network
 """
 
-import time
 from mininet.cli import CLI
 from mininet.log import setLogLevel
 import howlitbe.mininet
@@ -21,11 +20,10 @@ H2_CONTAINER_NAME = "docker_simple_http_client"
 
 def main():
     # Save containers into a certain directory, so they can be ported by the deployed containers
-    # TODO: add "already exists" check
     image_tar_output_dir = '/tmp/dockerimages'
-    tired.command.execute(f'mkdir -p {image_tar_output_dir}')
-    tired.command.execute(f'docker save -o {image_tar_output_dir}/{H1_CONTAINER_NAME} {H1_CONTAINER_NAME}')
-    tired.command.execute(f'docker save -o {image_tar_output_dir}/{H2_CONTAINER_NAME} {H2_CONTAINER_NAME}')
+    stager = howlitbe.mininet.ImageStager(howlitbe.mininet.ImageCache(image_tar_output_dir),
+            host_directory='/var/dockerimages')
+    archives = stager.stage_images([H1_CONTAINER_NAME, H2_CONTAINER_NAME])
     
     os.system('cgroupfs-umount')
     os.system('cgroupfs-mount')
@@ -69,22 +67,13 @@ def main():
         hosts[i].sendCmd(f'mkdir -p /var/dockerimages && mount --bind {image_tar_output_dir} /var/dockerimages')
         hosts[i].waitOutput()
 
-        tired.logging.info(f"Launching containerd on {hosts[i].name}")
-        hosts[i].sendCmd(f'containerd --log-level debug > /tmp/mininet-containerd-{i}.log 2>&1 &')
-        hosts[i].waitOutput()
-
-        tired.logging.info(f"Launching containerd on {hosts[i].name}")
-        time.sleep(3) # TODO Crutch: containerd needs some time to launch
-        tired.logging.info(f"Deploying Docker on {hosts[i].name}")
-        hosts[i].sendCmd(f'dockerd --log-level debug > /tmp/mininet-dockerd-{i}.log 2>&1 &')
-        hosts[i].waitOutput()
+    # Launch containerd, and dockerd on all hosts at once
+    latencies = howlitbe.mininet.HostBootstrap(howlitbe.mininet.DOCKER_DAEMONS).bootstrap(hosts)
+    for host, daemons in latencies.items():
+        tired.logging.info(f"Host {host}: daemons got ready in", str(daemons))
 
-        # Load canned docker images
-        time.sleep(3) # TODO Crutch: dockerd needs some time to launch
-        hosts[i].sendCmd(f'docker load -i /var/dockerimages/{H1_CONTAINER_NAME}')
-        hosts[i].waitOutput()
-        hosts[i].sendCmd(f'docker load -i /var/dockerimages/{H2_CONTAINER_NAME}')
-        hosts[i].waitOutput()
+    # Load canned docker images. Waits for the daemons to get ready
+    stager.load(hosts, archives)
 
     # Drop into Mininet shell
     tired.logging.info("Dropping into containernet shell")
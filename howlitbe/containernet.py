@@ -7,34 +7,112 @@ changing mininet.
 """
 
 
+import contextlib
 import howlitbe.containernet
+import howlitbe.deployment
 import howlitbe.topology
 import os
+import threading
+import time
 import tired.logging
 import networkx as nx
 
 # If containernet is not installed (development environment), dry run
 
-def make_dry_run(classname: str):
-    def mock_function(self, *args, **kwargs):
-        return self
+class _DryRunNode:
+    """ Mock of a network node (host, switch, docker), as returned by the dry-run network """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.n_interfaces = 0
+        self.addresses = dict()
+        """ {interface name: (ip, prefix length)} set w/ `setIP` """
+
+    def __repr__(self):
+        return self.name
+
+    def cmd(self, *args, **kwargs):
+        return ""
+
+    def setIP(self, ip: str, prefixLen: int = 8, intf=None):
+        self.addresses[None if intf is None else intf.name] = (ip, prefixLen)
+
+
+class _DryRunIntf:
+
+    def __init__(self, node: _DryRunNode):
+        self.node = node
+        self.name = f"{node.name}-eth{node.n_interfaces}"
+        node.n_interfaces += 1
+
+
+class _DryRunLink:
+    """ Mock of a link, as returned by the dry-run network """
+
+    def __init__(self, node1: _DryRunNode, node2: _DryRunNode):
+        self.intf1 = _DryRunIntf(node1)
+        self.intf2 = _DryRunIntf(node2)
+
+
+def make_dry_run(classname: str, latency: dict = None):
+    """
+    Makes a mock class. Instances record the calls they receive into `calls`,
+    node-creating calls return node mocks named after the first argument.
+    - latency: {method name: seconds}. Delay injected into the calls, e.g. to
+      measure the effect of concurrent deployment w/o Containernet installed
+    """
+    if latency is None:
+        latency = dict()
+
+    def make_mock_function(method_name: str, returns: type = None):
+        def mock_function(self, *args, **kwargs):
+            time.sleep(latency.get(method_name, 0.0))
+            with self.lock:
+                self.calls.append((method_name, args, kwargs))
+            if returns is _DryRunNode:
+                return _DryRunNode(args[0])
+            elif returns is _DryRunLink and all(isinstance(i, _DryRunNode) for i in args[:2]):
+                return _DryRunLink(args[0], args[1])
+            return self
+        return mock_function
 
     class _DryRun:
         def __init__(self, *args, **kwargs):
-            pass
+            self.calls = list()
+            self.lock = threading.Lock()
+            self.hosts = list()
+            self.nameToNode = dict()
 
-        addDocker = mock_function
-        addHost = mock_function
-        addSwitch = mock_function
-        addController = mock_function
-        start = mock_function
-        addLink = mock_function
+        addDocker = make_mock_function("addDocker", _DryRunNode)
+        addHost = make_mock_function("addHost", _DryRunNode)
+        addSwitch = make_mock_function("addSwitch", _DryRunNode)
+        addController = make_mock_function("addController", _DryRunNode)
+        start = make_mock_function("start")
+        addLink = make_mock_function("addLink", _DryRunLink)
+        delLinkBetween = make_mock_function("delLinkBetween")
+        removeDocker = make_mock_function("removeDocker")
+        delHost = make_mock_function("delHost")
+        delSwitch = make_mock_function("delSwitch")
 
     ret = _DryRun
     ret.__name__ = classname
     return ret
 
 
+def make_dry_run_docker(latency: float = 0.0) -> type:
+    """
+    Makes a mock of `mininet.node.Docker`. Constructing an instance takes
+    `latency` seconds, as starting a container would
+    """
+    class _DryRunDocker(_DryRunNode):
+        def __init__(self, name: str, **params):
+            time.sleep(latency)
+            _DryRunNode.__init__(self, name)
+            self.params = params
+
+    return _DryRunDocker
+
+
 try:
     from mininet.net import Containernet
     from mininet.node import Controller
@@ -43,6 +121,7 @@ try:
     from mininet.log import info, setLogLevel
     from mininet.link import Link
     from mininet.node import Node
+    from mininet.node import Docker
     HWL_DRY_RUN = False
 except ModuleNotFoundError as e:
     tired.logging.warning("Mocking containernet, because containernet is not installed")
@@ -51,87 +130,181 @@ except ModuleNotFoundError as e:
     Controller = make_dry_run("Controller")
     CLI = make_dry_run("CLI")
     TCLink = make_dry_run("TCLink")
+    Docker = make_dry_run_docker()
     info = tired.logging.info
     HWL_DRY_RUN = True
 
 
 class DeploymentBuilder:
-    """ Builds Containernet object from a given topology """
+    """
+    Builds Containernet object from a given topology.
 
-    def build_from_topology(self, topology: howlitbe.topology.Topology) -> Containernet:
-        # Initialize the network
-        net = Containernet(controller=Controller)
-        # Create one default controller w/ a predefined name
-        net.addController('c0')
-        nodemap = dict()  # A temporary index for addressing the created mininet/containernet entities later
-        # Spawn nodes and switches
+    The topology is first compiled into a `howlitbe.deployment.DeploymentPlan`,
+    w/ the network brought up in phases: switches, hosts, containers, links.
+    Containers (the slowest part, each one is a `docker run`) may be started
+    concurrently on a bounded thread pool, while their registration in the
+    network is serialized. Time spent on each phase is stored in `timings`.
+
+    The builder keeps the plan it has deployed, so the running network can
+    later be brought to an updated topology w/ `redeploy`.
+    """
+
+    def __init__(self, n_workers: int = 1, network_type: type = None,
+                limits: howlitbe.deployment.ResourceLimits = None, docker_type: type = None):
+        """
+        - n_workers: number of threads creating docker containers
+          concurrently. 1 -- containers are created one after another
+        - network_type: Containernet-compatible class to instantiate. If None,
+          `Containernet` (or its dry-run mock) is used
+        - docker_type: node class containers are constructed w/, when
+          `n_workers` > 1. If None, `Docker` (or its dry-run mock) is used
+        - limits: how resource fractions of the topology translate into
+          absolute limits. If None, containers, and links are not limited
+        """
+        self.n_workers = n_workers
+        self.network_type = network_type
+        self.docker_type = docker_type
+        self.limits = limits or howlitbe.deployment.NoResourceLimits()
+        self.timings = dict()
+        """ {phase: seconds}. Phases: "switches", "hosts", "containers", "links", "start" """
+        self.plan = None
+        """ Plan the network has been deployed w/ """
+        self.nodemap = dict()
+        """ {operation name: created mininet/containernet entity} """
+
+    @contextlib.contextmanager
+    def _timed(self, phase: str):
+        t0 = time.perf_counter()
+        yield
+        self.timings[phase] = time.perf_counter() - t0
+        tired.logging.info(f"Deployment phase \"{phase}\" took {self.timings[phase]:.3f} s")
+
+    def _log_timings(self):
+        for phase, seconds in self.timings.items():
+            tired.logging.info(f"Deployment phase \"{phase}\" took {seconds:.3f} s")
+
+    def compile_plan(self, topology: howlitbe.topology.Topology) -> howlitbe.deployment.DeploymentPlan:
+        """
+        Translates the topology into an ordered list of operations. Entities
+        are named after topology ids, so unchanged parts of a topology compile
+        into identical operations. Resource limits are part of the operations
+        """
+        plan = howlitbe.deployment.DeploymentPlan()
+        names = dict()  # {node hash: name of the entity}
+        node_bps = dict()  # {node hash: total bandwidth of the node's physical links}
         nx_graph = topology.as_nxgraph()
-        for i in nx_graph.nodes():
-            node = nx_graph.nodes[i]["data"]
-            if isinstance(node, howlitbe.topology.Switch):
-                switch_name = "s" + str(node.get_id())
-                # TODO: Limits
-                s = net.addSwitch(switch_name)
-                tired.logging.debug(f"Built switch {switch_name}")
-                nodemap[hash(node)] = s
-            elif isinstance(node, howlitbe.topology.Node):
-                # TODO: do we really need nodes for that? It might be so docker automatically create a host
-                host_name = "h" + str(node.get_id())
-                # TODO: Limits
-                tired.logging.debug("Adding host", host_name, node.get_ip4_string())
-                n = net.addHost(host_name,
-                        ip=node.get_ip4_string(),
-                        prefixLen=node.get_ip4_prefixlen())
-                nodemap[hash(node)] = n
-            elif isinstance(node, howlitbe.topology.Container):
-                container_name = "d" + str(node.get_id())
-                # TODO: Limits
-                tired.logging.debug("Adding docker", container_name, "on node",
-                        str(node.node.get_id()), "ip", node.node.get_ip4_string(),
-                        "application", node.name)
-                n = net.addDocker(node.get_string_id(),
-                        ip=node.node.get_ip4_string(),
-                        dcmd=node.command if node.command else None,
-                        dimage=f"{node.name}",
-                        prefixLen=node.node.get_ip4_prefixlen())
-                nodemap[hash(node)] = n
-        # Add links b/w the components of the network
-        for e in nx_graph.edges():
-            edge = nx_graph.edges[e]["relationship"]
+        index = topology.get_index()
+        nodes_of_kind = lambda *kinds: [node for kind, node
+                in zip(index.node_kind, index.node_objects) if kind in kinds]
+
+        # Switches
+        for node in nodes_of_kind(howlitbe.topology.NODE_KIND_SWITCH,
+                    howlitbe.topology.NODE_KIND_GATE):
+            names[hash(node)] = "s" + str(node.get_id())
+            plan.add_switch(names[hash(node)], source=hash(node))
+
+        # Hosts
+        for node in nodes_of_kind(howlitbe.topology.NODE_KIND_NODE):
+            # TODO: do we really need nodes for that? It might be so docker automatically create a host
+            names[hash(node)] = "h" + str(node.get_id())
+            plan.add_host(names[hash(node)],
+                    source=hash(node),
+                    ip=node.get_ip4_string(),
+                    prefixLen=node.get_ip4_prefixlen())
+
+        # Containers. Names, and IPs are set explicitly, so the order
+        # Containernet registers them in does not matter. Detached containers
+        # are not deployed
+        attachments = topology.get_container_attachments()
+        for container in nodes_of_kind(howlitbe.topology.NODE_KIND_CONTAINER):
+            if hash(container) not in attachments:
+                continue
+            names[hash(container)] = container.get_string_id()
+            plan.add_docker(names[hash(container)],
+                    source=hash(container),
+                    ip=container.node.get_ip4_string(),
+                    dcmd=container.command if container.command else None,
+                    dimage=f"{container.name}",
+                    prefixLen=container.node.get_ip4_prefixlen(),
+                    **self.limits.get_docker_limits(container))
+
+        # Links b/w the components of the network
+        for edge in index.edge_objects:
             if isinstance(edge, howlitbe.topology.PhysicalLink):
-                node1 = edge.node1
-                node2 = edge.node2
-                tired.logging.debug("Creating physical link between", node1.get_summary(), "and", node2.get_summary())
-                netlink = net.addLink(nodemap[hash(node1)], nodemap[hash(node2)])
-                nodemap[hash(edge)] = netlink  # JIC
+                plan.add_link(names[hash(edge.node1)], names[hash(edge.node2)],
+                        source=(hash(edge.node1), hash(edge.node2)),
+                        **self.limits.get_link_limits(edge.bps))
+                for node in [edge.node1, edge.node2]:
+                    node_bps[hash(node)] = node_bps.get(hash(node), 0) + edge.bps
         # Add links b/w docker containers, and switches
         # Get a list of connected switches
         for i in nx_graph.nodes():
             container = nx_graph.nodes[i]["data"]
-            if isinstance(container, howlitbe.topology.Container):
-                for n in nx.node_connected_component(nx_graph, hash(container.node)):
+            if isinstance(container, howlitbe.topology.Container) and hash(container) in attachments:
+                link_limits = self.limits.get_container_link_limits(container,
+                        node_bps.get(hash(container.node)))
+                for n in attachments[hash(container)]:
                     switch = nx_graph.nodes[n]["data"]
                     if not isinstance(switch, howlitbe.topology.Switch):
                         # We've got deployment relation, skip
                         continue
-                    tired.logging.debug("Adding link between container",
-                            container.get_string_id(),
-                            "and switch #",
-                            str(switch.get_id()))
-                    net.addLink(nodemap[hash(container)], nodemap[hash(switch)])
+                    plan.add_link(names[hash(container)], names[hash(switch)],
+                            source=(hash(container), hash(switch)), **link_limits)
+
+        return plan
+
+    def build_from_topology(self, topology: howlitbe.topology.Topology) -> Containernet:
+        # Initialize the network
+        net = (self.network_type or Containernet)(controller=Controller)
+        # Create one default controller w/ a predefined name
+        net.addController('c0')
+        self.plan = self.compile_plan(topology)
+        self.nodemap = dict()
+        self.timings = dict()
+        if HWL_DRY_RUN:
+            howlitbe.deployment.log_limits_report(self.plan)
+        howlitbe.deployment.apply_operations(net, self.plan.operations, self.nodemap,
+                n_workers=self.n_workers, timings=self.timings, link_type=TCLink,
+                docker_type=self.docker_type or Docker)
+        self._log_timings()
 
         return net
 
+    def start(self, net: Containernet):
+        with self._timed("start"):
+            net.start()
+
+    def redeploy(self, net: Containernet,
+                topology: howlitbe.topology.Topology) -> howlitbe.deployment.PlanDiff:
+        """
+        Brings a running network built by this builder to `topology`,
+        removing, and creating only the entities whose operations have
+        changed. Entities are matched by topology ids, so `topology` is
+        expected to be the deployed one, mutated, or restored from a snapshot
+        """
+        plan = self.compile_plan(topology)
+        diff = self.plan.diff(plan)
+        tired.logging.info(f"Redeploying: {len(diff.removed)} operations to undo, "
+                f"{len(diff.added)} to apply")
+        self.timings = dict()
+        howlitbe.deployment.apply_diff(net, diff, self.nodemap, n_workers=self.n_workers,
+                timings=self.timings, link_type=TCLink, docker_type=self.docker_type or Docker)
+        self._log_timings()
+        self.plan = plan
+
+        return diff
 
-def run_topology(topology: howlitbe.topology.Topology):
+
+def run_topology(topology: howlitbe.topology.Topology, n_workers: int = 1):
     """
     Translates a given topology into containernet topology
-    TODO: add limits (cpu, net, mem)
+    - n_workers: see `DeploymentBuilder`
     """
     import tired.ui
     if not tired.ui.envvar("HWL_NO_MININET", type_=bool, default=False):
-        net = DeploymentBuilder().build_from_topology(topology)
-        net.start()
+        builder = DeploymentBuilder(n_workers=n_workers)
+        net = builder.build_from_topology(topology)
+        builder.start(net)
 
 
 def log_network_summary(net: Containernet):
@@ -159,3 +332,173 @@ def test_run_topology():
             n_overlays=2,
             image_commands={"image 1": "echo wazzup, man"})
     howlitbe.containernet.run_topology(topology=topology)
+
+
+def test_parallel_deployment():
+    """
+    Concurrent bring-up creates the same entities, and is faster when
+    starting containers is slow. Containers are constructed directly, and
+    registered in the network one at a time
+    """
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=2,
+            n_gates=1,
+            n_nodes=4,
+            images_count={
+                "image 1": 16,
+            },
+            n_overlays=2,
+            image_commands={"image 1": "echo wazzup, man"})
+    slow_containernet = make_dry_run("Containernet", latency={"addDocker": 0.02})
+    builders = [DeploymentBuilder(n_workers=n_workers, network_type=slow_containernet,
+            docker_type=make_dry_run_docker(latency=0.02)) for n_workers in [1, 8]]
+    nets = [builder.build_from_topology(topology) for builder in builders]
+
+    calls = [[(name, tuple(map(repr, args)), kwargs) for name, args, kwargs in net.calls]
+            for net in nets]
+    dockers = {args[0]: kwargs for name, args, kwargs in nets[0].calls if name == "addDocker"}
+    assert len(dockers) == 16
+    assert [i for i in calls[0] if i[0] != "addDocker"] == calls[1]
+    # Containers may be registered in any order
+    assert {i.name: i.params for i in nets[1].hosts} == dockers
+    assert set(nets[1].nameToNode.keys()) == set(dockers.keys())
+    assert builders[1].timings["containers"] < builders[0].timings["containers"] / 2
+    assert set(builders[0].timings.keys()) == {"switches", "hosts", "containers", "links"}
+
+
+def test_container_links_match_per_container_search():
+    """ Links b/w containers, and switches are the same as if each container's component were searched separately """
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=3,
+            n_gates=1,
+            n_nodes=5,
+            images_count={
+                "image 1": 8,
+                "image 2": 4,
+            },
+            n_overlays=3,
+            image_commands={})
+    net = DeploymentBuilder().build_from_topology(topology)
+    links = [tuple(map(repr, args)) for name, args, _ in net.calls if name == "addLink"]
+
+    def _name(node):
+        if isinstance(node, howlitbe.topology.Switch):
+            return "s" + str(node.get_id())
+        elif isinstance(node, howlitbe.topology.Node):
+            return "h" + str(node.get_id())
+        return node.get_string_id()
+
+    nx_graph = topology.as_nxgraph()
+    expected = list()
+    for i in nx_graph.nodes():
+        container = nx_graph.nodes[i]["data"]
+        if isinstance(container, howlitbe.topology.Container):
+            for n in nx.node_connected_component(nx_graph, hash(container.node)):
+                switch = nx_graph.nodes[n]["data"]
+                if not isinstance(switch, howlitbe.topology.Switch):
+                    continue
+                expected.append((container.get_string_id(), _name(switch)))
+    assert links[len(links) - len(expected):] == expected
+
+
+def test_incremental_redeploy():
+    """ Only the changed entities get re-created, when a running network is brought to an updated topology """
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=2,
+            n_gates=1,
+            n_nodes=3,
+            images_count={
+                "image 1": 6,
+            },
+            n_overlays=2,
+            image_commands={})
+    builder = DeploymentBuilder()
+    net = builder.build_from_topology(topology)
+    builder.start(net)
+    n_calls = len(net.calls)
+    assert builder.redeploy(net, topology).is_empty()
+    assert len(net.calls) == n_calls
+
+    # Switch one container to another image, and deploy one more container
+    index = topology.get_index()
+    containers = [node for kind, node in zip(index.node_kind, index.node_objects)
+            if kind == howlitbe.topology.NODE_KIND_CONTAINER]
+    containers[0].name = "image 2"
+    new_container = howlitbe.topology.Container(containers[1].node, 1.0, 1.0, 1.0, "image 1", None)
+    topology.add_edge(new_container, new_container.node, howlitbe.topology.Deployment())
+    diff = builder.redeploy(net, topology)
+
+    calls = net.calls[n_calls:]
+    changed = {containers[0].get_string_id(), new_container.get_string_id()}
+    assert [args[0] for name, args, _ in calls if name == "removeDocker"] == [containers[0].get_string_id()]
+    assert {args[0] for name, args, _ in calls if name == "addDocker"} == changed
+    # Only the links of the affected containers are touched
+    for name, args, _ in calls:
+        if name in ["delLinkBetween", "addLink"]:
+            assert repr(args[0]) in changed
+    assert len([i for i in calls if i[0] == "delLinkBetween"]) > 0
+    assert len([i for i in calls if i[0] == "addLink"]) \
+            > len([i for i in calls if i[0] == "delLinkBetween"])
+    assert set(builder.nodemap.keys()) == {i.name for i in builder.plan.operations}
+    # Re-created containers get their address on the interfaces of the new links
+    addresses = builder.nodemap[new_container.get_string_id()].addresses
+    assert len(addresses) > 0
+    assert set(addresses.values()) == {(new_container.node.get_ip4_string(),
+            new_container.node.get_ip4_prefixlen())}
+    assert builder.plan.diff(builder.compile_plan(topology)).is_empty()
+    assert len(diff.added) == len([i for i in calls if i[0] in ["addDocker", "addLink"]])
+
+    # A detached container is stopped, w/ its links, and comes back on attach
+    n_calls = len(net.calls)
+    topology.detach_container(containers[2])
+    builder.redeploy(net, topology)
+    calls = net.calls[n_calls:]
+    assert [args[0] for name, args, _ in calls if name == "removeDocker"] == [containers[2].get_string_id()]
+    assert not any(name in ["addDocker", "addLink"] for name, _, _ in calls)
+    assert containers[2].get_string_id() not in builder.nodemap
+    topology.attach_container(containers[2])
+    builder.redeploy(net, topology)
+    assert containers[2].get_string_id() in builder.nodemap
+
+
+def test_resource_limits():
+    """ Fractions of the topology end up as absolute limits in the calls to Containernet """
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=2,
+            n_gates=1,
+            n_nodes=2,
+            images_count={
+                "image 1": 2,
+            },
+            n_overlays=2,
+            image_commands={})
+    index = topology.get_index()
+    containers = [node for kind, node in zip(index.node_kind, index.node_objects)
+            if kind == howlitbe.topology.NODE_KIND_CONTAINER]
+    containers[0].cpufrac = 0.25
+    containers[0].networkfrac = 0.5
+    containers[0].hddfrac = 0.1
+    limits = howlitbe.deployment.ResourceLimits(n_cpus=2, disk_bps=1e8)
+    builder = DeploymentBuilder(limits=limits)
+    net = builder.build_from_topology(topology)
+
+    dockers = {args[0]: kwargs for name, args, kwargs in net.calls if name == "addDocker"}
+    assert dockers[containers[0].get_string_id()]["cpu_quota"] == 50000
+    assert dockers[containers[0].get_string_id()]["cpu_period"] == 100000
+    assert dockers[containers[0].get_string_id()]["device_read_bps"] \
+            == [dict(Path="/dev/sda", Rate=10 ** 7)]
+    assert dockers[containers[1].get_string_id()]["cpu_quota"] == 100000 * 2
+
+    node_bps = sum(edge.bps for edge in index.edge_objects
+            if isinstance(edge, howlitbe.topology.PhysicalLink)
+            and containers[0].node in [edge.node1, edge.node2])
+    links = [(tuple(map(repr, args)), kwargs) for name, args, kwargs in net.calls if name == "addLink"]
+    assert all(kwargs["cls"] is TCLink for _, kwargs in links)
+    for (node1, _), kwargs in links:
+        if node1 == containers[0].get_string_id():
+            assert kwargs["bw"] == 0.5 * node_bps / 1e6
+    report = howlitbe.deployment.get_limits_report(builder.plan)
+    assert report[containers[0].get_string_id()]["cpu_quota"] == 50000
+    assert len(report) == len(builder.plan.operations) - len(index.node_objects) + len(containers)
+
+    # Limits are opt-in
+    plan = DeploymentBuilder().compile_plan(topology)
+    assert howlitbe.deployment.get_limits_report(plan) == dict()
+    docker_limits = howlitbe.deployment.ResourceLimits().get_docker_limits(containers[1])
+    assert docker_limits["cpu_quota"] == 100000 * os.cpu_count()
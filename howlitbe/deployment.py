@@ -0,0 +1,406 @@
+"""
+Deployment plans. A topology is first compiled into an ordered list of
+operations (switch, host, docker, link), which is then applied to a
+Mininet/Containernet network. Plans are serializable, and two plans can be
+diffed, so a running network can be brought from one plan to another by
+applying only the changed operations.
+"""
+
+import concurrent.futures
+import dataclasses
+import json
+import os
+import threading
+import time
+import tired.logging
+
+
+OPERATION_KINDS = ["switch", "host", "docker", "link"]
+""" In the order the entities must be created. Removal goes in reverse """
+
+OPERATION_PHASES = {
+    "switch": "switches",
+    "host": "hosts",
+    "docker": "containers",
+    "link": "links",
+}
+""" Names of deployment phases, as reported in timings """
+
+
+@dataclasses.dataclass
+class DeploymentOperation:
+    """
+    A single call to the network. For nodes, `name` is the name of the created
+    entity. For links, `name` is unique within a plan, and `endpoints` holds
+    the names of the nodes being connected. `source` is what the operation
+    has been compiled from: hash of a topology node, or a pair of node hashes
+    for a link
+    """
+
+    kind: str
+    name: str
+    endpoints: tuple = ()
+    kwargs: dict = dataclasses.field(default_factory=dict)
+    source: object = None
+
+    def key(self) -> tuple:
+        return self.kind, self.name
+
+    def to_dict(self) -> dict:
+        return dict(kind=self.kind, name=self.name, endpoints=list(self.endpoints),
+                kwargs=self.kwargs,
+                source=list(self.source) if isinstance(self.source, tuple) else self.source)
+
+    @staticmethod
+    def from_dict(data: dict) -> object:
+        source = data.get("source")
+        return DeploymentOperation(kind=data["kind"], name=data["name"],
+                endpoints=tuple(data["endpoints"]), kwargs=dict(data["kwargs"]),
+                source=tuple(source) if isinstance(source, list) else source)
+
+
+@dataclasses.dataclass
+class PlanDiff:
+    """
+    Operations to undo (in the order they must be undone), and operations to
+    apply, to bring a network from one plan to another
+    """
+
+    removed: list
+    added: list
+    addresses: dict = dataclasses.field(default_factory=dict)
+    """ {node name: (ip, prefix length)} of the target plan's hosts, and containers """
+
+    def is_empty(self) -> bool:
+        return len(self.removed) == 0 and len(self.added) == 0
+
+
+@dataclasses.dataclass
+class ResourceLimits:
+    """
+    Translates resource fractions of the topology into absolute limits
+    passed to Containernet: CPU quota/period (cgroup CFS), block IO
+    throttles, and `TCLink` bandwidth (tc rate limit) for links.
+
+    A container's network limit is set on the links b/w the container, and
+    switches. Fractions, and bandwidths set to None are not limited.
+    """
+
+    cpu_period: int = 100000
+    """ CFS period, [us] """
+    n_cpus: float = None
+    """ Number of CPUs `Container.cpufrac` is a fraction of. If None, all the CPUs of the machine """
+    network_bps: float = None
+    """ Bandwidth `Container.networkfrac` is a fraction of, [b/s]. If None, the total bandwidth of the container node's physical links is used """
+    disk_bps: float = None
+    """ Disk bandwidth `Container.hddfrac` is a fraction of, [B/s]. If None, disk IO is not throttled """
+    disk_device: str = "/dev/sda"
+
+    def get_docker_limits(self, container) -> dict:
+        """ Returns `addDocker` parameters """
+        ret = dict()
+        if container.cpufrac is not None:
+            n_cpus = os.cpu_count() if self.n_cpus is None else self.n_cpus
+            ret["cpu_period"] = self.cpu_period
+            ret["cpu_quota"] = max(1000, int(round(container.cpufrac * n_cpus * self.cpu_period)))
+        if container.hddfrac is not None and self.disk_bps is not None:
+            rate = [dict(Path=self.disk_device, Rate=int(container.hddfrac * self.disk_bps))]
+            ret["device_read_bps"] = rate
+            ret["device_write_bps"] = rate
+        return ret
+
+    def get_container_link_limits(self, container, node_bps: float) -> dict:
+        """
+        Returns `addLink` parameters for a link b/w the container, and a switch
+        - node_bps: total bandwidth of the container node's physical links
+        """
+        bps = node_bps if self.network_bps is None else self.network_bps
+        if container.networkfrac is None or bps is None:
+            return dict()
+        return self.get_link_limits(container.networkfrac * bps)
+
+    @staticmethod
+    def get_link_limits(bps: float) -> dict:
+        """ Returns `addLink` parameters. `TCLink` takes bandwidth in Mb/s """
+        if bps is None:
+            return dict()
+        return dict(bw=bps / 1e6)
+
+
+class NoResourceLimits(ResourceLimits):
+    """ Leaves containers, and links unlimited """
+
+    def get_docker_limits(self, container) -> dict:
+        return dict()
+
+    def get_container_link_limits(self, container, node_bps: float) -> dict:
+        return dict()
+
+    @staticmethod
+    def get_link_limits(bps: float) -> dict:
+        return dict()
+
+
+LIMIT_PARAMETERS = ["cpu_period", "cpu_quota", "device_read_bps", "device_write_bps", "bw"]
+
+
+def get_limits_report(plan) -> dict:
+    """ Returns {operation name: {parameter: value}} for the operations w/ limits """
+    report = dict()
+    for operation in plan.operations:
+        limits = {k: operation.kwargs[k] for k in LIMIT_PARAMETERS if k in operation.kwargs}
+        if len(limits) > 0:
+            report[operation.name] = limits
+    return report
+
+
+def log_limits_report(plan):
+    for name, limits in get_limits_report(plan).items():
+        tired.logging.info("Limits of", name + ":", ", ".join(f"{k}={v}" for k, v in limits.items()))
+
+
+class DeploymentPlan:
+    """ Ordered list of `DeploymentOperation` """
+
+    def __init__(self, operations: list = None):
+        self.operations: list[DeploymentOperation] = list() if operations is None else operations
+        self._node_names = set()
+        self._link_counter = dict()
+        for operation in self.operations:
+            if operation.kind == "link":
+                n = int(operation.name.rsplit("#", 1)[1])
+                self._link_counter[operation.endpoints] = max(n + 1,
+                        self._link_counter.get(operation.endpoints, 0))
+            else:
+                self._node_names.add(operation.name)
+
+    def _add_node(self, kind: str, name: str, source: int, kwargs: dict):
+        # Mininet identifies nodes by name, a duplicate would be created twice
+        if name in self._node_names:
+            raise ValueError(f"Duplicate node name \"{name}\" ({kind})")
+        self._node_names.add(name)
+        self.operations.append(DeploymentOperation(kind, name, (), kwargs, source))
+
+    def add_switch(self, name: str, source: int = None, **kwargs):
+        self._add_node("switch", name, source, kwargs)
+
+    def add_host(self, name: str, source: int = None, **kwargs):
+        self._add_node("host", name, source, kwargs)
+
+    def add_docker(self, name: str, source: int = None, **kwargs):
+        self._add_node("docker", name, source, kwargs)
+
+    def add_link(self, node1: str, node2: str, source: tuple = None, **kwargs):
+        # The same pair may be linked more than once
+        n = self._link_counter.get((node1, node2), 0)
+        self._link_counter[(node1, node2)] = n + 1
+        self.operations.append(DeploymentOperation("link", f"{node1}--{node2}#{n}",
+                (node1, node2), kwargs, source))
+
+    def get_addresses(self) -> dict:
+        """ Returns {node name: (ip, prefix length)} for the hosts, and containers w/ an IP """
+        return {i.name: (i.kwargs["ip"], i.kwargs.get("prefixLen", 8)) for i in self.operations
+                if i.kind in ["host", "docker"] and i.kwargs.get("ip") is not None}
+
+    def get_sources(self, kind: str) -> dict:
+        """ Returns {source: operation name} for operations of the kind """
+        return {i.source: i.name for i in self.operations if i.kind == kind and i.source is not None}
+
+    def to_json(self) -> str:
+        return json.dumps([i.to_dict() for i in self.operations])
+
+    @staticmethod
+    def from_json(data: str) -> object:
+        return DeploymentPlan([DeploymentOperation.from_dict(i) for i in json.loads(data)])
+
+    def diff(self, target) -> PlanDiff:
+        """
+        Computes operations required to bring a network deployed w/ this plan
+        to `target`. A node whose operation has changed is re-created, and so
+        are all the links attached to it
+        """
+        current = {i.key(): i for i in self.operations}
+        wanted = {i.key(): i for i in target.operations}
+        recreated_nodes = {i.name for i in self.operations if i.kind != "link"
+                and i.key() in wanted and wanted[i.key()] != i}
+        removed_nodes = {i.name for i in self.operations if i.kind != "link"
+                and i.key() not in wanted}
+
+        def _is_stale(operation, other):
+            return operation.key() not in other or other[operation.key()] != operation \
+                    or (operation.kind == "link"
+                    and len(set(operation.endpoints) & (recreated_nodes | removed_nodes)) > 0)
+
+        removed = [i for i in self.operations if _is_stale(i, wanted)]
+        removed.sort(key=lambda i: -OPERATION_KINDS.index(i.kind))
+        added = [i for i in target.operations if _is_stale(i, current)]
+        return PlanDiff(removed=removed, added=added, addresses=target.get_addresses())
+
+
+def _apply_operation(net, operation: DeploymentOperation, nodemap: dict, link_type: type = None):
+    if operation.kind == "switch":
+        tired.logging.debug(f"Built switch {operation.name}")
+        return net.addSwitch(operation.name, **operation.kwargs)
+    elif operation.kind == "host":
+        tired.logging.debug("Adding host", operation.name, str(operation.kwargs.get("ip")))
+        return net.addHost(operation.name, **operation.kwargs)
+    elif operation.kind == "docker":
+        tired.logging.debug("Adding docker", operation.name, "ip", str(operation.kwargs.get("ip")),
+                "application", str(operation.kwargs.get("dimage")))
+        return net.addDocker(operation.name, **operation.kwargs)
+    elif operation.kind == "link":
+        tired.logging.debug("Adding link between", *operation.endpoints)
+        node1, node2 = operation.endpoints
+        if "bw" in operation.kwargs and link_type is not None:
+            # Bandwidth is only enforced by traffic-controlled links
+            return net.addLink(nodemap[node1], nodemap[node2], cls=link_type, **operation.kwargs)
+        return net.addLink(nodemap[node1], nodemap[node2], **operation.kwargs)
+    raise ValueError(f"Unsupported operation kind {operation.kind}")
+
+
+def _attach_to_running_network(net, operation: DeploymentOperation, entity, addresses: dict):
+    """
+    Entities added to a started network must be started, or attached
+    explicitly. Addresses are only configured by `start`, so interfaces of
+    links added later get them assigned here
+    """
+    if operation.kind == "switch" and hasattr(entity, "start"):
+        entity.start(getattr(net, "controllers", []))
+    elif operation.kind == "link":
+        for intf in [getattr(entity, "intf1", None), getattr(entity, "intf2", None)]:
+            if intf is None:
+                continue
+            if hasattr(intf.node, "attach"):
+                intf.node.attach(intf)
+            if intf.node.name in addresses:
+                ip, prefix_length = addresses[intf.node.name]
+                intf.node.setIP(ip, prefix_length, intf=intf)
+
+
+def _create_docker(net, operation: DeploymentOperation, docker_type: type,
+            lock: threading.Lock):
+    """
+    Concurrent counterpart of `net.addDocker`. Only the construction of the
+    node, which starts the container, runs concurrently. Registration in the
+    network (what `Mininet.addHost` does after constructing a node) is
+    serialized, as Mininet's bookkeeping is not thread-safe. W/o
+    `docker_type`, `addDocker` calls are serialized as a whole
+    """
+    if docker_type is None:
+        with lock:
+            return _apply_operation(net, operation, dict())
+    tired.logging.debug("Adding docker", operation.name, "ip", str(operation.kwargs.get("ip")),
+            "application", str(operation.kwargs.get("dimage")))
+    node = docker_type(operation.name, **operation.kwargs)
+    with lock:
+        net.hosts.append(node)
+        net.nameToNode[operation.name] = node
+    return node
+
+
+def apply_operations(net, operations: list, nodemap: dict, n_workers: int = 1,
+            timings: dict = None, running: bool = False, link_type: type = None,
+            addresses: dict = None, docker_type: type = None):
+    """
+    Applies operations in the given order. Created entities are stored into
+    `nodemap` under the operations' names.
+
+    - n_workers: consecutive docker operations are applied concurrently on a
+      thread pool of this size, see `_create_docker`
+    - timings: if provided, time spent on each phase is accumulated in it
+    - running: whether the network has already been started
+    - link_type: link class (e.g. `TCLink`) for links w/ bandwidth limits
+    - addresses: {node name: (ip, prefix length)}, see `PlanDiff.addresses`.
+      Assigned to the interfaces of the links added to a running network
+    - docker_type: node class (e.g. `mininet.node.Docker`) containers are
+      constructed w/ when created concurrently
+    """
+    if addresses is None:
+        addresses = dict()
+    lock = threading.Lock()
+    i = 0
+    while i < len(operations):
+        kind = operations[i].kind
+        # Take the whole run of operations of the same kind
+        j = i
+        while j < len(operations) and operations[j].kind == kind:
+            j += 1
+        batch = operations[i:j]
+        t0 = time.perf_counter()
+        if kind == "docker" and n_workers > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+                entities = list(executor.map(lambda o: _create_docker(net, o, docker_type, lock),
+                        batch))
+        else:
+            entities = [_apply_operation(net, o, nodemap, link_type) for o in batch]
+        for operation, entity in zip(batch, entities):
+            nodemap[operation.name] = entity
+            if running:
+                _attach_to_running_network(net, operation, entity, addresses)
+        if timings is not None:
+            phase = OPERATION_PHASES[kind]
+            timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - t0
+        i = j
+
+
+def remove_operations(net, operations: list, nodemap: dict):
+    """
+    Undoes operations (in the given order), removing the entities they have
+    created from the network, and from `nodemap`
+    """
+    for operation in operations:
+        entity = nodemap.pop(operation.name)
+        tired.logging.debug("Removing", operation.kind, operation.name)
+        if operation.kind == "link":
+            node1, node2 = operation.endpoints
+            net.delLinkBetween(nodemap[node1], nodemap[node2])
+        elif operation.kind == "docker":
+            net.removeDocker(operation.name)
+        elif operation.kind == "host":
+            net.delHost(entity)
+        elif operation.kind == "switch":
+            net.delSwitch(entity)
+        else:
+            raise ValueError(f"Unsupported operation kind {operation.kind}")
+
+
+def apply_diff(net, diff: PlanDiff, nodemap: dict, n_workers: int = 1,
+            timings: dict = None, link_type: type = None, docker_type: type = None):
+    """ Brings a running network from one plan to another, see `DeploymentPlan.diff` """
+    remove_operations(net, diff.removed, nodemap)
+    apply_operations(net, diff.added, nodemap, n_workers=n_workers, timings=timings,
+            running=True, link_type=link_type, addresses=diff.addresses, docker_type=docker_type)
+
+
+def test_plan_diff():
+    old = DeploymentPlan()
+    old.add_switch("s0")
+    old.add_host("h0", ip="10.0.0.1")
+    old.add_docker("d0", ip="10.0.0.1", dimage="a")
+    old.add_docker("d1", ip="10.0.0.1", dimage="a")
+    old.add_link("h0", "s0")
+    old.add_link("d0", "s0")
+    old.add_link("d1", "s0")
+    new = DeploymentPlan.from_json(old.to_json())
+    assert new.diff(old).is_empty()
+    new.operations[3].kwargs["dimage"] = "b"  # d1 changes the image
+    new.add_docker("d2", ip="10.0.0.1", dimage="a")
+    new.add_link("d2", "s0")
+    del new.operations[2]  # d0 is gone
+    del new.operations[4]  # So is its link
+
+    diff = old.diff(new)
+    assert [i.name for i in diff.removed] == ["d0--s0#0", "d1--s0#0", "d0", "d1"]
+    assert [i.name for i in diff.added] == ["d1", "d1--s0#0", "d2", "d2--s0#0"]
+
+    # Names continue from the loaded links
+    new.add_link("d2", "s0")
+    assert new.operations[-1].name == "d2--s0#1"
+    loaded = DeploymentPlan.from_json(new.to_json())
+    loaded.add_link("d2", "s0")
+    assert loaded.operations[-1].name == "d2--s0#2"
+    try:
+        loaded.add_docker("d2", ip="10.0.0.1", dimage="a")
+        assert False
+    except ValueError:
+        pass
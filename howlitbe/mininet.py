@@ -7,28 +7,95 @@ one w/ docker. Please refer to 'tools/mininet-postinstall.sh'
 """
 
 
+import concurrent.futures
+import dataclasses
+import howlitbe.deployment
 import howlitbe.mininet
 import howlitbe.topology
 import os
+import threading
+import time
+import tired.command
 import tired.logging
+import uuid
 import networkx as nx
 
 # If containernet is not installed (development environment), dry run
 
-def make_dry_run(classname: str):
-    def mock_function(self, *args, **kwargs):
-        return self
+class _DryRunNode:
+    """ Mock of a network node (host, switch, docker), as returned by the dry-run network """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.n_interfaces = 0
+        self.addresses = dict()
+        """ {interface name: (ip, prefix length)} set w/ `setIP` """
+
+    def __repr__(self):
+        return self.name
+
+    def cmd(self, *args, **kwargs):
+        return ""
+
+    def setIP(self, ip: str, prefixLen: int = 8, intf=None):
+        self.addresses[None if intf is None else intf.name] = (ip, prefixLen)
+
+
+class _DryRunIntf:
+
+    def __init__(self, node: _DryRunNode):
+        self.node = node
+        self.name = f"{node.name}-eth{node.n_interfaces}"
+        node.n_interfaces += 1
+
+
+class _DryRunLink:
+    """ Mock of a link, as returned by the dry-run network """
+
+    def __init__(self, node1: _DryRunNode, node2: _DryRunNode):
+        self.intf1 = _DryRunIntf(node1)
+        self.intf2 = _DryRunIntf(node2)
+
+
+def make_dry_run(classname: str, latency: dict = None):
+    """
+    Makes a mock class. Instances record the calls they receive into `calls`,
+    node-creating calls return node mocks named after the first argument.
+    - latency: {method name: seconds}. Delay injected into the calls, e.g. to
+      measure the effect of concurrent deployment w/o Containernet installed
+    """
+    if latency is None:
+        latency = dict()
+
+    def make_mock_function(method_name: str, returns: type = None):
+        def mock_function(self, *args, **kwargs):
+            time.sleep(latency.get(method_name, 0.0))
+            with self.lock:
+                self.calls.append((method_name, args, kwargs))
+            if returns is _DryRunNode:
+                return _DryRunNode(args[0])
+            elif returns is _DryRunLink and all(isinstance(i, _DryRunNode) for i in args[:2]):
+                return _DryRunLink(args[0], args[1])
+            return self
+        return mock_function
 
     class _DryRun:
         def __init__(self, *args, **kwargs):
-            pass
+            self.calls = list()
+            self.lock = threading.Lock()
+            self.hosts = list()
+            self.nameToNode = dict()
 
-        addDocker = mock_function
-        addHost = mock_function
-        addSwitch = mock_function
-        addController = mock_function
-        start = mock_function
-        addLink = mock_function
+        addDocker = make_mock_function("addDocker", _DryRunNode)
+        addHost = make_mock_function("addHost", _DryRunNode)
+        addSwitch = make_mock_function("addSwitch", _DryRunNode)
+        addController = make_mock_function("addController", _DryRunNode)
+        start = make_mock_function("start")
+        addLink = make_mock_function("addLink", _DryRunLink)
+        delLinkBetween = make_mock_function("delLinkBetween")
+        removeDocker = make_mock_function("removeDocker")
+        delHost = make_mock_function("delHost")
+        delSwitch = make_mock_function("delSwitch")
 
     ret = _DryRun
     ret.__name__ = classname
@@ -57,77 +124,112 @@ except ModuleNotFoundError as e:
 
 
 class DeploymentBuilder:
-    """ Builds Containernet object from a given topology """
+    """
+    Builds Containernet object from a given topology. The topology is
+    compiled into a `howlitbe.deployment.DeploymentPlan` first, the builder
+    keeps the deployed plan, so the running network can later be brought to
+    an updated topology w/ `redeploy`
+    """
 
-    def build_from_topology(self, topology: howlitbe.topology.Topology):
-        # Initialize the network
-        net = Mininet(controller=Controller)
-        # Create one default controller w/ a predefined name
-        net.addController('c0')
-        nodemap = dict()  # A temporary index for addressing the created mininet/containernet entities later
+    def __init__(self, limits: howlitbe.deployment.ResourceLimits = None):
+        """
+        - limits: how resource fractions of the topology translate into
+          absolute limits. If None, containers, and links are not limited
+        """
+        self.limits = limits or howlitbe.deployment.NoResourceLimits()
+        self.plan = None
+        """ Plan the network has been deployed w/ """
+        self.nodemap = dict()
+        """ {operation name: created mininet/containernet entity} """
+
+    def compile_plan(self, topology: howlitbe.topology.Topology) -> howlitbe.deployment.DeploymentPlan:
+        """
+        Translates the topology into an ordered list of operations. Entities
+        are named after topology ids, so unchanged parts of a topology compile
+        into identical operations. Resource limits are part of the operations
+        """
+        plan = howlitbe.deployment.DeploymentPlan()
+        names = dict()  # {node hash: name of the entity}
+        node_bps = dict()  # {node hash: total bandwidth of the node's physical links}
         # Spawn nodes and switches
         nx_graph = topology.as_nxgraph()
-        for i in nx_graph.nodes():
-            node = nx_graph.nodes[i]["data"]
-            if isinstance(node, howlitbe.topology.Switch):
-                switch_name = "s" + str(node.get_id())
-                # TODO: Limits
-                s = net.addSwitch(switch_name)
-                tired.logging.debug(f"Built switch {switch_name}")
-                nodemap[hash(node)] = s
-            elif isinstance(node, howlitbe.topology.Node):
+        index = topology.get_index()
+        attachments = topology.get_container_attachments()  # Detached containers are not deployed
+        for kind, node in zip(index.node_kind, index.node_objects):
+            if kind in (howlitbe.topology.NODE_KIND_SWITCH, howlitbe.topology.NODE_KIND_GATE):
+                names[hash(node)] = "s" + str(node.get_id())
+                plan.add_switch(names[hash(node)], source=hash(node))
+            elif kind == howlitbe.topology.NODE_KIND_NODE:
                 # TODO: do we really need nodes for that? It might be so docker automatically create a host
-                host_name = "h" + str(node.get_id())
-                # TODO: Limits
-                tired.logging.debug("Adding host", host_name, node.get_ip4_string())
-                n = net.addHost(host_name,
+                names[hash(node)] = "h" + str(node.get_id())
+                plan.add_host(names[hash(node)],
+                        source=hash(node),
                         ip=node.get_ip4_string(),
                         prefixLen=node.get_ip4_prefixlen())
-                nodemap[hash(node)] = n
-            elif isinstance(node, howlitbe.topology.Container):
-                container_name = "d" + str(node.get_id())
-                # TODO: Limits
-                tired.logging.debug("Adding docker", container_name, "on node",
-                        str(node.node.get_id()), "ip", node.node.get_ip4_string(),
-                        "application", node.name)
-                n = net.addDocker(node.get_string_id(),
+            elif kind == howlitbe.topology.NODE_KIND_CONTAINER and hash(node) in attachments:
+                names[hash(node)] = node.get_string_id()
+                plan.add_docker(names[hash(node)],
+                        source=hash(node),
                         ip=node.node.get_ip4_string(),
                         dcmd=node.command if node.command else None,
                         dimage=f"{node.name}",
-                        prefixLen=node.node.get_ip4_prefixlen())
-                nodemap[hash(node)] = n
+                        prefixLen=node.node.get_ip4_prefixlen(),
+                        **self.limits.get_docker_limits(node))
         # Add links b/w the components of the network
-        for e in nx_graph.edges():
-            edge = nx_graph.edges[e]["relationship"]
+        for edge in index.edge_objects:
             if isinstance(edge, howlitbe.topology.PhysicalLink):
-                node1 = edge.node1
-                node2 = edge.node2
-                tired.logging.debug("Creating physical link between", node1.get_summary(), "and", node2.get_summary())
-                netlink = net.addLink(nodemap[hash(node1)], nodemap[hash(node2)])
-                nodemap[hash(edge)] = netlink  # JIC
+                plan.add_link(names[hash(edge.node1)], names[hash(edge.node2)],
+                        source=(hash(edge.node1), hash(edge.node2)),
+                        **self.limits.get_link_limits(edge.bps))
+                for node in [edge.node1, edge.node2]:
+                    node_bps[hash(node)] = node_bps.get(hash(node), 0) + edge.bps
         # Add links b/w docker containers, and switches
         # Get a list of connected switches
         for i in nx_graph.nodes():
             container = nx_graph.nodes[i]["data"]
-            if isinstance(container, howlitbe.topology.Container):
-                for n in nx.node_connected_component(nx_graph, hash(container.node)):
+            if isinstance(container, howlitbe.topology.Container) and hash(container) in attachments:
+                link_limits = self.limits.get_container_link_limits(container,
+                        node_bps.get(hash(container.node)))
+                for n in attachments[hash(container)]:
                     switch = nx_graph.nodes[n]["data"]
                     if isinstance(switch, howlitbe.topology.Switch):
                         # We've got deployment relation, skip
                         continue
-                    tired.logging.debug("Adding link between container",
-                            container.get_string_id(),
-                            "and switch #",
-                            str(switch.get_id()))
-                    net.addLink(nodemap[hash(container)], nodemap[hash(switch)])
+                    plan.add_link(names[hash(container)], names[hash(switch)],
+                            source=(hash(container), hash(switch)), **link_limits)
+
+        return plan
+
+    def build_from_topology(self, topology: howlitbe.topology.Topology):
+        # Initialize the network
+        net = Mininet(controller=Controller)
+        # Create one default controller w/ a predefined name
+        net.addController('c0')
+        self.plan = self.compile_plan(topology)
+        self.nodemap = dict()
+        if HWL_DRY_RUN:
+            howlitbe.deployment.log_limits_report(self.plan)
+        howlitbe.deployment.apply_operations(net, self.plan.operations, self.nodemap,
+                link_type=TCLink)
 
         return net
 
+    def redeploy(self, net, topology: howlitbe.topology.Topology) -> howlitbe.deployment.PlanDiff:
+        """
+        Brings a running network built by this builder to `topology`, see
+        `howlitbe.containernet.DeploymentBuilder.redeploy`
+        """
+        plan = self.compile_plan(topology)
+        diff = self.plan.diff(plan)
+        howlitbe.deployment.apply_diff(net, diff, self.nodemap, link_type=TCLink)
+        self.plan = plan
+
+        return diff
+
 
 def run_topology(topology: howlitbe.topology.Topology):
     """
     Translates a given topology into containernet topology
-    TODO: add limits (cpu, net, mem)
     """
     net = DeploymentBuilder().build_from_topology(topology)
     net.start()
@@ -148,6 +250,232 @@ def log_network_summary(net):
                     ', '.join(map(lambda i: f"{i.name} ({i.ip})", interfaces)))
 
 
+def _wait_until(predicate: callable, timeout: float, initial_delay: float = 0.05,
+            max_delay: float = 1.0) -> float:
+    """
+    Polls `predicate` w/ exponentially growing delays b/w attempts. Returns
+    time (s) it took for the predicate to become true, raises `TimeoutError`
+    after `timeout` seconds
+    """
+    t0 = time.perf_counter()
+    delay = initial_delay
+    while not predicate():
+        elapsed = time.perf_counter() - t0
+        if elapsed >= timeout:
+            raise TimeoutError(f"Condition has not been met in {timeout} s")
+        time.sleep(min(delay, timeout - elapsed))
+        delay = min(delay * 2, max_delay)
+    return time.perf_counter() - t0
+
+
+def get_topology_images(topology: howlitbe.topology.Topology) -> list[str]:
+    """ Returns distinct names of the images deployed in the topology """
+    index = topology.get_index()
+    images = dict()  # Ordered set
+    for kind, node in zip(index.node_kind, index.node_objects):
+        if kind == howlitbe.topology.NODE_KIND_CONTAINER:
+            images[node.name] = None
+    return list(images.keys())
+
+
+class ImageCache:
+    """
+    Directory of `docker save` archives. Each archive is named after the
+    content digest of the image, so an image is saved once, and re-saved
+    only when it gets rebuilt
+    """
+
+    def __init__(self, directory: str = "/tmp/dockerimages", execute: callable = None):
+        """
+        - execute: runs a shell command on the machine the images are built
+          on, returns its output. Defaults to `tired.command.get_output`
+        """
+        self.directory = directory
+        self.execute = execute or tired.command.get_output
+
+    def get_digest(self, image: str) -> str:
+        return self.execute(f"docker image inspect --format {{{{.Id}}}} {image}").strip()
+
+    def get_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest.replace(":", "-") + ".tar")
+
+    def save(self, image: str, *aliases) -> tuple:
+        """
+        Saves the image, unless an archive w/ the same digest is already
+        cached. Returns (digest, path to the archive)
+        - aliases: other names of the same image, saved into the same archive
+        """
+        digest = self.get_digest(image)
+        path = self.get_path(digest)
+        if os.path.exists(path):
+            tired.logging.debug("Image", image, "is cached as", path)
+            return digest, path
+        tired.logging.info("Saving image", image, "to", path)
+        os.makedirs(self.directory, exist_ok=True)
+        # Save under a temporary name, so an interrupted save does not end up
+        # in the cache. The name is unique, so concurrent saves do not clash
+        partial_path = f"{path}.{uuid.uuid4().hex}.partial"
+        self.execute(" ".join(["docker", "save", "-o", partial_path, image, *aliases]))
+        os.replace(partial_path, path)
+        return digest, path
+
+
+class ImageStager:
+    """
+    Delivers the images of a topology to the docker daemons running on
+    mininet hosts. Each distinct image is saved once (see `ImageCache`), and
+    then loaded into the hosts' daemons concurrently. A daemon is waited for
+    to get ready, and the images it already has are skipped.
+    """
+
+    def __init__(self, cache: ImageCache = None, n_workers: int = 8,
+                host_directory: str = None, readiness_timeout: float = 30.0):
+        """
+        - host_directory: where the cache directory is mounted on the hosts.
+          If None, the hosts are expected to see it under the same path
+        - readiness_timeout: time (s) to wait for a host's daemon to respond
+        """
+        self.cache = cache or ImageCache()
+        self.n_workers = n_workers
+        self.host_directory = host_directory
+        self.readiness_timeout = readiness_timeout
+
+    def stage(self, topology: howlitbe.topology.Topology) -> dict:
+        """ Saves the topology's images. Returns {image: (digest, path to the archive)} """
+        return self.stage_images(get_topology_images(topology))
+
+    def stage_images(self, images: list) -> dict:
+        """ Same as `stage`, for an explicit list of images """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            # Images sharing a digest (aliases) are saved once
+            groups = dict()  # {digest: [images]}
+            for image, digest in zip(images, executor.map(self.cache.get_digest, images)):
+                groups.setdefault(digest, list()).append(image)
+            archives = executor.map(lambda group: self.cache.save(*group), groups.values())
+            return {image: archive for group, archive in zip(groups.values(), archives)
+                    for image in group}
+
+    @staticmethod
+    def _is_daemon_ready(host) -> bool:
+        return host.cmd("docker info > /dev/null 2>&1; echo $?").strip() == "0"
+
+    def _load_host(self, host, archives: dict) -> int:
+        _wait_until(lambda: self._is_daemon_ready(host), self.readiness_timeout)
+        n_loaded = 0
+        for image, (digest, path) in archives.items():
+            present = host.cmd(f"docker image inspect --format {{{{.Id}}}} {image} 2> /dev/null").strip()
+            if present == digest:
+                continue
+            if self.host_directory is not None:
+                path = os.path.join(self.host_directory, os.path.basename(path))
+            tired.logging.debug("Loading image", image, "on host", host.name)
+            output = host.cmd(f"docker load -i {path} 2>&1; echo $?").strip().split("\n")
+            if output[-1].strip() != "0":
+                raise RuntimeError(f"Unable to load image {image} from {path} on host {host.name}: "
+                        + "\n".join(output[:-1]))
+            n_loaded += 1
+        return n_loaded
+
+    def load(self, hosts: list, archives: dict) -> dict:
+        """
+        Loads images staged by `stage` into the hosts' daemons. Returns
+        {host name: number of images loaded}
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            loaded = list(executor.map(lambda host: self._load_host(host, archives), hosts))
+        return {host.name: n for host, n in zip(hosts, loaded)}
+
+
+@dataclasses.dataclass
+class DaemonSpec:
+    """
+    A daemon to run on a mininet host. `command`, and `socket` may contain
+    "{host}", which is replaced w/ the name of the host
+    """
+
+    name: str
+    command: str
+    socket: str
+    """ UNIX socket the daemon opens when it is ready to serve """
+
+
+DOCKER_DAEMONS = [
+    DaemonSpec("containerd",
+            "containerd --log-level debug --address /var/run/containerd/containerd.sock",
+            "/var/run/containerd/containerd.sock"),
+    DaemonSpec("dockerd",
+            "dockerd --log-level debug --containerd /var/run/containerd/containerd.sock",
+            "/var/run/docker.sock"),
+]
+"""
+Docker-in-host daemons. Sockets are kept under /var, which is expected to be
+bind-mounted per host, so the daemons of different hosts do not clash
+"""
+
+
+class HostBootstrap:
+    """
+    Starts daemons on mininet hosts. Hosts are bootstrapped concurrently. On
+    each host, the daemons are started in order, and each one is waited for
+    to open its socket (polling w/ exponential backoff) before the next one
+    gets started. Per-host startup latencies are stored in `latencies`.
+    """
+
+    def __init__(self, daemons: list = DOCKER_DAEMONS, n_workers: int = 16,
+                timeout: float = 30.0, initial_delay: float = 0.05, max_delay: float = 1.0,
+                log_directory: str = "/tmp"):
+        """
+        - timeout: time (s) a daemon is given to open its socket
+        - initial_delay, max_delay: bounds of the delay (s) b/w readiness checks
+        - log_directory: where daemons' output is redirected to
+        """
+        self.daemons = daemons
+        self.n_workers = n_workers
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.log_directory = log_directory
+        self.latencies = dict()
+        """ {host name: {daemon name: seconds it took the daemon to get ready}} """
+
+    @staticmethod
+    def _is_socket_ready(host, socket: str) -> bool:
+        # The check is run on the host, as its filesystem view may differ
+        return host.cmd(f"test -S {socket}; echo $?").strip() == "0"
+
+    def _bootstrap_host(self, host) -> dict:
+        latencies = dict()
+        for daemon in self.daemons:
+            socket = daemon.socket.format(host=host.name)
+            log = os.path.join(self.log_directory, f"mininet-{daemon.name}-{host.name}.log")
+            # A stale socket would pass the readiness check right away
+            host.cmd(f"rm -f {socket}")
+            tired.logging.debug("Launching", daemon.name, "on", host.name)
+            t0 = time.perf_counter()
+            host.cmd(f"{daemon.command.format(host=host.name)} < /dev/null > {log} 2>&1 &")
+            try:
+                _wait_until(lambda: self._is_socket_ready(host, socket), self.timeout,
+                        self.initial_delay, self.max_delay)
+            except TimeoutError:
+                raise TimeoutError(f"{daemon.name} on host {host.name} has not opened {socket} "
+                        f"in {self.timeout} s, see {log}")
+            latencies[daemon.name] = time.perf_counter() - t0
+            tired.logging.debug(daemon.name, "on", host.name,
+                    f"got ready in {latencies[daemon.name]:.3f} s")
+        return latencies
+
+    def bootstrap(self, hosts: list) -> dict:
+        """ Starts the daemons on the hosts. Returns `latencies` """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            latencies = list(executor.map(self._bootstrap_host, hosts))
+        self.latencies = {host.name: i for host, i in zip(hosts, latencies)}
+        if len(hosts) > 0:
+            slowest = max(self.latencies, key=lambda i: sum(self.latencies[i].values()))
+            tired.logging.info(f"Bootstrapped {len(hosts)} hosts, the slowest one is {slowest}: "
+                    f"{sum(self.latencies[slowest].values()):.3f} s")
+        return self.latencies
+
+
 def test_run_topology():
     topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=1,
             n_gates=1,
@@ -158,3 +486,178 @@ def test_run_topology():
             n_overlays=2,
             image_commands={"image 1": "echo wazzup, man"})
     howlitbe.mininet.run_topology(topology=topology)
+
+
+def test_container_links_match_per_container_search():
+    """ Links b/w containers, and switches are the same as if each container's component were searched separately """
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=3,
+            n_gates=1,
+            n_nodes=5,
+            images_count={
+                "image 1": 8,
+                "image 2": 4,
+            },
+            n_overlays=3,
+            image_commands={})
+    net = DeploymentBuilder().build_from_topology(topology)
+    links = [tuple(map(repr, args)) for name, args, _ in net.calls if name == "addLink"]
+
+    def _name(node):
+        if isinstance(node, howlitbe.topology.Switch):
+            return "s" + str(node.get_id())
+        elif isinstance(node, howlitbe.topology.Node):
+            return "h" + str(node.get_id())
+        return node.get_string_id()
+
+    nx_graph = topology.as_nxgraph()
+    expected = list()
+    for i in nx_graph.nodes():
+        container = nx_graph.nodes[i]["data"]
+        if isinstance(container, howlitbe.topology.Container):
+            for n in nx.node_connected_component(nx_graph, hash(container.node)):
+                switch = nx_graph.nodes[n]["data"]
+                if isinstance(switch, howlitbe.topology.Switch):
+                    continue
+                expected.append((container.get_string_id(), _name(switch)))
+    assert links[len(links) - len(expected):] == expected
+
+
+def test_plan_matches_deployed_network():
+    """ The network gets exactly the operations of the compiled plan, and a no-op redeploy issues no calls """
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=2,
+            n_gates=1,
+            n_nodes=3,
+            images_count={
+                "image 1": 4,
+            },
+            n_overlays=2,
+            image_commands={})
+    builder = DeploymentBuilder()
+    net = builder.build_from_topology(topology)
+    kinds = {"addSwitch": "switch", "addHost": "host", "addDocker": "docker", "addLink": "link"}
+    calls = [(kinds[name], tuple(map(str, args))) for name, args, _ in net.calls if name in kinds]
+    expected = [(i.kind, i.endpoints if i.kind == "link" else (i.name,)) for i in builder.plan.operations]
+    assert calls == expected
+    n_calls = len(net.calls)
+    assert builder.redeploy(net, topology).is_empty()
+    assert len(net.calls) == n_calls
+
+
+def test_image_staging():
+    """ Each distinct image is saved once, and loaded into each host's daemon once """
+    import tempfile
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=1,
+            n_gates=1,
+            n_nodes=3,
+            images_count={
+                "image_1": 4,
+                "image_2": 2,
+            },
+            n_overlays=2,
+            image_commands={})
+    saved = list()
+
+    def execute(command):
+        args = command.split()
+        if args[:3] == ["docker", "image", "inspect"]:
+            return "sha256:" + args[-1]
+        assert args[:3] == ["docker", "save", "-o"]
+        saved.append(args[4:])
+        open(args[3], 'w').close()
+        return ""
+
+    class _FakeHost:
+        """ Host whose daemon gets ready after a few attempts """
+
+        def __init__(self, name):
+            self.name = name
+            self.attempts = 2
+            self.images = dict()
+
+        def cmd(self, command):
+            args = command.split()
+            if args[:2] == ["docker", "info"]:
+                self.attempts -= 1
+                return "0" if self.attempts < 0 else "1"
+            elif args[:3] == ["docker", "image", "inspect"]:
+                return self.images.get(args[5], "")
+            elif args[:2] == ["docker", "load"]:
+                if self.name == "broken":
+                    return "open /var/dockerimages: no such file or directory\n1\n"
+                image = os.path.basename(args[3])[len("sha256-"):-len(".tar")]
+                self.images[image] = "sha256:" + image
+                return f"Loaded image: {image}\n0\n"
+            return ""
+
+    with tempfile.TemporaryDirectory() as directory:
+        stager = ImageStager(ImageCache(directory, execute), host_directory="/var/dockerimages")
+        archives = stager.stage(topology)
+        assert sorted(saved) == [["image_1"], ["image_2"]]
+        assert stager.stage(topology) == archives
+        assert len(saved) == 2  # Cached
+        hosts = [_FakeHost(f"h{i}") for i in range(4)]
+        assert stager.load(hosts, archives) == {i.name: 2 for i in hosts}
+        assert stager.load(hosts, archives) == {i.name: 0 for i in hosts}
+        try:
+            stager.load([_FakeHost("broken")], archives)
+            assert False
+        except RuntimeError:
+            pass
+        assert sorted(os.listdir(directory)) == sorted(os.path.basename(i[1]) for i in archives.values())
+
+        # Aliases of an image go into one archive
+        saved.clear()
+        aliases = ImageStager(ImageCache(os.path.join(directory, "aliases"),
+                lambda command: "sha256:image_3" if command.startswith("docker image inspect")
+                else execute(command)))
+        archives = aliases.stage_images(["image_3", "image_3_alias", "image_3_latest"])
+        assert saved == [["image_3", "image_3_alias", "image_3_latest"]]
+        assert len(set(archives.values())) == 1
+
+
+def test_host_bootstrap():
+    """ Daemons are started concurrently, and waited for until their sockets get opened """
+    import random
+    import subprocess
+    import sys
+    import tempfile
+
+    class _LocalHost:
+        """ Runs commands on this machine. Fake daemons get the host's delay through env. """
+
+        def __init__(self, name, delay):
+            self.name = name
+            self.delay = delay
+
+        def cmd(self, command):
+            return subprocess.run(["bash", "-c", command], stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE, text=True,
+                    env=dict(os.environ, HWL_FAKE_DAEMON_DELAY=str(self.delay))).stdout
+
+    # Fake daemon: opens the socket after a delay, and serves for a while
+    fake_daemon = sys.executable + " -c 'import os, socket, sys, time; " \
+            "time.sleep(float(os.environ[\"HWL_FAKE_DAEMON_DELAY\"])); " \
+            "s = socket.socket(socket.AF_UNIX); s.bind(sys.argv[1]); s.listen(); time.sleep(2)'"
+    rng = random.Random(0)
+    hosts = [_LocalHost(f"h{i}", rng.uniform(0.1, 0.4)) for i in range(8)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        socket = f"{directory}/{{host}}.sock"
+        bootstrap = HostBootstrap([DaemonSpec("fake", f"{fake_daemon} {socket}", socket)],
+                timeout=5.0, log_directory=directory)
+        t0 = time.perf_counter()
+        latencies = bootstrap.bootstrap(hosts)
+        duration = time.perf_counter() - t0
+        assert set(latencies.keys()) == {i.name for i in hosts}
+        for host in hosts:
+            assert latencies[host.name]["fake"] >= host.delay
+        assert duration < sum(i.delay for i in hosts) / 2
+
+        # A daemon that never opens its socket
+        never = HostBootstrap([DaemonSpec("never", "sleep 1", f"{directory}/never.sock")],
+                timeout=0.2, log_directory=directory)
+        try:
+            never.bootstrap(hosts[:1])
+            assert False
+        except TimeoutError:
+            pass
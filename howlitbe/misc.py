@@ -3,31 +3,51 @@ import random
 import tired.logging
 
 
-_generated_seed = False
+_seed = None
 """
-"Do-once" flag for random generators
+Initial value for RNG, see `get_seed`
 """
 
 
-def random_uniform(from_inclusive: float, to_exclusive: float):
+def get_seed() -> int:
     """
-    if no HWL_RND_SEED value specified, seeds the twister w/ a truly random
-    number (ONLY once), and generates a random number in the range
-    [from_inclusive, to_exclusive).
+    Returns the value of HWL_RND_SEED, if specified, or a truly random number
+    otherwise. The value is generated (and logged) ONLY once.
+
+    HWL_RND_SEED MUST be an integer. Older versions seeded the twister w/ the
+    string as is, so a given HWL_RND_SEED produces different sequences now.
     """
-    global _generated_seed
+    global _seed
 
-    # Make sure seed value is generated
-    if not _generated_seed:
+    if _seed is None:
         # Generate 4 random bytes from os' RNG source
         seed = os.urandom(4)
         seed = int(seed[0]) << 24 | int(seed[1]) << 16 | int(seed[2]) << 8 | int(seed[3])
         # Check if user provided the seed
-        seed = os.getenv("HWL_RND_SEED", seed)
-        tired.logging.info(f"Environment variable HWL_RND_SEED={seed} (Initial value for RNG)")
-        # Reset seed value
-        random.seed(seed)
-        _generated_seed = True
-
-    # Proceed to actual RNG
-    return random.uniform(from_inclusive, to_exclusive)
+        _seed = int(os.getenv("HWL_RND_SEED", seed))
+        tired.logging.info(f"Environment variable HWL_RND_SEED={_seed} (Initial value for RNG)")
+
+    return _seed
+
+
+def seed_random(seed: int):
+    """
+    Seeds the twister, and the process-wide streams of `howlitbe.rng` w/ a
+    given value.
+    """
+    import howlitbe.rng
+
+    random.seed(seed)
+    howlitbe.rng.seed(seed)
+
+
+def random_uniform(from_inclusive: float, to_exclusive: float):
+    """
+    Generates a random number in the range [from_inclusive, to_exclusive)
+    from the "uniform" stream of `howlitbe.rng`, which is seeded w/
+    HWL_RND_SEED, or w/ a truly random number. Prefer drawing arrays from
+    a named stream directly.
+    """
+    import howlitbe.rng
+
+    return float(howlitbe.rng.get_stream("uniform").uniform(from_inclusive, to_exclusive))
@@ -0,0 +1,219 @@
+"""
+Monte-Carlo replications of `howlitbe.simnet` simulations. Replications are
+fanned out over a process pool, each one gets its own reproducible set of
+`howlitbe.rng` streams spawned from a base seed (HWL_RND_SEED, unless specified
+explicitly).
+"""
+
+import concurrent.futures
+import copy
+import howlitbe.misc
+import howlitbe.rng
+import howlitbe.simnet
+import howlitbe.topology
+import numpy as np
+import random
+import statistics
+import tired.logging
+
+
+def _collect_stats(simulation, topology: howlitbe.topology.Topology):
+    """
+    Represents simulation stats as arrays indexed by dense node, and edge
+    indices, so the arrays are comparable between replications even though
+    object hashes are not.
+    """
+    index = topology.get_index()
+    processed = simulation.stats.processed.copy()
+    transferred = np.bincount(index.csr_edge,
+            weights=simulation.stats.trasnferred_directed,
+            minlength=index.get_n_edges())
+    return processed, transferred
+
+
+def _run_replication(topology_factory: callable,
+            topology_kwargs: dict,
+            simulation_type: type,
+            node_agent_type: type,
+            user_arg,
+            dt: float,
+            t1: float,
+            streams: howlitbe.rng.RngStreams):
+    """
+    Runs a single replication. Executed by pool workers
+    """
+    howlitbe.rng.set_streams(streams)
+    random.seed(streams.get_seed())  # Agents using the global RNG are reproducible too
+    topology = topology_factory(**copy.deepcopy(topology_kwargs))
+    simulation = simulation_type(topology, node_agent_type, user_arg)
+    simulation.run(dt, user_arg, t1)
+    return _collect_stats(simulation, topology)
+
+
+class ReplicationSummary:
+    """
+    Per-replication stats, and estimates merged over replications. Arrays are
+    indexed by dense node, and edge indices. Hash-based accessors address
+    nodes by the ids of `topology`, a reference instance built by the runner.
+    """
+
+    def __init__(self, topology: howlitbe.topology.Topology, seeds: list[int],
+                processed: np.ndarray, transferred: np.ndarray):
+        """
+        - processed: (n replications, n nodes) array
+        - transferred: (n replications, n edges) array, non-directed
+        """
+        self.topology = topology
+        self.seeds = seeds
+        self.processed = processed
+        self.transferred = transferred
+        self.index = topology.get_index()
+
+    def _get_edge(self, nodea: int, nodeb: int) -> int:
+        return self.index.csr_edge[self.index.edge_index[(nodea, nodeb)]]
+
+    def get_n_replications(self) -> int:
+        return len(self.seeds)
+
+    def get_processed_mean(self, nodeid: int) -> float:
+        return float(self.processed_mean()[self.index.node_index[nodeid]])
+
+    def get_processed_variance(self, nodeid: int) -> float:
+        return float(self.processed_variance()[self.index.node_index[nodeid]])
+
+    def get_processed_ci(self, nodeid: int, confidence: float = 0.95) -> tuple:
+        low, high = self.processed_ci(confidence)
+        return float(low[self.index.node_index[nodeid]]), float(high[self.index.node_index[nodeid]])
+
+    def get_non_directed_edge_mean(self, nodea: int, nodeb: int) -> float:
+        return float(self.transferred_mean()[self._get_edge(nodea, nodeb)])
+
+    def get_non_directed_edge_variance(self, nodea: int, nodeb: int) -> float:
+        return float(self.transferred_variance()[self._get_edge(nodea, nodeb)])
+
+    def get_non_directed_edge_ci(self, nodea: int, nodeb: int,
+                confidence: float = 0.95) -> tuple:
+        low, high = self.transferred_ci(confidence)
+        i = self._get_edge(nodea, nodeb)
+        return float(low[i]), float(high[i])
+
+    def processed_mean(self) -> np.ndarray:
+        return self.processed.mean(axis=0)
+
+    def processed_variance(self) -> np.ndarray:
+        return self._variance(self.processed)
+
+    def processed_ci(self, confidence: float = 0.95) -> tuple:
+        return self._ci(self.processed, confidence)
+
+    def transferred_mean(self) -> np.ndarray:
+        return self.transferred.mean(axis=0)
+
+    def transferred_variance(self) -> np.ndarray:
+        return self._variance(self.transferred)
+
+    def transferred_ci(self, confidence: float = 0.95) -> tuple:
+        return self._ci(self.transferred, confidence)
+
+    @staticmethod
+    def _variance(samples: np.ndarray) -> np.ndarray:
+        """ Unbiased sample variance, zero for a single replication """
+        if len(samples) < 2:
+            return np.zeros(samples.shape[1:], dtype=np.float64)
+        return samples.var(axis=0, ddof=1)
+
+    @staticmethod
+    def _ci(samples: np.ndarray, confidence: float) -> tuple:
+        """
+        (low, high) bounds of the confidence interval for the mean. Normal
+        approximation is used.
+        """
+        z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+        mean = samples.mean(axis=0)
+        half_width = z * np.sqrt(ReplicationSummary._variance(samples) / len(samples))
+        return mean - half_width, mean + half_width
+
+
+def run_replications(topology_factory: callable,
+            node_agent_type: type,
+            n_replications: int,
+            dt: float,
+            t1: float,
+            topology_kwargs: dict = None,
+            user_arg=None,
+            base_seed: int = None,
+            simulation_type: type = howlitbe.simnet.VectorSimulation,
+            n_workers: int = None) -> ReplicationSummary:
+    """
+    Runs `n_replications` independent simulations in a process pool.
+
+    - topology_factory: callable producing a topology, e.g.
+      `Topology.new_topology_lb22_overlay`. Called w/ `topology_kwargs` once per
+      replication, and MUST be deterministic
+    - node_agent_type: agent type, see `howlitbe.simnet.NodeAgent`
+    - dt, t1: simulation step, and duration, see `Simulation.run`
+    - topology_kwargs: keyword arguments of `topology_factory`. If None, the
+      factory is called w/o arguments
+    - user_arg: agent constructor argument, and the per-step argument, see
+      `Simulation.run`
+    - base_seed: seed the per-replication seeds are derived from. If None,
+      HWL_RND_SEED is used
+    - simulation_type: engine each replication is run with, e.g.
+      `howlitbe.simnet.Simulation`, or `howlitbe.simnet.VectorSimulation`
+    - n_workers: number of worker processes. If None, equals to the number of
+      CPUs. If 1, replications are run in this process
+    """
+    if topology_kwargs is None:
+        topology_kwargs = dict()
+    if base_seed is None:
+        base_seed = howlitbe.misc.get_seed()
+    streams = howlitbe.rng.RngStreams(base_seed).spawn(n_replications)
+    seeds = [i.get_seed() for i in streams]
+    tired.logging.info(f"Running {n_replications} replications, base seed {base_seed}")
+    args = [(topology_factory, topology_kwargs, simulation_type, node_agent_type,
+            user_arg, dt, t1, i) for i in streams]
+
+    if n_workers == 1:
+        results = [_run_replication(*i) for i in args]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_run_replication, *zip(*args)))
+
+    topology = topology_factory(**copy.deepcopy(topology_kwargs))
+    return ReplicationSummary(topology=topology,
+            seeds=seeds,
+            processed=np.array([i[0] for i in results]),
+            transferred=np.array([i[1] for i in results]))
+
+
+def test_replications_reproducible():
+    topology_kwargs = dict(n_switches_total=5,
+            n_gates=2,
+            n_nodes=20,
+            images_count={
+                "image 1": 30,
+            },
+            n_overlays=5,
+            image_commands={})
+    summaries = [run_replications(howlitbe.topology.Topology.new_topology_lb22_overlay,
+            howlitbe.simnet.RandomPassNodeAgent,
+            n_replications=4,
+            dt=1.0,
+            t1=10,
+            topology_kwargs=topology_kwargs,
+            base_seed=42,
+            n_workers=n_workers) for n_workers in [1, 2]]
+
+    # Same seed -- same trajectories, no matter how many workers run them
+    assert summaries[0].seeds == summaries[1].seeds
+    assert np.array_equal(summaries[0].processed, summaries[1].processed)
+    assert np.array_equal(summaries[0].transferred, summaries[1].transferred)
+    # Streams are independent
+    assert len(set(summaries[0].seeds)) == 4
+    assert not np.array_equal(summaries[0].processed[0], summaries[0].processed[1])
+
+    summary = summaries[0]
+    assert summary.processed.shape == (4, summary.topology.as_nxgraph().number_of_nodes())
+    for inode in summary.topology.as_nxgraph().nodes:
+        low, high = summary.get_processed_ci(inode)
+        assert low <= summary.get_processed_mean(inode) <= high
@@ -0,0 +1,142 @@
+"""
+Random number streams. Each stream is a NumPy `Generator` identified by name
+(e.g. "traffic", "routing", "failures"), and derived from a single
+`SeedSequence`, so streams are independent from each other, and from the
+order they are first requested in. Child stream sets are spawned for
+parallel workers.
+
+The process-wide stream set is seeded w/ HWL_RND_SEED (see
+`howlitbe.misc.get_seed`), unless `seed` or `set_streams` is called.
+"""
+
+import howlitbe.misc
+import numpy as np
+import zlib
+
+
+TRAFFIC = "traffic"
+ROUTING = "routing"
+FAILURES = "failures"
+
+_NAMED_STREAM = 0
+_CHILD_STREAM = 1
+""" Spawn key prefixes, so named streams, and children never collide """
+
+
+class RngStreams:
+
+    def __init__(self, seed=None):
+        """
+        - seed: int, or `np.random.SeedSequence`. If None, HWL_RND_SEED is used
+        """
+        if seed is None:
+            seed = howlitbe.misc.get_seed()
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.streams = dict()
+
+    def _derive(self, *key) -> np.random.SeedSequence:
+        return np.random.SeedSequence(self.seed_sequence.entropy,
+                spawn_key=tuple(self.seed_sequence.spawn_key) + key,
+                pool_size=self.seed_sequence.pool_size)
+
+    def get(self, name: str) -> np.random.Generator:
+        """ Returns the stream. Created on first use """
+        if name not in self.streams:
+            seed_sequence = self._derive(_NAMED_STREAM, zlib.crc32(name.encode("utf8")))
+            self.streams[name] = np.random.Generator(np.random.PCG64(seed_sequence))
+        return self.streams[name]
+
+    def spawn(self, n: int) -> list:
+        """
+        Returns `n` independent stream sets, e.g. one per worker. The result
+        only depends on the seed, and `n`
+        """
+        return [RngStreams(self._derive(_CHILD_STREAM, i)) for i in range(n)]
+
+    def get_seed(self) -> int:
+        """ Returns a 64-bit integer representing the seed, e.g. for reporting, or legacy RNGs """
+        return int(self.seed_sequence.generate_state(1, dtype=np.uint64)[0])
+
+    def get_state(self) -> dict:
+        """ Returns picklable state, see `from_state` """
+        return dict(entropy=self.seed_sequence.entropy,
+                spawn_key=tuple(self.seed_sequence.spawn_key),
+                pool_size=self.seed_sequence.pool_size,
+                streams={k: v.bit_generator.state for k, v in self.streams.items()})
+
+    @staticmethod
+    def from_state(state: dict) -> object:
+        ret = RngStreams(np.random.SeedSequence(state["entropy"], spawn_key=state["spawn_key"],
+                pool_size=state["pool_size"]))
+        for name, bit_generator_state in state["streams"].items():
+            ret.get(name).bit_generator.state = bit_generator_state
+        return ret
+
+
+_streams = None
+
+
+def get_streams() -> RngStreams:
+    """ Returns the process-wide stream set """
+    global _streams
+
+    if _streams is None:
+        _streams = RngStreams()
+    return _streams
+
+
+def set_streams(streams: RngStreams):
+    global _streams
+
+    _streams = streams
+
+
+def seed(seed: int):
+    """ Re-seeds the process-wide stream set """
+    set_streams(RngStreams(seed))
+
+
+def get_stream(name: str) -> np.random.Generator:
+    """ Returns a stream from the process-wide set """
+    return get_streams().get(name)
+
+
+def choose_allowed(generator: np.random.Generator, mask: np.ndarray) -> np.ndarray:
+    """
+    For each row of a boolean (n, m) mask, picks an allowed column uniformly
+    at random w/ a single batch draw. Each row MUST have an allowed column
+    """
+    counts = mask.sum(axis=1)
+    # k-th allowed column of each row
+    k = np.minimum((generator.random(len(mask)) * counts).astype(np.int64), counts - 1)
+    return np.argmax(np.cumsum(mask, axis=1) > k[:, None], axis=1)
+
+
+def test_streams_are_reproducible_and_independent():
+    a = RngStreams(42)
+    b = RngStreams(42)
+    b.get(ROUTING)  # Creation order does not matter
+    assert np.array_equal(a.get(TRAFFIC).random(8), b.get(TRAFFIC).random(8))
+    assert not np.array_equal(RngStreams(42).get(TRAFFIC).random(8),
+            RngStreams(42).get(ROUTING).random(8))
+    children = [i.get(TRAFFIC).random(8) for i in RngStreams(42).spawn(3)]
+    assert not np.array_equal(children[0], children[1])
+    assert np.array_equal(children[2], RngStreams(42).spawn(3)[2].get(TRAFFIC).random(8))
+    # Named streams, and children do not collide
+    assert not np.array_equal(RngStreams(42).get(TRAFFIC).random(8), children[0])
+
+    # State round trip
+    a.get(FAILURES).random(5)
+    restored = RngStreams.from_state(a.get_state())
+    assert np.array_equal(a.get(FAILURES).random(8), restored.get(FAILURES).random(8))
+
+
+def test_choose_allowed():
+    generator = RngStreams(0).get(ROUTING)
+    mask = np.array([[True, False, True], [False, True, False], [True, True, True]])
+    choices = np.array([choose_allowed(generator, mask) for _ in range(3000)])
+    assert np.all(mask[np.arange(3)[None, :], choices])
+    assert np.all(choices[:, 1] == 1)
+    assert np.allclose(np.bincount(choices[:, 2], minlength=3) / 3000, 1 / 3, atol=0.05)
@@ -0,0 +1,318 @@
+"""
+Structural stability intervals. A scenario is a sequence of intervals
+(index `l` in `howlitbe.scenario.lb22` terms), each one w/ a topology delta
+applied at its beginning, agent parameters, and planned amounts of
+processed, transferred, and dropped data. The runner drives a simulation
+through the intervals, and records planned, and actual amounts per interval
+as arrays, so plans can be validated against the simulator in batch.
+
+Only these three are compared. Storage, and resource limits (cpu, network,
+and memory bandwidth fractions) of a technology have no counterpart in the
+simulator, and are not carried by intervals.
+"""
+
+import concurrent.futures
+import dataclasses
+import howlitbe.rng
+import howlitbe.simnet
+import howlitbe.topology
+import numpy as np
+import tired.logging
+
+
+@dataclasses.dataclass
+class Interval:
+    """
+    - duration: [s]
+    - detach, reattach: node objects to detach from, or reattach to the
+      topology at the beginning of the interval (see `Topology.detach_node`)
+    - user_arg: passed to the agents on each step of the interval
+    - processing: {hash(node): planned amount processed over the interval}
+    - traffic: {(hash(node a), hash(node b)): planned amount transferred
+      over the interval in both directions}
+    - drop: {hash(node): planned amount dropped at the node over the
+      interval}
+    """
+
+    duration: float
+    detach: list = dataclasses.field(default_factory=list)
+    reattach: list = dataclasses.field(default_factory=list)
+    user_arg: object = None
+    processing: dict = dataclasses.field(default_factory=dict)
+    traffic: dict = dataclasses.field(default_factory=dict)
+    drop: dict = dataclasses.field(default_factory=dict)
+
+    @staticmethod
+    def from_technology(technology, l: int, duration: float, **kwargs) -> object:
+        """
+        Takes planned processing, traffic, and drop of interval `l` from a
+        `howlitbe.scenario.lb22.VirtualizedNetworkTechnology`, summed over
+        overlays. Node ids of the technology are node hashes. Storage, and
+        resource limits are not taken, see the module's docstring
+        """
+        processing = dict()
+        for (l_, j, rho), value in technology.processing.items():
+            if l_ == l:
+                processing[j] = processing.get(j, 0.0) + value
+        drop = dict()
+        for (l_, j, rho), value in technology.drop.items():
+            if l_ == l:
+                drop[j] = drop.get(j, 0.0) + value
+        traffic = dict()
+        for (l_, j, i, rho), value in technology.traffic.items():
+            if l_ == l:
+                key = (j, i) if (i, j) not in traffic else (i, j)
+                traffic[key] = traffic.get(key, 0.0) + value
+        return Interval(duration=duration, processing=processing, traffic=traffic, drop=drop,
+                **kwargs)
+
+
+class ScenarioResult:
+    """
+    Planned, and actual amounts, (n intervals, n nodes), and (n intervals,
+    n edges) arrays. Nodes, and edges are those of the topology's dense
+    index before the first interval. Amounts that have not been planned are
+    NaN in the planned arrays
+    """
+
+    def __init__(self, node_ids: np.ndarray, edge_ids: np.ndarray, interval_start: np.ndarray,
+                planned_processed: np.ndarray, actual_processed: np.ndarray,
+                planned_transferred: np.ndarray, actual_transferred: np.ndarray,
+                planned_dropped: np.ndarray, actual_dropped: np.ndarray):
+        self.node_ids = node_ids
+        self.edge_ids = edge_ids
+        """ (n edges, 2) array of node hashes """
+        self.interval_start = interval_start
+        self.planned_processed = planned_processed
+        self.actual_processed = actual_processed
+        self.planned_transferred = planned_transferred
+        self.actual_transferred = actual_transferred
+        self.planned_dropped = planned_dropped
+        self.actual_dropped = actual_dropped
+        """ Dropped at the node: discarded, or sent over a congested link, see `howlitbe.simnet._SimStats` """
+
+    def get_processed_deviation(self) -> np.ndarray:
+        """ Actual minus planned, NaN for what has not been planned """
+        return self.actual_processed - self.planned_processed
+
+    def get_transferred_deviation(self) -> np.ndarray:
+        return self.actual_transferred - self.planned_transferred
+
+    def get_dropped_deviation(self) -> np.ndarray:
+        return self.actual_dropped - self.planned_dropped
+
+    def get_max_deviation(self) -> np.ndarray:
+        """ Max. absolute deviation of processed, transferred, and dropped amounts in each interval """
+        deviations = np.concatenate([self.get_processed_deviation(),
+                self.get_transferred_deviation(), self.get_dropped_deviation()], axis=1)
+        ret = np.zeros(len(deviations))
+        planned = ~np.isnan(deviations)
+        for l in range(len(deviations)):
+            if np.any(planned[l]):
+                ret[l] = np.abs(deviations[l][planned[l]]).max()
+        return ret
+
+
+class ScenarioRunner:
+
+    def __init__(self, topology: howlitbe.topology.Topology, node_agent_type: type,
+                user_arg=None, dt: float = 1.0,
+                simulation_type: type = howlitbe.simnet.VectorSimulation, **simulation_kwargs):
+        """
+        - user_arg: agent constructor argument, and the per-step argument of
+          the intervals that do not set their own
+        - simulation_kwargs: passed to the simulation constructor
+        """
+        self.topology = topology
+        self.user_arg = user_arg
+        self.dt = dt
+        self.simulation = simulation_type(topology, node_agent_type, user_arg, **simulation_kwargs)
+
+    def _get_edge_positions(self, edge_ids: np.ndarray) -> tuple:
+        """ CSR positions of both directions of each edge in the current index, -1 if absent """
+        edge_index = self.simulation.index.edge_index
+        forward = np.array([edge_index.get((int(a), int(b)), -1) for a, b in edge_ids], dtype=np.int64)
+        backward = np.array([edge_index.get((int(b), int(a)), -1) for a, b in edge_ids], dtype=np.int64)
+        return forward, backward
+
+    def _get_transferred(self, positions: tuple) -> np.ndarray:
+        transferred = self.simulation.stats.trasnferred_directed
+        ret = np.zeros(len(positions[0]), dtype=np.float64)
+        for i in positions:
+            ret[i >= 0] += transferred[i[i >= 0]]
+        return ret
+
+    def _get_link_dropped(self) -> np.ndarray:
+        """ Per node: dropped at the congested links going out of the node """
+        index = self.simulation.index
+        source = np.repeat(np.arange(index.get_n_nodes()), np.diff(index.indptr))
+        return np.bincount(source, weights=self.simulation.stats.dropped_directed,
+                minlength=index.get_n_nodes())
+
+    def run(self, intervals: list) -> ScenarioResult:
+        index = self.topology.get_index()
+        node_ids = index.node_ids
+        edge_ids = index.node_ids[index.edges]
+        edge_keys = {(int(a), int(b)): k for k, (a, b) in enumerate(edge_ids)}
+        n = len(intervals)
+        planned_processed = np.full((n, len(node_ids)), np.nan)
+        actual_processed = np.zeros((n, len(node_ids)))
+        planned_transferred = np.full((n, len(edge_ids)), np.nan)
+        actual_transferred = np.zeros((n, len(edge_ids)))
+        planned_dropped = np.full((n, len(node_ids)), np.nan)
+        actual_dropped = np.zeros((n, len(node_ids)))
+        interval_start = np.zeros(n)
+
+        t_end = self.simulation.get_previous_time()
+        for l, interval in enumerate(intervals):
+            for node in interval.detach:
+                self.topology.detach_node(node)
+            for node in interval.reattach:
+                self.topology.reattach_node(node)
+            # Counters of the removed edges are discarded, so the interval
+            # starts after that. Data discarded by the change counts though
+            dropped = self.simulation.stats.dropped.copy()
+            self.simulation.apply_topology_changes()
+            positions = self._get_edge_positions(edge_ids)
+            processed = self.simulation.stats.processed.copy()
+            transferred = self._get_transferred(positions)
+            link_dropped = self._get_link_dropped()
+
+            interval_start[l] = self.simulation.get_previous_time()
+            t_end += interval.duration
+            user_arg = self.user_arg if interval.user_arg is None else interval.user_arg
+            self.simulation.run(self.dt, user_arg, t_end)
+
+            actual_processed[l] = self.simulation.stats.processed - processed
+            actual_transferred[l] = self._get_transferred(positions) - transferred
+            actual_dropped[l] = self.simulation.stats.dropped - dropped \
+                    + self._get_link_dropped() - link_dropped
+            for inode, value in interval.processing.items():
+                planned_processed[l, index.node_index[inode]] = value
+            for (a, b), value in interval.traffic.items():
+                planned_transferred[l, edge_keys[(a, b)] if (a, b) in edge_keys
+                        else edge_keys[(b, a)]] = value
+            for inode, value in interval.drop.items():
+                planned_dropped[l, index.node_index[inode]] = value
+            tired.logging.debug(f"Interval {l}: t={interval_start[l]}..{t_end}")
+
+        return ScenarioResult(node_ids=node_ids, edge_ids=edge_ids,
+                interval_start=interval_start,
+                planned_processed=planned_processed, actual_processed=actual_processed,
+                planned_transferred=planned_transferred, actual_transferred=actual_transferred,
+                planned_dropped=planned_dropped, actual_dropped=actual_dropped)
+
+
+def _run_scenario(scenario_factory: callable, i: int, node_agent_type: type, user_arg,
+            dt: float, simulation_type: type, streams: howlitbe.rng.RngStreams) -> ScenarioResult:
+    """ Executed by pool workers """
+    howlitbe.rng.set_streams(streams)
+    topology, intervals = scenario_factory(i)
+    return ScenarioRunner(topology, node_agent_type, user_arg, dt, simulation_type).run(intervals)
+
+
+def run_scenarios(scenario_factory: callable, n_scenarios: int, node_agent_type: type,
+            user_arg=None, dt: float = 1.0,
+            simulation_type: type = howlitbe.simnet.VectorSimulation, base_seed: int = None,
+            n_workers: int = None) -> list:
+    """
+    Runs scenarios in a process pool. Returns a `ScenarioResult` per scenario.
+
+    - scenario_factory: called w/ the scenario number, returns (topology,
+      intervals). It is called in the workers, as nodes of the intervals
+      must be the objects of the topology, and MUST be deterministic
+    - base_seed: seed the `howlitbe.rng` streams of each scenario are spawned
+      from. If None, HWL_RND_SEED is used
+    - n_workers: number of worker processes. If 1, scenarios are run in
+      this process
+    """
+    streams = howlitbe.rng.RngStreams(base_seed).spawn(n_scenarios)
+    args = [(scenario_factory, i, node_agent_type, user_arg, dt, simulation_type, streams[i])
+            for i in range(n_scenarios)]
+    if n_workers == 1:
+        return [_run_scenario(*i) for i in args]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(_run_scenario, *zip(*args)))
+
+
+class _RateAgent(howlitbe.simnet.ShortestPathNodeAgent):
+    """ Gates generate `user_arg` bytes per second, nodes process everything """
+
+    def generate_inbound_data(self, simulation, topology, self_as_node_object, dt, user_arg=None):
+        return user_arg * dt
+
+    def calc_processed_data_amnt_bytes_batch(self, simulation, topology, neighbors_as_agents,
+                neighbor_node_ids, self_as_node_object, dt, data_amnts, user_arg=None):
+        return data_amnts
+
+
+def _make_replication_scenario(i: int) -> tuple:
+    """
+    Gate -- switch -- 3 nodes. The node the data goes to detaches for the
+    second interval, the rate doubles in the third one
+    """
+    import networkx as nx
+
+    topology = howlitbe.topology.Topology(nx.Graph())
+    gate = howlitbe.topology.Switch(is_gate=True)
+    switch = howlitbe.topology.Switch(is_gate=False)
+    topology.add_edge(gate, switch, howlitbe.topology.PhysicalLink(gate, switch, bandwidth=1e6))
+    nodes = [howlitbe.topology.Node() for _ in range(3)]
+    for node in nodes:
+        topology.add_edge(switch, node, howlitbe.topology.PhysicalLink(switch, node, bandwidth=1e6))
+    table = topology.get_routing_table()
+    index = topology.get_index()
+    nearest = index.node_objects[table.targets[table.get_nearest_target_row(
+            np.array([index.node_index[hash(gate)]]))[0]]]
+    intervals = [
+        Interval(duration=10, user_arg=1.0, processing={hash(nearest): 10.0},
+                traffic={(hash(gate), hash(switch)): 10.0}),
+        Interval(duration=10, user_arg=1.0, detach=[nearest], processing={hash(nearest): 0.0},
+                traffic={(hash(switch), hash(gate)): 10.0}),
+        Interval(duration=10, user_arg=2.0 + i, reattach=[nearest], processing={hash(nearest): 20.0}),
+    ]
+    return topology, intervals
+
+
+def test_replication_scenario():
+    results = run_scenarios(_make_replication_scenario, 2, _RateAgent, user_arg=1.0,
+            base_seed=0, n_workers=1)
+    result = results[0]
+    assert list(result.interval_start) == [0, 10, 20]
+    assert result.planned_processed.shape == result.actual_processed.shape == (3, 5)
+    assert result.planned_transferred.shape == result.actual_transferred.shape == (3, 4)
+    assert np.count_nonzero(~np.isnan(result.planned_processed)) == 3
+    # Data takes 2 steps to reach a node, and 1 more to get processed
+    assert np.sum(result.actual_processed[0]) == 8.0
+    assert np.all(np.nansum(np.abs(result.get_transferred_deviation()), axis=1) == 0)
+    # The node processes what it has received before it detached. After it
+    # reattaches, it also gets what has been waiting at the switch
+    assert list(result.get_processed_deviation()[:, np.flatnonzero(
+            ~np.isnan(result.planned_processed[0]))[0]]) == [-2.0, 1.0, -3.0]
+    assert list(result.get_max_deviation()) == [2.0, 1.0, 3.0]
+    # Agent parameters are switched per interval
+    assert np.sum(results[1].actual_processed[2]) == np.sum(result.actual_processed[2]) + 8
+
+
+def test_dropped_data():
+    """ Gate -- switch -- node. The switch detaches for the second interval, data is dropped at the gate """
+    import networkx as nx
+
+    topology = howlitbe.topology.Topology(nx.Graph())
+    gate = howlitbe.topology.Switch(is_gate=True)
+    switch = howlitbe.topology.Switch(is_gate=False)
+    node = howlitbe.topology.Node()
+    topology.add_edge(gate, switch, howlitbe.topology.PhysicalLink(gate, switch, bandwidth=1e6))
+    topology.add_edge(switch, node, howlitbe.topology.PhysicalLink(switch, node, bandwidth=1e6))
+    intervals = [
+        Interval(duration=10, user_arg=1.0, drop={hash(gate): 0.0}),
+        Interval(duration=10, user_arg=1.0, detach=[switch], drop={hash(gate): 10.0, hash(switch): 0.0}),
+    ]
+    result = ScenarioRunner(topology, _RateAgent).run(intervals)
+    assert result.planned_dropped.shape == result.actual_dropped.shape == (2, 3)
+    assert np.nansum(np.abs(result.get_dropped_deviation()[0])) == 0
+    # The unit waiting at the switch is discarded, once it is cut off
+    deviation = dict(zip(result.node_ids.tolist(), result.get_dropped_deviation()[1]))
+    assert deviation[hash(gate)] == 0.0 and deviation[hash(switch)] == 1.0
+    assert np.isnan(deviation[hash(node)])
+    assert list(result.get_max_deviation()) == [0.0, 1.0]
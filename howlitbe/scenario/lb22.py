@@ -18,8 +18,11 @@ process is maximized.
 import dataclasses
 import howlitbe.topology
 import networkx as nx
-import twoopt.linsmat
-import twoopt.data_processing.vector_index
+import numpy as np
+import scipy.optimize
+import scipy.sparse
+import time
+import tired.logging
 
 
 @dataclasses.dataclass
@@ -66,6 +69,9 @@ class VirtualizedNetworkTechnology:
     cpu_limit: map
     """{(l, j, rho): F}, l - structural stability span index, j - node, rho - container overlay network, F - fraction"""
 
+    timings: dict = dataclasses.field(default_factory=dict)
+    """ {"assembly": s, "solve": s}, time spent on the linear programming model """
+
     @staticmethod
     def new_replication_scenario(j_max: int,
                         rho_max: int,
@@ -73,7 +79,13 @@ class VirtualizedNetworkTechnology:
                         n_switches_total: int,
                         n_gates: int,
                         inbound_traffic_bytes: int,
-                        outbound_traffic_bytes: int) -> object:
+                        outbound_traffic_bytes: int,
+                        interval_duration: float = 1.0,
+                        node_processing_bytes: float = None,
+                        database_storage_bytes: float = None,
+                        link_bps: float = None,
+                        alpha_0: float = 1.0,
+                        alpha_1: float = 1.0) -> object:
         """
         "Replication" scenario, 3 structural stability intervals:
         1. A networks operates normally;
@@ -87,24 +99,265 @@ class VirtualizedNetworkTechnology:
         n_ingress - number of externally-connected switches
         inbound_traffic_bytes - number of bytes that enter the network
         outbound_traffic_bytes - number of bytes that exit the network
+        interval_duration - [s], link capacities are bps * duration / 8
+        node_processing_bytes - amount a node can process over an interval. If None, inbound traffic / number of nodes hosting containers
+        database_storage_bytes - amount a database can store. If None, inbound traffic
+        link_bps - bandwidth of each physical link. If None, a link can carry the whole inbound traffic over an interval
+        alpha_0 - relative importance of maximizing the amount of processed data
+        alpha_1 - relative importance of minimizing the amount of dropped data
 
         From a set of parameters, generates network topology, structural
         stability intervals, constraints, runs linear solver, and initializes
-        the object with calculated planned values.
+        the object with calculated planned values. Node ids are node hashes,
+        only non-zero planned values are stored.
+        """
+        n_nodes = j_max - n_switches_total
+        if n_nodes <= n_databases:
+            raise ValueError(f"{n_nodes} nodes can not host {n_databases} databases")
+        topology = howlitbe.topology.Topology.new_topology_lb22_overlay(
+                n_switches_total=n_switches_total,
+                n_gates=n_gates,
+                n_nodes=n_nodes,
+                images_count={"application": max(n_nodes, rho_max)},
+                n_overlays=rho_max,
+                link_bps=inbound_traffic_bytes * 8 / interval_duration if link_bps is None else link_bps)
+        index = topology.get_index()
+        node_dense = np.flatnonzero(index.node_kind == howlitbe.topology.NODE_KIND_NODE)
+        databases = node_dense[:n_databases]
+        detached = [set(), set(int(i) for i in databases[:2]), set()]
+        lp = _ReplicationModel(topology, rho_max, detached, interval_duration)
+
+        t0 = time.perf_counter()
+        lp.assemble(
+            inbound_bytes=inbound_traffic_bytes,
+            outbound_bytes=outbound_traffic_bytes,
+            node_processing_bytes=inbound_traffic_bytes / max(np.count_nonzero(lp.hosts.any(axis=0)), 1)
+                    if node_processing_bytes is None else node_processing_bytes,
+            databases=databases,
+            database_storage_bytes=inbound_traffic_bytes if database_storage_bytes is None
+                    else database_storage_bytes,
+            alpha_0=alpha_0,
+            alpha_1=alpha_1)
+        t1 = time.perf_counter()
+        solution = lp.solve()
+        t2 = time.perf_counter()
+        tired.logging.info(f"Replication scenario: {lp.n_variables} variables, "
+                f"{lp.a_eq.shape[0] + lp.a_ub.shape[0]} constraints, assembled in {t1 - t0:.3f} s, "
+                f"solved in {t2 - t1:.3f} s")
+
+        return VirtualizedNetworkTechnology(topology=topology,
+                **lp.get_planned_values(solution),
+                network_bandwidth_limit=dict(),
+                memory_bandwidth_limit=dict(),
+                cpu_limit=dict(),
+                timings=dict(assembly=t1 - t0, solve=t2 - t1))
+
+
+class _ReplicationModel:
+    """
+    Sparse linear programming model. Flow variables exist for the directed
+    physical links of the topology only, so the model grows w/ the number of
+    links, not w/ the number of node pairs. Variables, for each interval l,
+    and overlay rho:
+
+    - x[p, rho, l]: transferred over the directed link at CSR position p
+    - g[j, rho, l]: processed by node j
+    - y[j, rho, l]: stored at node j by the end of the interval
+    - z[j, rho, l]: dropped at node j
+    - e[j, rho, l]: sent out of the network through gate j
+
+    Balance of each (network) node: inbound + received + stored before =
+    sent + processed + stored + dropped + sent out
+    """
+
+    N_INTERVALS = 3
+
+    def __init__(self, topology: howlitbe.topology.Topology, n_overlays: int, detached: list,
+                interval_duration: float):
         """
+        - detached: for each interval, a set of dense indices of the nodes whose links are down
+        """
+        self.index = topology.get_index()
+        self.n_overlays = n_overlays
+        self.detached = detached
+        self.interval_duration = interval_duration
+        index = self.index
+
+        # Network nodes, w/o containers
+        self.nodes = np.flatnonzero(index.node_kind != howlitbe.topology.NODE_KIND_CONTAINER)
+        self.node_row = np.full(index.get_n_nodes(), -1, dtype=np.int64)
+        self.node_row[self.nodes] = np.arange(len(self.nodes))
+        self.gates = np.flatnonzero(index.node_kind == howlitbe.topology.NODE_KIND_GATE)
+        self.positions = np.flatnonzero(np.isfinite(index.edge_bps[index.csr_edge]))
+        self.position_source = np.repeat(np.arange(index.get_n_nodes()),
+                index.get_degree())[self.positions]
+        self.position_target = index.indices[self.positions]
+
+        # Overlays hosted by nodes
+        self.hosts = np.zeros((n_overlays, index.get_n_nodes()), dtype=bool)
+        for kind, obj in zip(index.node_kind, index.node_objects):
+            if kind == howlitbe.topology.NODE_KIND_CONTAINER and obj.overlay_id is not None:
+                self.hosts[obj.overlay_id, index.node_index[hash(obj.node)]] = True
+
+        # Variable layout: blocks of x, g, y, z, e, each ordered by (l, rho, item)
+        n_blocks = self.N_INTERVALS * n_overlays
+        sizes = dict(x=len(self.positions), g=len(self.nodes), y=len(self.nodes),
+                z=len(self.nodes), e=len(self.gates))
+        self.offsets = dict()
+        offset = 0
+        for name, size in sizes.items():
+            self.offsets[name] = offset
+            offset += n_blocks * size
+        self.sizes = sizes
+        self.n_variables = offset
+
+    def get_variables(self, name: str, l: np.ndarray, rho: np.ndarray, item: np.ndarray) -> np.ndarray:
+        """ Returns variable numbers. Arguments are broadcast """
+        return self.offsets[name] + (l * self.n_overlays + rho) * self.sizes[name] + item
+
+    def _grid(self, n_items: int) -> tuple:
+        """ (l, rho, item) of all the variables of a block, flattened """
+        l, rho, item = np.meshgrid(np.arange(self.N_INTERVALS), np.arange(self.n_overlays),
+                np.arange(n_items), indexing="ij")
+        return l.ravel(), rho.ravel(), item.ravel()
+
+    def assemble(self, inbound_bytes: float, outbound_bytes: float, node_processing_bytes: float,
+                databases: np.ndarray, database_storage_bytes: float, alpha_0: float, alpha_1: float):
+        n_nodes = len(self.nodes)
+        n_balance = self.N_INTERVALS * self.n_overlays * n_nodes
+        rows, columns, values = list(), list(), list()
+
+        def _add(row, column, value):
+            row, column = np.broadcast_arrays(row, column)
+            rows.append(row.ravel())
+            columns.append(column.ravel())
+            values.append(np.broadcast_to(value, row.shape).ravel().astype(np.float64))
+
+        def _balance_row(l, rho, node_row):
+            return (l * self.n_overlays + rho) * n_nodes + node_row
+
+        # Balance equations
+        l, rho, p = self._grid(len(self.positions))
+        x = self.get_variables("x", l, rho, p)
+        _add(_balance_row(l, rho, self.node_row[self.position_source[p]]), x, 1.0)
+        _add(_balance_row(l, rho, self.node_row[self.position_target[p]]), x, -1.0)
+        l, rho, j = self._grid(n_nodes)
+        for name in ["g", "y", "z"]:
+            _add(_balance_row(l, rho, j), self.get_variables(name, l, rho, j), 1.0)
+        later = l > 0
+        _add(_balance_row(l[later], rho[later], j[later]),
+                self.get_variables("y", l[later] - 1, rho[later], j[later]), -1.0)
+        l, rho, k = self._grid(len(self.gates))
+        _add(_balance_row(l, rho, self.node_row[self.gates[k]]), self.get_variables("e", l, rho, k), 1.0)
+        self.b_eq = np.zeros(n_balance)
+        inbound = inbound_bytes / max(len(self.gates) * self.n_overlays, 1)
+        np.add.at(self.b_eq, _balance_row(l, rho, self.node_row[self.gates[k]]), inbound)
+        self.a_eq = scipy.sparse.csr_matrix((np.concatenate(values),
+                (np.concatenate(rows), np.concatenate(columns))), shape=(n_balance, self.n_variables))
+
+        # Capacities, summed over overlays: links (both directions), processing,
+        # storage, and the gates' share of outbound traffic
+        rows, columns, values = list(), list(), list()
+        b_ub = list()
+        n_edges = self.index.get_n_edges()
+        l, rho, p = self._grid(len(self.positions))
+        _add(l * n_edges + self.index.csr_edge[self.positions[p]], self.get_variables("x", l, rho, p), 1.0)
+        bytes_per_interval = self.index.edge_bps / 8 * self.interval_duration
+        b_ub.append(np.tile(np.where(np.isfinite(bytes_per_interval), bytes_per_interval, 0.0),
+                self.N_INTERVALS))
+        offset = self.N_INTERVALS * n_edges
+        l, rho, j = self._grid(n_nodes)
+        for name, capacity in [("g", np.full(n_nodes, node_processing_bytes)),
+                ("y", np.where(np.isin(self.nodes, databases), database_storage_bytes, 0.0))]:
+            _add(offset + l * n_nodes + j, self.get_variables(name, l, rho, j), 1.0)
+            b_ub.append(np.tile(capacity, self.N_INTERVALS))
+            offset += self.N_INTERVALS * n_nodes
+        l, rho, k = self._grid(len(self.gates))
+        _add(offset + l * len(self.gates) + k, self.get_variables("e", l, rho, k), 1.0)
+        b_ub.append(np.full(self.N_INTERVALS * len(self.gates), outbound_bytes / max(len(self.gates), 1)))
+        self.b_ub = np.concatenate(b_ub)
+        self.a_ub = scipy.sparse.csr_matrix((np.concatenate(values),
+                (np.concatenate(rows), np.concatenate(columns))), shape=(len(self.b_ub), self.n_variables))
+
+        # Bounds. Nodes process their overlays only, links of detached nodes are down
+        self.upper = np.full(self.n_variables, np.inf)
+        l, rho, j = self._grid(n_nodes)
+        not_hosted = ~self.hosts[rho, self.nodes[j]]
+        self.upper[self.get_variables("g", l, rho, j)[not_hosted]] = 0.0
+        l, rho, p = self._grid(len(self.positions))
+        detached = np.zeros((self.N_INTERVALS, self.index.get_n_nodes()), dtype=bool)
+        for li, nodes in enumerate(self.detached):
+            detached[li, list(nodes)] = True
+        down = detached[l, self.position_source[p]] | detached[l, self.position_target[p]]
+        self.upper[self.get_variables("x", l, rho, p)[down]] = 0.0
+
+        # Objective: max. processed, min. dropped
+        self.c = np.zeros(self.n_variables)
+        l, rho, j = self._grid(n_nodes)
+        self.c[self.get_variables("g", l, rho, j)] = -alpha_0
+        self.c[self.get_variables("z", l, rho, j)] = alpha_1
+
+    def solve(self) -> np.ndarray:
+        result = scipy.optimize.linprog(self.c, A_ub=self.a_ub, b_ub=self.b_ub, A_eq=self.a_eq,
+                b_eq=self.b_eq, bounds=np.stack([np.zeros(self.n_variables), self.upper], axis=1),
+                method="highs")
+        if result.status != 0:
+            raise RuntimeError(f"The linear programming model has not been solved: {result.message}")
+        return result.x
+
+    def get_planned_values(self, solution: np.ndarray) -> dict:
+        """ Returns traffic, processing, storage, and drop maps of `VirtualizedNetworkTechnology` """
+        node_ids = self.index.node_ids
+        ret = dict()
+        l, rho, p = self._grid(len(self.positions))
+        x = solution[self.get_variables("x", l, rho, p)]
+        nonzero = np.flatnonzero(x > 0)
+        ret["traffic"] = {(int(l[i]), int(node_ids[self.position_source[p[i]]]),
+                int(node_ids[self.position_target[p[i]]]), int(rho[i])): float(x[i]) for i in nonzero}
+        l, rho, j = self._grid(len(self.nodes))
+        for name, key in [("g", "processing"), ("y", "storage"), ("z", "drop")]:
+            values = solution[self.get_variables(name, l, rho, j)]
+            ret[key] = {(int(l[i]), int(node_ids[self.nodes[j[i]]]), int(rho[i])): float(values[i])
+                    for i in np.flatnonzero(values > 0)}
+        return ret
+
+
+def test_replication_scenario_lp():
+    import howlitbe.scenario.intervals
+
+    technology = VirtualizedNetworkTechnology.new_replication_scenario(j_max=20, rho_max=3,
+            n_databases=3, n_switches_total=5, n_gates=2, inbound_traffic_bytes=100,
+            outbound_traffic_bytes=20, interval_duration=100)
+    assert set(technology.timings.keys()) == {"assembly", "solve"}
+    index = technology.topology.get_index()
+    # Flows only go over physical links
+    physical = {(int(a), int(b)) for (a, b), pos in index.edge_index.items()
+            if np.isfinite(index.edge_bps[index.csr_edge[pos]])}
+    assert all((j, i) in physical for (l, j, i, rho) in technology.traffic.keys())
+    # Everything that enters the network is processed, stored, dropped, or goes out
+    for l in range(3):
+        processed = sum(v for k, v in technology.processing.items() if k[0] == l)
+        assert processed > 0
+        assert processed + sum(v for k, v in technology.drop.items() if k[0] == l) <= 100 + 1e-6
+    # Detached databases are unreachable during the second interval
+    databases = index.node_ids[index.node_kind == howlitbe.topology.NODE_KIND_NODE][:2]
+    assert not any(l == 1 and (j in databases or i in databases)
+            for (l, j, i, rho) in technology.traffic.keys())
+    interval = howlitbe.scenario.intervals.Interval.from_technology(technology, 0, duration=100)
+    assert np.isclose(sum(interval.processing.values()),
+            sum(v for k, v in technology.processing.items() if k[0] == 0))
+    assert np.isclose(sum(interval.drop.values()),
+            sum(v for k, v in technology.drop.items() if k[0] == 0))
+
 
-        # Describes used variables, variable indices, and bounds thereof. Used for linear equation matrix building
-        schema = twoopt.data_processing.Schema(data={
-            "indexbound": {
-                "j": 5, # TODO
-            },
-            "variableindices": {
-                "alpha_0": [],  # Relative importance of maximizing the amount of processed data
-                "alpha_1": [],  # Relative importance of minimizing the amount of dropped data
-                "x": ["j", "i", "rho", "l"],  # Amount of transferred data
-                "y": ["j", "rho", "l"],  # Amount of stored data
-                "g": ["j", "rho", "l"],  # Amount of processed data
-                "z": ["j", "rho", "l"],  # Amount of dropped data
-                "x_eq": ["j", "rho", "l"],  # Balance offset, positive for ingress nodes, negative for outgress
-            }
-        })
+def test_replication_scenario_lp_at_scale():
+    """ 200 nodes, 20 overlays: most of the inbound traffic gets processed, nothing is dropped """
+    inbound = 1e6
+    technology = VirtualizedNetworkTechnology.new_replication_scenario(j_max=200, rho_max=20,
+            n_databases=10, n_switches_total=20, n_gates=4, inbound_traffic_bytes=inbound,
+            outbound_traffic_bytes=1e5)
+    processed = sum(technology.processing.values())
+    assert processed > 0.9 * inbound * 3
+    for l in range(3):
+        assert sum(v for k, v in technology.processing.items() if k[0] == l) > 0.5 * inbound
+    assert sum(technology.drop.values()) < 1e-6 * inbound
@@ -6,11 +6,17 @@ one of its neighbors, or process it.
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 import customtkinter as ctk
 import dataclasses
+import heapq
+import howlitbe.rng
 import howlitbe.topology
+import math
 import matplotlib.pyplot as plt
 import networkx as nx
 import numpy as np
+import os
+import pickle
 import random
+import time
 import tired.logging
 
 
@@ -56,6 +62,17 @@ class NodeAgent:
                 user_arg=None) -> float:
         raise NotImplemented()
 
+    def get_state(self) -> object:
+        """
+        Returns picklable state to be stored in a checkpoint. Stateless
+        agents return None
+        """
+        return None
+
+    def set_state(self, state: object):
+        """ Restores what `get_state` has returned """
+        pass
+
 
 class RandomPassNodeAgent(NodeAgent):
 
@@ -82,7 +99,172 @@ class RandomPassNodeAgent(NodeAgent):
                 self_as_node_object: howlitbe.topology.Node,
                 dt,
                 user_arg=None):
-        return random.randrange(0, len(neighbors_as_agents))
+        return int(howlitbe.rng.get_stream(howlitbe.rng.ROUTING).integers(0,
+                len(neighbors_as_agents)))
+
+
+class BatchedNodeAgent(NodeAgent):
+    """
+    Opt-in batched protocol. Instead of being queried once per pending data
+    unit, an agent is handed all the units that are currently at its node at
+    once, and returns decisions for all of them as an array.
+
+    Scalar agents are exposed through this protocol by
+    `ScalarNodeAgentAdapter`.
+    """
+
+    def get_next_hop_batch(self,
+                simulation,
+                topology: howlitbe.topology.Topology,
+                neighbors_as_agents: list, # Neighbors represented as NodeAgent objects
+                neighbor_node_ids: np.ndarray, # Neighbors represented as howlitbe.topology.Node objects
+                neighbor_mask: np.ndarray, # (n units, n neighbors) bool, whether a neighbor is allowed for a unit
+                self_as_node_object: howlitbe.topology.Node,
+                dt,
+                data_amnts: np.ndarray, # Amount of data carried by each unit
+                user_arg=None) -> np.ndarray:
+        """
+        Returns an array of next hop indices, as listed in
+        `neighbors_as_agents`, or `neighbor_node_ids`, one per unit. Each
+        selected neighbor MUST be allowed by `neighbor_mask`
+        """
+        raise NotImplementedError
+
+    def calc_processed_data_amnt_bytes_batch(self,
+                simulation,
+                topology: howlitbe.topology.Topology,
+                neighbors_as_agents: list, # Neighbors represented as NodeAgent objects
+                neighbor_node_ids: np.ndarray, # Neighbors represented as howlitbe.topology.Node objects
+                self_as_node_object: howlitbe.topology.Node,
+                dt,
+                data_amnts: np.ndarray,
+                user_arg=None) -> np.ndarray:
+        """
+        Returns an array of processed data amounts, one per unit
+        """
+        return data_amnts
+
+
+class ScalarNodeAgentAdapter(BatchedNodeAgent):
+    """
+    Exposes a scalar `NodeAgent` through the batched protocol by querying it
+    once per unit, in the order the units are given.
+    """
+
+    def __init__(self, agent: NodeAgent):
+        self.agent = agent
+
+    def get_next_hop_batch(self,
+                simulation,
+                topology: howlitbe.topology.Topology,
+                neighbors_as_agents: list,
+                neighbor_node_ids: np.ndarray,
+                neighbor_mask: np.ndarray,
+                self_as_node_object: howlitbe.topology.Node,
+                dt,
+                data_amnts: np.ndarray,
+                user_arg=None) -> np.ndarray:
+        ret = np.zeros(len(neighbor_mask), dtype=np.int64)
+        for i, mask in enumerate(neighbor_mask):
+            allowed = np.flatnonzero(mask)
+            inext = self.agent.get_next_hop(
+                    simulation=simulation,
+                    topology=topology,
+                    neighbors_as_agents=[neighbors_as_agents[j] for j in allowed],
+                    neighbor_node_ids=[int(neighbor_node_ids[j]) for j in allowed],
+                    self_as_node_object=self_as_node_object,
+                    dt=dt,
+                    user_arg=user_arg)
+            ret[i] = allowed[inext]
+        return ret
+
+    def calc_processed_data_amnt_bytes_batch(self,
+                simulation,
+                topology: howlitbe.topology.Topology,
+                neighbors_as_agents: list,
+                neighbor_node_ids: np.ndarray,
+                self_as_node_object: howlitbe.topology.Node,
+                dt,
+                data_amnts: np.ndarray,
+                user_arg=None) -> np.ndarray:
+        neighbor_node_ids = [int(i) for i in neighbor_node_ids]
+        return np.array([self.agent.calc_processed_data_amnt_bytes(
+                simulation=simulation,
+                topology=topology,
+                neighbors_as_agents=neighbors_as_agents,
+                neighbor_node_ids=neighbor_node_ids,
+                self_as_node_object=self_as_node_object,
+                dt=dt,
+                data_amnt=data_amnt,
+                user_arg=user_arg) for data_amnt in data_amnts], dtype=np.float64)
+
+
+class BatchedRandomPassNodeAgent(BatchedNodeAgent, RandomPassNodeAgent):
+    """
+    `RandomPassNodeAgent` drawing next hops for all the units at a node w/ a
+    single batch draw from the "routing" stream
+    """
+
+    def get_next_hop_batch(self,
+                simulation,
+                topology: howlitbe.topology.Topology,
+                neighbors_as_agents: list,
+                neighbor_node_ids: np.ndarray,
+                neighbor_mask: np.ndarray,
+                self_as_node_object: howlitbe.topology.Node,
+                dt,
+                data_amnts: np.ndarray,
+                user_arg=None) -> np.ndarray:
+        return howlitbe.rng.choose_allowed(howlitbe.rng.get_stream(howlitbe.rng.ROUTING),
+                neighbor_mask)
+
+    def calc_processed_data_amnt_bytes_batch(self,
+                simulation,
+                topology: howlitbe.topology.Topology,
+                neighbors_as_agents: list,
+                neighbor_node_ids: np.ndarray,
+                self_as_node_object: howlitbe.topology.Node,
+                dt,
+                data_amnts: np.ndarray,
+                user_arg=None) -> np.ndarray:
+        return data_amnts * 0.995
+
+
+class ShortestPathNodeAgent(BatchedRandomPassNodeAgent):
+    """
+    Passes data towards the nearest processing node along a shortest path,
+    looked up in the routing table of the topology (see
+    `Topology.get_routing_table`). Units whose next hop is not allowed are
+    passed at random
+    """
+
+    metric = "hops"
+
+    def get_next_hop_batch(self,
+                simulation,
+                topology: howlitbe.topology.Topology,
+                neighbors_as_agents: list,
+                neighbor_node_ids: np.ndarray,
+                neighbor_mask: np.ndarray,
+                self_as_node_object: howlitbe.topology.Node,
+                dt,
+                data_amnts: np.ndarray,
+                user_arg=None) -> np.ndarray:
+        table = topology.get_routing_table(self.metric)
+        source = topology.get_index().node_index[hash(self_as_node_object)]
+        slot = table.next_hop_slot[table.get_nearest_target_row(np.array([source]))[0], source]
+        ret = np.full(len(neighbor_mask), slot, dtype=np.int64)
+        blocked = (ret < 0) | ~neighbor_mask[np.arange(len(ret)), np.maximum(ret, 0)]
+        if np.any(blocked):
+            ret[blocked] = howlitbe.rng.choose_allowed(
+                    howlitbe.rng.get_stream(howlitbe.rng.ROUTING), neighbor_mask[blocked])
+        return ret
+
+
+def _as_batched_agent(agent: NodeAgent) -> BatchedNodeAgent:
+    if isinstance(agent, BatchedNodeAgent):
+        return agent
+    return ScalarNodeAgentAdapter(agent)
 
 
 @dataclasses.dataclass
@@ -94,51 +276,350 @@ class _PendingData:
 
 
 class _SimStats:
+    """
+    Per-node, and per-directed-edge counters, stored in preallocated arrays.
+    Nodes are addressed by dense indices, directed edges -- by positions in
+    the CSR adjacency (see `howlitbe.topology.TopologyIndex`). Hash-based
+    accessors are kept for convenience.
+
+    Optionally, keeps a ring buffer of the last `history_size` per-step
+    records (amounts processed, and transferred over a step), so throughput
+    curves are available right after a run.
+    """
+
+    def __init__(self, index: howlitbe.topology.TopologyIndex, history_size: int = 0):
+        self.node_index = index.node_index
+        self.edge_index = index.edge_index
+        self.processed = np.zeros(index.get_n_nodes(), dtype=np.float64)
+        self.trasnferred_directed = np.zeros(len(index.indices), dtype=np.float64) # Amt. of transferred data, edge (A, B). (B, A) is a separate entry
+        self.backlog_directed = np.zeros(len(index.indices), dtype=np.float64) # Amt. of data waiting for edge (A, B) at A after the last step
+        self.dropped_directed = np.zeros(len(index.indices), dtype=np.float64) # Amt. of data dropped, as edge (A, B) was congested
+        self.dropped = np.zeros(index.get_n_nodes(), dtype=np.float64) # Amt. of data discarded at a node: dead ends, and switches cut off by topology changes
 
-    def __init__(self):
-        self.processed = dict()
-        self.trasnferred_directed = dict() # Amt. of transferred data, edge (A, B). (B, A) is a separate entry
+        # Ring buffer of per-step records
+        self.history_size = history_size
+        self.history_time = np.zeros(history_size, dtype=np.float64)
+        self.history_processed = np.zeros((history_size, len(self.processed)),
+                dtype=np.float64)
+        self.history_transferred = np.zeros((history_size,
+                len(self.trasnferred_directed)), dtype=np.float64)
+        self.n_recorded = 0
+        self._recorded_processed = np.zeros_like(self.processed)
+        self._recorded_transferred = np.zeros_like(self.trasnferred_directed)
+
+    _STATE_ARRAYS = ["processed", "trasnferred_directed", "backlog_directed", "dropped_directed",
+            "dropped", "history_time", "history_processed", "history_transferred", "_recorded_processed",
+            "_recorded_transferred"]
+
+    def get_state(self) -> dict:
+        """ Returns {name: array} w/ copies of all the counters, see `set_state` """
+        ret = {f"stats_{i}": getattr(self, i).copy() for i in self._STATE_ARRAYS}
+        ret["stats_n_recorded"] = np.array(self.n_recorded)
+        return ret
+
+    def set_state(self, state: dict):
+        for i in self._STATE_ARRAYS:
+            if getattr(self, i).shape != state[f"stats_{i}"].shape:
+                raise ValueError(f"Stats \"{i}\" of a different shape")
+            getattr(self, i)[:] = state[f"stats_{i}"]
+        self.n_recorded = int(state["stats_n_recorded"])
+
+    def remap_edges(self, index: howlitbe.topology.TopologyIndex, old_positions: np.ndarray):
+        """
+        Moves per-edge counters to the CSR positions of a new index of the
+        same nodes. Counters of removed edges are discarded, added edges
+        start from zero
+        - old_positions: for each position of `index`, the position of the
+          same directed edge before the change, or -1
+        """
+        self.edge_index = index.edge_index
+        exists = old_positions >= 0
+
+        def _remap(array: np.ndarray) -> np.ndarray:
+            ret = np.zeros(array.shape[:-1] + (len(old_positions),), dtype=array.dtype)
+            ret[..., exists] = array[..., old_positions[exists]]
+            return ret
+
+        self.trasnferred_directed = _remap(self.trasnferred_directed)
+        self.backlog_directed = _remap(self.backlog_directed)
+        self.dropped_directed = _remap(self.dropped_directed)
+        self.history_transferred = _remap(self.history_transferred)
+        self._recorded_transferred = _remap(self._recorded_transferred)
 
     def get_processed(self, nodeid: int):
-        return self.processed.get(nodeid, 0.0)
+        return float(self.processed[self.node_index[nodeid]])
+
+    def get_dropped(self, nodeid: int):
+        return float(self.dropped[self.node_index[nodeid]])
 
     def get_non_directed_edge_stats(self, nodea: int, nodeb: int):
-        return self.trasnferred_directed.get((nodea, nodeb,), 0.0) \
-                + self.trasnferred_directed.get((nodeb, nodea,), 0.0)
+        return float(self.trasnferred_directed[self.edge_index[(nodea, nodeb,)]]
+                + self.trasnferred_directed[self.edge_index[(nodeb, nodea,)]])
+
+    def get_non_directed_edge_backlog(self, nodea: int, nodeb: int):
+        return float(self.backlog_directed[self.edge_index[(nodea, nodeb,)]]
+                + self.backlog_directed[self.edge_index[(nodeb, nodea,)]])
+
+    def get_non_directed_edge_dropped(self, nodea: int, nodeb: int):
+        return float(self.dropped_directed[self.edge_index[(nodea, nodeb,)]]
+                + self.dropped_directed[self.edge_index[(nodeb, nodea,)]])
 
     def update_transferred(self, nodea: int, nodeb: int, amount: float):
-        self.trasnferred_directed[(nodea, nodeb,)] =\
-                self.trasnferred_directed.get((nodea, nodeb,), 0.0) + amount
+        self.trasnferred_directed[self.edge_index[(nodea, nodeb,)]] += amount
         return self
 
     def update_processed(self, nodeid: int, amount: float):
-        self.processed[nodeid] = self.processed.get(nodeid, 0.0) + amount
+        self.processed[self.node_index[nodeid]] += amount
 
+    def add_transferred(self, positions: np.ndarray, amounts: np.ndarray):
+        """
+        Bulk update. `positions` -- CSR positions of directed edges. Amounts
+        are accumulated in the order they are listed
+        """
+        np.add.at(self.trasnferred_directed, positions, amounts)
+        return self
 
-class Simulation:
+    def add_processed(self, inodes: np.ndarray, amounts: np.ndarray):
+        """ Bulk update. `inodes` -- dense node indices """
+        np.add.at(self.processed, inodes, amounts)
+        return self
+
+    def add_dropped(self, inodes: np.ndarray, amounts: np.ndarray):
+        """ Bulk update. `inodes` -- dense node indices """
+        np.add.at(self.dropped, inodes, amounts)
+        return self
+
+    def record(self, t: float):
+        """
+        Stores amounts processed, and transferred since the previous record
+        into the ring buffer. No-op, if the history is disabled
+        """
+        if self.history_size == 0:
+            return
+        i = self.n_recorded % self.history_size
+        self.history_time[i] = t
+        np.subtract(self.processed, self._recorded_processed,
+                out=self.history_processed[i])
+        np.subtract(self.trasnferred_directed, self._recorded_transferred,
+                out=self.history_transferred[i])
+        self._recorded_processed[:] = self.processed
+        self._recorded_transferred[:] = self.trasnferred_directed
+        self.n_recorded += 1
+
+    def get_history(self):
+        """
+        Returns (time, processed, transferred) arrays of the retained records
+        in chronological order. `processed` is (n records, n nodes),
+        `transferred` is (n records, n directed edges)
+        """
+        n = min(self.n_recorded, self.history_size)
+        order = (np.arange(n) + self.n_recorded - n) % max(self.history_size, 1)
+        return self.history_time[order], self.history_processed[order], \
+                self.history_transferred[order]
+
+    def get_processed_history(self, nodeid: int):
+        """ Returns (time, processed over each step) arrays """
+        t, processed, _ = self.get_history()
+        return t, processed[:, self.node_index[nodeid]]
+
+    def get_non_directed_edge_history(self, nodea: int, nodeb: int):
+        """ Returns (time, transferred over each step) arrays """
+        t, _, transferred = self.get_history()
+        return t, transferred[:, self.edge_index[(nodea, nodeb,)]] \
+                + transferred[:, self.edge_index[(nodeb, nodea,)]]
+
+
+def _get_old_positions(old_index: howlitbe.topology.TopologyIndex,
+            index: howlitbe.topology.TopologyIndex) -> np.ndarray:
+    """
+    For each CSR position of `index`, returns the position of the same
+    directed edge in `old_index`, or -1 for new edges. Node sets of both
+    indices MUST be the same
+    """
+    if not np.array_equal(old_index.node_ids, index.node_ids):
+        raise ValueError("Nodes of a running simulation have changed. Only edges may be changed, "
+                "see `Topology.detach_node`")
+    ret = np.full(len(index.indices), -1, dtype=np.int64)
+    for key, position in index.edge_index.items():
+        ret[position] = old_index.edge_index.get(key, -1)
+    return ret
+
+
+def _save_checkpoint(path: str, simulation, arrays: dict, objects: dict = None):
+    """
+    Writes a checkpoint: `arrays`, stats, and `previous_time` as arrays,
+    Python and NumPy global RNG states, `howlitbe.rng` streams, and agent states (in the order of
+    dense node indices) pickled into a byte array. The file is written
+    under a temporary name, and renamed once complete
+    """
+    objects = dict(
+        kind=simulation.__class__.__name__,
+        random_state=random.getstate(),
+        numpy_random_state=np.random.get_state(),
+        streams_state=howlitbe.rng.get_streams().get_state(),
+        agent_states=[simulation.agent_index[int(i)].get_state() for i in simulation.index.node_ids],
+        extra=objects,
+    )
+    arrays = dict(arrays, **simulation.stats.get_state(),
+            node_ids=simulation.index.node_ids,
+            previous_time=np.array(simulation.previous_time),
+            objects=np.frombuffer(pickle.dumps(objects), dtype=np.uint8))
+    with open(str(path) + ".partial", 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(str(path) + ".partial", path)
+
+
+def _load_checkpoint(path: str, simulation) -> dict:
+    """
+    Restores what `_save_checkpoint` has stored, except for `arrays`, and
+    `objects`, which are returned to the caller
+    """
+    with np.load(path) as data:
+        arrays = dict(data)
+    objects = pickle.loads(arrays.pop("objects").tobytes())
+    if objects["kind"] != simulation.__class__.__name__:
+        raise ValueError(f"Checkpoint of {objects['kind']} can not be restored into "
+                f"{simulation.__class__.__name__}")
+    if not np.array_equal(arrays.pop("node_ids"), simulation.index.node_ids):
+        raise ValueError("Checkpoint was taken on a different topology")
+    simulation.stats.set_state(arrays)
+    simulation.previous_time = float(arrays.pop("previous_time"))
+    for i, state in zip(simulation.index.node_ids, objects["agent_states"]):
+        simulation.agent_index[int(i)].set_state(state)
+    random.setstate(objects["random_state"])
+    np.random.set_state(objects["numpy_random_state"])
+    howlitbe.rng.set_streams(howlitbe.rng.RngStreams.from_state(objects["streams_state"]))
+    return arrays, objects["extra"]
+
+
+def _run(simulation, dt, user_arg, t1, sink, checkpoint_path, checkpoint_interval):
+    """
+    Steps a simulation until `t1`, streaming records into the sink, and
+    writing checkpoints every `checkpoint_interval` seconds of wall time
+    """
+    if sink is not None:
+        sink.open(simulation.index, simulation.stats.processed,
+                simulation.stats.trasnferred_directed)
+    checkpointed_at = time.monotonic()
+    try:
+        while simulation.previous_time < t1:
+            simulation.step(dt, user_arg)
+            if sink is not None:
+                sink.write(simulation.previous_time, simulation.stats.processed,
+                        simulation.stats.trasnferred_directed, simulation.get_pending_count())
+            if checkpoint_path is not None \
+                    and time.monotonic() - checkpointed_at >= checkpoint_interval:
+                if sink is not None:
+                    # Records up to the checkpoint must not get lost
+                    sink.flush()
+                simulation.save_checkpoint(checkpoint_path)
+                checkpointed_at = time.monotonic()
+    finally:
+        # Whatever has been simulated before a failure is still usable
+        if sink is not None:
+            sink.flush()
+
+
+class _LinkCapacity:
+    """
+    Link capacity enforcement shared by `Simulation`, and `VectorSimulation`:
+    a directed edge can carry `PhysicalLink.bps * dt / 8` per step (a token
+    bucket, so a unit larger than that still gets through, and the edge pays
+    it off over the next steps). Units are admitted in the order they are
+    pending, the units that do not fit are either queued at the sending
+    switch (and decided upon again on the next step), or dropped.
+    """
+
+    def _init_link_capacity(self, link_capacity: str):
+        """
+        `link_capacity` - None, "queue", or "drop". What to do w/ the data
+        exceeding link capacity. If None, capacity is not enforced
+        """
+        if link_capacity not in [None, "queue", "drop"]:
+            raise ValueError(f"Unsupported link capacity mode \"{link_capacity}\"")
+        # Edges that are not physical links are not limited
+        self.link_capacity = link_capacity
+        self.position_bytes_per_second = self.index.edge_bps[self.index.csr_edge] / 8
+        self.position_credit = np.zeros(len(self.index.indices), dtype=np.float64)
+
+    def _remap_link_capacity(self, index: howlitbe.topology.TopologyIndex,
+                old_positions: np.ndarray):
+        """ Moves credit to the positions of a new index, see `_SimStats.remap_edges` """
+        credit = np.zeros(len(index.indices), dtype=np.float64)
+        credit[old_positions >= 0] = self.position_credit[old_positions[old_positions >= 0]]
+        self.position_credit = credit
+        self.position_bytes_per_second = index.edge_bps[index.csr_edge] / 8
+
+    def _admit(self, position: np.ndarray, amounts: np.ndarray, dt) -> np.ndarray:
+        """
+        Decides which units fit into the capacity of the edges they are sent
+        over. Updates backlog, and drop counters. Returns a bool mask
+        """
+        # Each edge gets a step's worth of credit, unused credit does not accumulate
+        capacity = self.position_bytes_per_second * dt
+        self.position_credit = np.minimum(self.position_credit + capacity, capacity)
+        self.stats.backlog_directed[:] = 0
+        if len(position) == 0:
+            return np.zeros(0, dtype=bool)
+        # Amount sent over the same edge by the preceding units
+        order = np.argsort(position, kind="stable")
+        sorted_position = position[order]
+        cumulative = np.cumsum(amounts[order])
+        group_start = np.flatnonzero(np.r_[True, sorted_position[1:] != sorted_position[:-1]])
+        group_offset = np.repeat(cumulative[group_start] - amounts[order][group_start],
+                np.diff(np.r_[group_start, len(order)]))
+        preceding = cumulative - amounts[order] - group_offset
+        passes = np.zeros(len(position), dtype=bool)
+        passes[order] = preceding < self.position_credit[sorted_position]
+
+        n_positions = len(self.position_credit)
+        self.position_credit -= np.bincount(position[passes], weights=amounts[passes],
+                minlength=n_positions)
+        blocked = np.bincount(position[~passes], weights=amounts[~passes], minlength=n_positions)
+        if self.link_capacity == "queue":
+            self.stats.backlog_directed[:] = blocked
+        else:
+            self.stats.dropped_directed += blocked
+        return passes
+
+
+class Simulation(_LinkCapacity):
     """
     Engine. On each step, provides agents w/ a lot of available information,
     so they make a decision on how much information they can process w/ over
     delta-t time.
+
+    Optionally, link capacity is enforced, see `_LinkCapacity`.
     """
 
     def __init__(self, network_topology: howlitbe.topology.Topology,
-                node_agent_type: NodeAgent, user_arg):
+                node_agent_type: NodeAgent, user_arg,
+                stats_history_size: int = 0,
+                link_capacity: str = None):
         """
         `user_arg` - implementation-defined argument that is used during
         object construction
+        `stats_history_size` - number of per-step stats records to retain, see
+        `_SimStats`
+        `link_capacity` - see `_LinkCapacity._init_link_capacity`
         """
         self.topology = network_topology
         self.agent_type = node_agent_type
         self.previous_time = 0.0
         self.pending_data: list[_PendingData] = list()
-        self.stats: _SimStats = _SimStats()
+        self.index = self.topology.get_index()
+        self.node_order = self.index.node_index
+        self.stats: _SimStats = _SimStats(self.index, stats_history_size)
+        self._init_link_capacity(link_capacity)
 
         # Initialize agents
         self.agent_index = dict()
+        self.batched_agent_index = dict()
         for inode in self.topology.as_nxgraph().nodes:
             self.agent_index[inode] = self.agent_type(self.topology,
                     inode, user_arg)
+            self.batched_agent_index[inode] = _as_batched_agent(
+                    self.agent_index[inode])
 
     def get_previous_time(self):
         """
@@ -146,12 +627,76 @@ class Simulation:
         """
         return self.previous_time
 
+    def get_pending_count(self) -> int:
+        return len(self.pending_data)
+
+    def apply_topology_changes(self):
+        """
+        Catches up w/ edges that have been changed through the mutation API
+        of the topology (e.g. `Topology.detach_node`). Data waiting at
+        switches that have been cut off entirely is discarded, and counted in
+        `_SimStats.dropped`. Called at the beginning of each step
+        """
+        index = self.topology.get_index()
+        if index is self.index:
+            return
+        old_positions = _get_old_positions(self.index, index)
+        self.stats.remap_edges(index, old_positions)
+        self._remap_link_capacity(index, old_positions)
+        self.index = index
+        self.node_order = index.node_index
+        nx_graph = self.topology.as_nxgraph()
+        keep = [nx_graph.degree[pd.deciding_inode] > 0
+                or not isinstance(nx_graph.nodes[pd.deciding_inode]["data"], howlitbe.topology.Switch)
+                for pd in self.pending_data]
+        discarded = [pd for pd, kept in zip(self.pending_data, keep) if not kept]
+        self.stats.add_dropped(np.array([self.node_order[pd.deciding_inode] for pd in discarded],
+                dtype=np.int64), np.array([pd.data_amount_bytes for pd in discarded], dtype=np.float64))
+        self.pending_data = [pd for pd, kept in zip(self.pending_data, keep) if kept]
+
+    def save_checkpoint(self, path: str):
+        """
+        Writes the state of the simulation: pending data, stats, RNG, and
+        agent states (see `NodeAgent.get_state`). Topology is not stored,
+        the checkpoint is restored into a simulation built on the same one
+        """
+        hops = np.array([len(pd.backtrace_node_ids) for pd in self.pending_data], dtype=np.int64)
+        trace = np.zeros((len(hops), hops.max(initial=0)), dtype=np.int64)
+        for i, pd in enumerate(self.pending_data):
+            trace[i, :hops[i]] = pd.backtrace_node_ids
+        _save_checkpoint(path, self, dict(
+            pending_node=np.array([pd.deciding_inode for pd in self.pending_data], dtype=np.int64),
+            pending_amount=np.array([pd.data_amount_bytes for pd in self.pending_data],
+                    dtype=np.float64),
+            pending_hops=hops,
+            pending_trace=trace,
+            position_credit=self.position_credit))
+
+    def load_checkpoint(self, path: str):
+        """
+        Restores the state written by `save_checkpoint`. The simulation must
+        have been constructed w/ the same topology, and agent type. Global
+        RNG state is restored as well, so the run continues exactly as the
+        checkpointed one would
+        """
+        arrays, _ = _load_checkpoint(path, self)
+        self.position_credit = arrays["position_credit"]
+        self.pending_data = [_PendingData(
+                deciding_inode=int(inode),
+                backtrace_nodes_as_agents=[self.agent_index[int(i)] for i in trace[:hops]],
+                backtrace_node_ids=[int(i) for i in trace[:hops]],
+                data_amount_bytes=float(amount))
+                for inode, amount, hops, trace in zip(arrays["pending_node"],
+                arrays["pending_amount"], arrays["pending_hops"], arrays["pending_trace"])]
+
     def step(self, dt, user_arg):
         """
         `user_arg` -- gets passed as a custom argument to all agent nodes that
         are subject to data processing.
         POST: `get_previous_time` is incremented by `delta-t`
         """
+        self.apply_topology_changes()
+
         # Generate inbound traffic
         for inode in self.topology.as_nxgraph().nodes:
             node_object = self.topology.as_nxgraph().nodes[inode]["data"]
@@ -169,71 +714,568 @@ class Simulation:
                         backtrace_node_ids=list(),
                         data_amount_bytes=data_amount))
 
-        # Process pending data
-        new_pending_data = list()
+        # Group pending data by the deciding node, so each agent is queried
+        # once per step. Groups are visited in the order of nodes
+        nx_graph = self.topology.as_nxgraph()
+        groups = dict()
         for pd in self.pending_data:
-            agent_object: NodeAgent = self.agent_index[pd.deciding_inode]
-            if isinstance(self.topology.as_nxgraph().nodes[pd.deciding_inode]["data"],
-                        howlitbe.topology.Switch):
-                # Get neighboring nodes excluding those from backtrace
-                neighbor_nodes: list[int] = [i for i in \
-                        self.topology.as_nxgraph().neighbors(pd.deciding_inode)
-                        if i not in map(hash,
-                        pd.backtrace_node_ids)]
-
-                # Topological dead-ends are not handled here
-                assert len(neighbor_nodes)
-
-                neighbor_agents: list[NodeAgent] = \
-                        [self.agent_index[i] for i in neighbor_nodes]
-                inext = agent_object.get_next_hop(
+            groups.setdefault(pd.deciding_inode, list()).append(pd)
+        new_pending_data = [pd for pd in self.pending_data if isinstance(
+                nx_graph.nodes[pd.deciding_inode]["data"], howlitbe.topology.Switch)]
+        moves = dict()  # {id(pd): (CSR position, next node)} for the units at switches
+        dead_ends = set()  # {id(pd)} for the units that have nowhere to go
+        for inode in sorted(groups.keys(), key=self.node_order.__getitem__):
+            group: list[_PendingData] = groups[inode]
+            node_object = nx_graph.nodes[inode]["data"]
+            agent_object: BatchedNodeAgent = self.batched_agent_index[inode]
+            neighbor_nodes: list[int] = list(nx_graph.neighbors(inode))
+            neighbor_agents: list[NodeAgent] = \
+                    [self.agent_index[i] for i in neighbor_nodes]
+            data_amnts = np.array([pd.data_amount_bytes for pd in group],
+                    dtype=np.float64)
+            if isinstance(node_object, howlitbe.topology.Switch):
+                # Exclude neighbors from backtrace
+                neighbor_mask = np.array([[i not in pd.backtrace_node_ids
+                        for i in neighbor_nodes] for pd in group],
+                        dtype=bool).reshape(len(group), len(neighbor_nodes))
+
+                # Units at topological dead-ends are dropped
+                alive = neighbor_mask.any(axis=1)
+                if not np.all(alive):
+                    self.stats.add_dropped(np.full(np.count_nonzero(~alive), self.node_order[inode]),
+                            data_amnts[~alive])
+                    dead_ends.update(id(pd) for pd, i in zip(group, alive) if not i)
+                    group = [pd for pd, i in zip(group, alive) if i]
+                    neighbor_mask = neighbor_mask[alive]
+                    data_amnts = data_amnts[alive]
+                    if len(group) == 0:
+                        continue
+
+                inext = agent_object.get_next_hop_batch(
+                        simulation=self,
+                        topology=self.topology,
+                        neighbors_as_agents=neighbor_agents,
+                        neighbor_node_ids=np.array(neighbor_nodes, dtype=np.int64),
+                        neighbor_mask=neighbor_mask,
+                        self_as_node_object=node_object,
+                        dt=dt,
+                        data_amnts=data_amnts,
+                        user_arg=user_arg)
+                for pd, i in zip(group, inext):
+                    moves[id(pd)] = (self.index.indptr[self.node_order[inode]] + i, neighbor_nodes[i])
+            elif isinstance(node_object, howlitbe.topology.Node):
+                processed_amnts = agent_object.calc_processed_data_amnt_bytes_batch(
                         simulation=self,
                         topology=self.topology,
                         neighbors_as_agents=neighbor_agents,
-                        neighbor_node_ids=neighbor_nodes,
-                        self_as_node_object=agent_object,
+                        neighbor_node_ids=np.array(neighbor_nodes, dtype=np.int64),
+                        self_as_node_object=node_object,
                         dt=dt,
+                        data_amnts=data_amnts,
                         user_arg=user_arg)
                 # Update the stats
-                self.stats.update_transferred(pd.deciding_inode,
-                        neighbor_nodes[inext],
-                        pd.data_amount_bytes)
+                self.stats.add_processed(
+                        np.full(len(group), self.node_order[inode]),
+                        processed_amnts)
+            else:
+                raise TypeError(f"Unsupported type {node_object.__class__}")
 
-                pd.backtrace_nodes_as_agents.append(
-                        self.agent_index[pd.deciding_inode])
+        # Move the units. Link capacity is given out in the order of pending
+        # data, the same way `VectorSimulation` does it
+        new_pending_data = [pd for pd in new_pending_data if id(pd) not in dead_ends]
+        position = np.array([moves[id(pd)][0] for pd in new_pending_data], dtype=np.int64)
+        amounts = np.array([pd.data_amount_bytes for pd in new_pending_data], dtype=np.float64)
+        if self.link_capacity is None:
+            passes = np.ones(len(new_pending_data), dtype=bool)
+        else:
+            passes = self._admit(position, amounts, dt)
+        # Update the stats
+        self.stats.add_transferred(position[passes], amounts[passes])
+        for pd, passed in zip(new_pending_data, passes):
+            if passed:
+                pd.backtrace_nodes_as_agents.append(self.agent_index[pd.deciding_inode])
                 pd.backtrace_node_ids.append(pd.deciding_inode)
-                pd.deciding_inode = neighbor_nodes[hash(inext)]
-                new_pending_data.append(pd)
-            elif isinstance(self.topology.as_nxgraph().nodes[pd.deciding_inode]["data"], howlitbe.topology.Node):
-                neighbor_agents = [self.agent_index[i] for i in \
-                        self.topology.as_nxgraph().neighbors(pd.deciding_inode)]
-                neighbor_nodes = [i for i in \
-                        self.topology.as_nxgraph().neighbors(hash(pd.deciding_inode))]
-                processed_amnt = agent_object.calc_processed_data_amnt_bytes(
+                pd.deciding_inode = moves[id(pd)][1]
+        if self.link_capacity == "drop":
+            new_pending_data = [pd for pd, passed in zip(new_pending_data, passes) if passed]
+        self.pending_data = new_pending_data
+
+        self.previous_time += dt
+        self.stats.record(self.previous_time)
+
+    def run(self, dt, user_arg, t1, sink=None, checkpoint_path: str = None,
+                checkpoint_interval: float = 600.0):
+        """
+        `dt` - simulation step [s]
+        `user_arg` - custom user argument
+        `t1` - sim. duration [s]
+        `sink` - `howlitbe.simsink.SimulationSink` receiving a record after
+        each step
+        `checkpoint_path` - if set, a checkpoint is written there every
+        `checkpoint_interval` seconds (wall time), see `save_checkpoint`
+        """
+        _run(self, dt, user_arg, t1, sink, checkpoint_path, checkpoint_interval)
+
+
+class VectorSimulation(_LinkCapacity):
+    """
+    Array-backed counterpart of `Simulation`. Pending data is kept as NumPy
+    arrays (current node, amount, hop count, backtrace) over a CSR adjacency
+    that is built once from the topology, so moving, filtering, and
+    accounting the pending units is done in bulk on each step.
+
+    Agents are queried through the batched protocol, in the same order
+    `Simulation` queries them, so both engines produce identical results
+    under the same seed.
+
+    Optionally, link capacity is enforced, see `_LinkCapacity`.
+    """
+
+    def __init__(self, network_topology: howlitbe.topology.Topology,
+                node_agent_type: NodeAgent, user_arg,
+                stats_history_size: int = 0,
+                link_capacity: str = None):
+        """
+        `user_arg` - implementation-defined argument that is used during
+        object construction
+        `stats_history_size` - number of per-step stats records to retain, see
+        `_SimStats`
+        `link_capacity` - see `_LinkCapacity._init_link_capacity`
+        """
+        self.topology = network_topology
+        self.agent_type = node_agent_type
+        self.previous_time = 0.0
+
+        # Dense node index, and CSR adjacency
+        self.index = self.topology.get_index()
+        self.node_ids = self.index.node_ids
+        self.node_objects = self.index.node_objects
+        self.adjacency_indptr = self.index.indptr
+        self.adjacency_indices = self.index.indices
+        self.node_is_gate = self.index.node_kind == howlitbe.topology.NODE_KIND_GATE
+        self.node_is_switch = self.node_is_gate \
+                | (self.index.node_kind == howlitbe.topology.NODE_KIND_SWITCH)
+        self.node_is_node = self.index.node_kind == howlitbe.topology.NODE_KIND_NODE
+
+        self._init_link_capacity(link_capacity)
+
+        # Pending data. `pending_trace` holds dense indices of the nodes a unit
+        # has already passed, -1 for unused slots
+        self.pending_node = np.zeros(0, dtype=np.int64)
+        self.pending_amount = np.zeros(0, dtype=np.float64)
+        self.pending_hops = np.zeros(0, dtype=np.int64)
+        self.pending_trace = np.full((0, 1), -1, dtype=np.int64)
+
+        self.stats = _SimStats(self.index, stats_history_size)
+
+        # Initialize agents
+        self.agents = [self.agent_type(self.topology, int(inode), user_arg)
+                for inode in self.node_ids]
+        self.agent_index = {int(inode): agent for inode, agent
+                in zip(self.node_ids, self.agents)}
+        self.batched_agents = [_as_batched_agent(i) for i in self.agents]
+
+    def get_previous_time(self):
+        """
+        "Current" time, i.e. before delta-t increment
+        """
+        return self.previous_time
+
+    def get_pending_count(self) -> int:
+        return len(self.pending_node)
+
+    def apply_topology_changes(self):
+        """ See `Simulation.apply_topology_changes` """
+        index = self.topology.get_index()
+        if index is self.index:
+            return
+        old_positions = _get_old_positions(self.index, index)
+        self.stats.remap_edges(index, old_positions)
+        self._remap_link_capacity(index, old_positions)
+        self.index = index
+        self.adjacency_indptr = index.indptr
+        self.adjacency_indices = index.indices
+        keep = ~self.node_is_switch[self.pending_node] | (index.get_degree()[self.pending_node] > 0)
+        self.stats.add_dropped(self.pending_node[~keep], self.pending_amount[~keep])
+        self.pending_node = self.pending_node[keep]
+        self.pending_amount = self.pending_amount[keep]
+        self.pending_hops = self.pending_hops[keep]
+        self.pending_trace = self.pending_trace[keep]
+
+    def save_checkpoint(self, path: str):
+        """ See `Simulation.save_checkpoint` """
+        _save_checkpoint(path, self, dict(
+            pending_node=self.pending_node,
+            pending_amount=self.pending_amount,
+            pending_hops=self.pending_hops,
+            pending_trace=self.pending_trace,
+            position_credit=self.position_credit))
+
+    def load_checkpoint(self, path: str):
+        """ See `Simulation.load_checkpoint` """
+        arrays, _ = _load_checkpoint(path, self)
+        self.pending_node = arrays["pending_node"]
+        self.pending_amount = arrays["pending_amount"]
+        self.pending_hops = arrays["pending_hops"]
+        self.pending_trace = arrays["pending_trace"]
+        self.position_credit = arrays["position_credit"]
+
+    def _push_pending(self, inodes: np.ndarray, amounts: np.ndarray):
+        """ Appends new data units located at nodes w/ dense indices `inodes` """
+        n = len(inodes)
+        self.pending_node = np.concatenate([self.pending_node, inodes])
+        self.pending_amount = np.concatenate([self.pending_amount, amounts])
+        self.pending_hops = np.concatenate([self.pending_hops,
+                np.zeros(n, dtype=np.int64)])
+        self.pending_trace = np.concatenate([self.pending_trace,
+                np.full((n, self.pending_trace.shape[1]), -1, dtype=np.int64)])
+
+    def step(self, dt, user_arg):
+        """
+        `user_arg` -- gets passed as a custom argument to all agent nodes that
+        are subject to data processing.
+        POST: `get_previous_time` is incremented by `delta-t`
+        """
+        self.apply_topology_changes()
+
+        # Generate inbound traffic
+        gates = np.flatnonzero(self.node_is_gate)
+        amounts = np.array([self.agents[i].generate_inbound_data(
+                simulation=self,
+                topology=self.topology,
+                self_as_node_object=self.node_objects[i],
+                dt=dt,
+                user_arg=user_arg) for i in gates], dtype=np.float64)
+        self._push_pending(gates, amounts)
+
+        at_switch = self.node_is_switch[self.pending_node]
+        at_node = self.node_is_node[self.pending_node] & ~at_switch
+
+        # Agent decisions. Units are grouped by node, so each agent is queried
+        # once per step, in the same order `Simulation` queries them
+        order = np.argsort(self.pending_node, kind="stable")
+        group_nodes, group_start, group_size = np.unique(
+                self.pending_node[order], return_index=True, return_counts=True)
+        choice = np.zeros(len(self.pending_node), dtype=np.int64)
+        processed = np.zeros(len(self.pending_node), dtype=np.float64)
+        dead_end = np.zeros(len(self.pending_node), dtype=bool)
+        for inode, start, size in zip(group_nodes, group_start, group_size):
+            units = order[start:start + size]
+            agent_object: BatchedNodeAgent = self.batched_agents[inode]
+            neighbor_nodes = self.adjacency_indices[
+                    self.adjacency_indptr[inode]:self.adjacency_indptr[inode + 1]]
+            neighbor_agents = [self.agents[j] for j in neighbor_nodes]
+            if self.node_is_switch[inode]:
+                # Exclude neighbors from backtrace
+                neighbor_mask = np.all(self.pending_trace[units][:, :, None]
+                        != neighbor_nodes[None, None, :], axis=1)
+
+                # Units at topological dead-ends are dropped
+                alive = neighbor_mask.any(axis=1)
+                if not np.all(alive):
+                    self.stats.add_dropped(self.pending_node[units[~alive]],
+                            self.pending_amount[units[~alive]])
+                    dead_end[units[~alive]] = True
+                    units = units[alive]
+                    neighbor_mask = neighbor_mask[alive]
+                    if len(units) == 0:
+                        continue
+
+                choice[units] = agent_object.get_next_hop_batch(
                         simulation=self,
                         topology=self.topology,
                         neighbors_as_agents=neighbor_agents,
-                        neighbor_node_ids=neighbor_nodes,
-                        self_as_node_object=agent_object,
+                        neighbor_node_ids=self.node_ids[neighbor_nodes],
+                        neighbor_mask=neighbor_mask,
+                        self_as_node_object=self.node_objects[inode],
                         dt=dt,
-                        data_amnt=pd.data_amount_bytes,
+                        data_amnts=self.pending_amount[units],
+                        user_arg=user_arg)
+            elif self.node_is_node[inode]:
+                processed[units] = agent_object.calc_processed_data_amnt_bytes_batch(
+                        simulation=self,
+                        topology=self.topology,
+                        neighbors_as_agents=neighbor_agents,
+                        neighbor_node_ids=self.node_ids[neighbor_nodes],
+                        self_as_node_object=self.node_objects[inode],
+                        dt=dt,
+                        data_amnts=self.pending_amount[units],
                         user_arg=user_arg)
-                # Update the stats
-                self.stats.update_processed(pd.deciding_inode, processed_amnt)
             else:
-                raise TypeError(f"Unsupported type {pd.__class__}")
-        self.pending_data = new_pending_data
+                raise TypeError(f"Unsupported type {self.node_objects[inode].__class__}")
+
+        iswitch = np.flatnonzero(at_switch & ~dead_end)
+        current = self.pending_node[iswitch]
+        position = self.adjacency_indptr[current] + choice[iswitch]
+        if self.link_capacity is None:
+            passes = np.ones(len(iswitch), dtype=bool)
+        else:
+            passes = self._admit(position, self.pending_amount[iswitch], dt)
+
+        # Update the stats. `np.add.at` accumulates in the order of units,
+        # just like the scalar engine does
+        self.stats.add_transferred(position[passes], self.pending_amount[iswitch[passes]])
+        self.stats.add_processed(self.pending_node[at_node], processed[at_node])
+
+        # Move the units that are still in transit, drop the processed ones
+        moving = iswitch[passes]
+        hops = self.pending_hops[moving]
+        if len(hops) and hops.max() >= self.pending_trace.shape[1]:
+            self.pending_trace = np.concatenate([self.pending_trace,
+                    np.full(self.pending_trace.shape, -1, dtype=np.int64)], axis=1)
+        self.pending_trace[moving, hops] = current[passes]
+        self.pending_node[moving] = self.adjacency_indices[position[passes]]
+        self.pending_hops[moving] = hops + 1
+        keep = np.zeros(len(self.pending_node), dtype=bool)
+        keep[moving] = True
+        if self.link_capacity == "queue":
+            keep[iswitch[~passes]] = True
+        self.pending_node = self.pending_node[keep]
+        self.pending_amount = self.pending_amount[keep]
+        self.pending_hops = self.pending_hops[keep]
+        self.pending_trace = self.pending_trace[keep]
 
-        self.previous_time += 1
+        self.previous_time += dt
+        self.stats.record(self.previous_time)
 
-    def run(self, dt, user_arg, t1):
+    def run(self, dt, user_arg, t1, sink=None, checkpoint_path: str = None,
+                checkpoint_interval: float = 600.0):
         """
         `dt` - simulation step [s]
         `user_arg` - custom user argument
         `t1` - sim. duration [s]
+        `sink` - `howlitbe.simsink.SimulationSink` receiving a record after
+        each step
+        `checkpoint_path` - if set, a checkpoint is written there every
+        `checkpoint_interval` seconds (wall time), see `save_checkpoint`
+        """
+        _run(self, dt, user_arg, t1, sink, checkpoint_path, checkpoint_interval)
+
+
+_EVENT_GENERATE = 0
+_EVENT_ARRIVE = 1
+_EVENT_PROCESSED = 2
+
+
+class EventSimulation:
+    """
+    Discrete-event counterpart of `Simulation`. Instead of jumping one hop
+    per step, a data unit occupies links, and nodes for as long as the
+    topology says it should:
+
+    - a link is a FIFO server per direction. Sending a unit takes
+      `amount * 8 / PhysicalLink.bps` seconds (serialization delay), plus
+      `link_latency`. Units waiting for a busy link queue at the sending
+      switch
+    - a node is a FIFO server too, processing a unit takes
+      `amount / node_processing_rate` seconds
+
+    Events are kept in a heap, so idle periods cost nothing. `step` processes
+    the events scheduled before `previous_time + dt`, stats get recorded once
+    per step, the same way the other engines do it.
+
+    Agents get the step `dt` in `calc_processed_data_amnt_bytes_batch`, just
+    like in the step-based engines, regardless of how long the unit occupies
+    the node.
+    """
+
+    def __init__(self, network_topology: howlitbe.topology.Topology,
+                node_agent_type: NodeAgent, user_arg,
+                stats_history_size: int = 0,
+                generation_interval: float = None,
+                link_latency: float = 0.0,
+                node_processing_rate: float = None):
+        """
+        `user_arg` - implementation-defined argument that is used during
+        object construction
+        `stats_history_size` - number of per-step stats records to retain, see
+        `_SimStats`
+        `generation_interval` - gates generate traffic each
+        `generation_interval` seconds. If None, once per step
+        `link_latency` - propagation delay of each link [s]
+        `node_processing_rate` - amount of data a node processes per second.
+        If None, processing is instantaneous
+        """
+        self.topology = network_topology
+        self.agent_type = node_agent_type
+        self.previous_time = 0.0
+        self.generation_interval = generation_interval
+        self.link_latency = link_latency
+        self.node_processing_rate = node_processing_rate
+
+        self.index = self.topology.get_index()
+        self.node_ids = self.index.node_ids
+        self.node_objects = self.index.node_objects
+        self.adjacency_indptr = self.index.indptr
+        self.adjacency_indices = self.index.indices
+        self.node_is_gate = self.index.node_kind == howlitbe.topology.NODE_KIND_GATE
+        self.node_is_switch = self.node_is_gate \
+                | (self.index.node_kind == howlitbe.topology.NODE_KIND_SWITCH)
+        self.node_is_node = self.index.node_kind == howlitbe.topology.NODE_KIND_NODE
+        # Time (s) it takes to send a byte over each directed edge
+        self.position_seconds_per_byte = 8.0 / self.index.edge_bps[self.index.csr_edge]
+        # Time each server gets free at
+        self.link_free_at = np.zeros(len(self.adjacency_indices), dtype=np.float64)
+        self.node_free_at = np.zeros(self.index.get_n_nodes(), dtype=np.float64)
+
+        self.events = list()  # Heap of (time, sequence number, kind, dense node, amount, trace, generated at)
+        self.n_events = 0
+        self.n_in_flight = 0
+        self.stats = _SimStats(self.index, stats_history_size)
+        self.latencies = list()
+        """ Time b/w generation, and processing of each processed unit [s] """
+
+        # Initialize agents
+        self.agents = [self.agent_type(self.topology, int(inode), user_arg)
+                for inode in self.node_ids]
+        self.agent_index = {int(inode): agent for inode, agent
+                in zip(self.node_ids, self.agents)}
+        self.batched_agents = [_as_batched_agent(i) for i in self.agents]
+
+        if self.generation_interval is not None:
+            for i in np.flatnonzero(self.node_is_gate):
+                self._push(0.0, _EVENT_GENERATE, i)
+
+    def get_previous_time(self):
+        """
+        "Current" time, i.e. before delta-t increment
+        """
+        return self.previous_time
+
+    def get_pending_count(self) -> int:
+        """ Number of units being transferred, queued, or processed """
+        return self.n_in_flight
+
+    def save_checkpoint(self, path: str):
+        """ See `Simulation.save_checkpoint`. Scheduled events are pickled as they are """
+        _save_checkpoint(path, self, dict(
+            link_free_at=self.link_free_at,
+            node_free_at=self.node_free_at,
+            latencies=np.array(self.latencies, dtype=np.float64)),
+            dict(events=self.events, n_events=self.n_events, n_in_flight=self.n_in_flight))
+
+    def load_checkpoint(self, path: str):
+        """ See `Simulation.load_checkpoint` """
+        arrays, objects = _load_checkpoint(path, self)
+        self.link_free_at = arrays["link_free_at"]
+        self.node_free_at = arrays["node_free_at"]
+        self.latencies = arrays["latencies"].tolist()
+        self.events = objects["events"]
+        self.n_events = objects["n_events"]
+        self.n_in_flight = objects["n_in_flight"]
+
+    def _push(self, t: float, kind: int, inode: int, amount: float = 0.0,
+                trace: tuple = (), generated_at: float = 0.0):
+        heapq.heappush(self.events, (t, self.n_events, kind, inode, amount, trace, generated_at))
+        self.n_events += 1
+
+    def _generate(self, t: float, inode: int, dt: float, user_arg):
+        amount = self.agents[inode].generate_inbound_data(
+                simulation=self,
+                topology=self.topology,
+                self_as_node_object=self.node_objects[inode],
+                dt=dt,
+                user_arg=user_arg)
+        if amount > 0:
+            self.n_in_flight += 1
+            self._push(t, _EVENT_ARRIVE, inode, amount, (), t)
+
+    def _arrive(self, t: float, inode: int, amount: float, trace: tuple, generated_at: float,
+                dt: float, user_arg):
+        neighbor_nodes = self.adjacency_indices[
+                self.adjacency_indptr[inode]:self.adjacency_indptr[inode + 1]]
+        neighbor_agents = [self.agents[j] for j in neighbor_nodes]
+        data_amnts = np.array([amount], dtype=np.float64)
+        if self.node_is_switch[inode]:
+            # Exclude neighbors from backtrace
+            neighbor_mask = np.array([[j not in trace for j in neighbor_nodes]], dtype=bool)
+
+            # Units at topological dead-ends are dropped
+            if not neighbor_mask.any():
+                self.stats.add_dropped(np.array([inode]), data_amnts)
+                self.n_in_flight -= 1
+                return
+
+            choice = self.batched_agents[inode].get_next_hop_batch(
+                    simulation=self,
+                    topology=self.topology,
+                    neighbors_as_agents=neighbor_agents,
+                    neighbor_node_ids=self.node_ids[neighbor_nodes],
+                    neighbor_mask=neighbor_mask,
+                    self_as_node_object=self.node_objects[inode],
+                    dt=dt,
+                    data_amnts=data_amnts,
+                    user_arg=user_arg)[0]
+            position = self.adjacency_indptr[inode] + choice
+            # Queue at the switch until the link is free
+            start = max(t, self.link_free_at[position])
+            self.link_free_at[position] = start + amount * self.position_seconds_per_byte[position]
+            self.stats.add_transferred(np.array([position]), data_amnts)
+            self._push(self.link_free_at[position] + self.link_latency, _EVENT_ARRIVE,
+                    int(self.adjacency_indices[position]), amount, trace + (inode,), generated_at)
+        elif self.node_is_node[inode]:
+            processing_time = 0.0 if self.node_processing_rate is None \
+                    else amount / self.node_processing_rate
+            processed = self.batched_agents[inode].calc_processed_data_amnt_bytes_batch(
+                    simulation=self,
+                    topology=self.topology,
+                    neighbors_as_agents=neighbor_agents,
+                    neighbor_node_ids=self.node_ids[neighbor_nodes],
+                    self_as_node_object=self.node_objects[inode],
+                    dt=dt,
+                    data_amnts=data_amnts,
+                    user_arg=user_arg)[0]
+            start = max(t, self.node_free_at[inode])
+            self.node_free_at[inode] = start + processing_time
+            self._push(self.node_free_at[inode], _EVENT_PROCESSED, inode, processed, (), generated_at)
+        else:
+            raise TypeError(f"Unsupported type {self.node_objects[inode].__class__}")
+
+    def step(self, dt, user_arg):
+        """
+        Processes the events scheduled before `previous_time + dt`.
+        `user_arg` -- gets passed as a custom argument to all agent nodes that
+        are subject to data processing. Topology changes are not supported,
+        the topology MUST stay as it was when the simulation was constructed.
+        POST: `get_previous_time` is incremented by `delta-t`
+        """
+        if self.topology.get_index() is not self.index:
+            raise ValueError("Topology of a running `EventSimulation` has changed, use `Simulation`, "
+                    "or `VectorSimulation` to simulate topology changes")
+        if self.generation_interval is None:
+            for i in np.flatnonzero(self.node_is_gate):
+                self._push(self.previous_time, _EVENT_GENERATE, i)
+        horizon = self.previous_time + dt
+        while len(self.events) > 0 and self.events[0][0] < horizon:
+            t, _, kind, inode, amount, trace, generated_at = heapq.heappop(self.events)
+            if kind == _EVENT_GENERATE:
+                if self.generation_interval is None:
+                    self._generate(t, inode, dt, user_arg)
+                else:
+                    self._generate(t, inode, self.generation_interval, user_arg)
+                    self._push(t + self.generation_interval, _EVENT_GENERATE, inode)
+            elif kind == _EVENT_ARRIVE:
+                self._arrive(t, inode, amount, trace, generated_at, dt, user_arg)
+            elif kind == _EVENT_PROCESSED:
+                self.stats.add_processed(np.array([inode]), np.array([amount]))
+                self.latencies.append(t - generated_at)
+                self.n_in_flight -= 1
+
+        self.previous_time = horizon
+        self.stats.record(self.previous_time)
+
+    def run(self, dt, user_arg, t1, sink=None, checkpoint_path: str = None,
+                checkpoint_interval: float = 600.0):
+        """
+        `dt` - stats recording interval [s]
+        `user_arg` - custom user argument
+        `t1` - sim. duration [s]
+        `sink` - `howlitbe.simsink.SimulationSink` receiving a record after
+        each step
+        `checkpoint_path` - if set, a checkpoint is written there every
+        `checkpoint_interval` seconds (wall time), see `save_checkpoint`
         """
-        while self.previous_time < t1:
-            self.step(dt, user_arg)
+        _run(self, dt, user_arg, t1, sink, checkpoint_path, checkpoint_interval)
 
 
 class SimTraceApp:
@@ -385,3 +1427,458 @@ def test_inbound_passing_w_termination():
     if False:
         topology.render()
         simulation.run()
+
+
+def test_vector_simulation_matches_simulation():
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=5,
+            n_gates=2,
+            n_nodes=20,
+            images_count={
+                "image 1": 30,
+                "image 2": 30,
+            },
+            n_overlays=5,
+            image_commands={})
+    for agent_type in [RandomPassNodeAgent, BatchedRandomPassNodeAgent]:
+        howlitbe.rng.seed(42)
+        simulation = Simulation(topology, agent_type, None)
+        simulation.run(1.0, None, 20)
+        howlitbe.rng.seed(42)
+        vector_simulation = VectorSimulation(topology, agent_type, None)
+        vector_simulation.run(1.0, None, 20)
+
+        nx_graph = topology.as_nxgraph()
+        assert len(simulation.pending_data) == vector_simulation.get_pending_count()
+        for inode in nx_graph.nodes:
+            assert simulation.stats.get_processed(inode) \
+                    == vector_simulation.stats.get_processed(inode)
+        for nodea, nodeb in nx_graph.edges:
+            assert simulation.stats.get_non_directed_edge_stats(nodea, nodeb) \
+                    == vector_simulation.stats.get_non_directed_edge_stats(nodea, nodeb)
+
+
+def test_batched_agent_matches_scalar_agent():
+    class FirstHopNodeAgent(RandomPassNodeAgent):
+
+        def get_next_hop(self, simulation, topology, neighbors_as_agents,
+                    neighbor_node_ids, self_as_node_object, dt, user_arg=None):
+            return 0
+
+    class BatchedFirstHopNodeAgent(BatchedNodeAgent, RandomPassNodeAgent):
+
+        def get_next_hop_batch(self, simulation, topology, neighbors_as_agents,
+                    neighbor_node_ids, neighbor_mask, self_as_node_object, dt,
+                    data_amnts, user_arg=None):
+            return np.argmax(neighbor_mask, axis=1)
+
+        def calc_processed_data_amnt_bytes_batch(self, simulation, topology,
+                    neighbors_as_agents, neighbor_node_ids, self_as_node_object,
+                    dt, data_amnts, user_arg=None):
+            return data_amnts * 0.995
+
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=5,
+            n_gates=2,
+            n_nodes=20,
+            images_count={
+                "image 1": 30,
+            },
+            n_overlays=5,
+            image_commands={})
+    simulations = [simulation_type(topology, agent_type, None)
+            for simulation_type in [Simulation, VectorSimulation]
+            for agent_type in [FirstHopNodeAgent, BatchedFirstHopNodeAgent]]
+    for simulation in simulations:
+        simulation.run(1.0, None, 10)
+
+    nx_graph = topology.as_nxgraph()
+    for simulation in simulations[1:]:
+        for inode in nx_graph.nodes:
+            assert simulations[0].stats.get_processed(inode) \
+                    == simulation.stats.get_processed(inode)
+        for nodea, nodeb in nx_graph.edges:
+            assert simulations[0].stats.get_non_directed_edge_stats(nodea, nodeb) \
+                    == simulation.stats.get_non_directed_edge_stats(nodea, nodeb)
+
+
+def test_stats_history():
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=5,
+            n_gates=2,
+            n_nodes=20,
+            images_count={
+                "image 1": 30,
+            },
+            n_overlays=5,
+            image_commands={})
+    simulation = VectorSimulation(topology, RandomPassNodeAgent, None,
+            stats_history_size=8)
+    simulation.run(1.0, None, 20)
+
+    # Only the last records are retained, in chronological order
+    t, processed, transferred = simulation.stats.get_history()
+    assert np.array_equal(t, np.arange(13, 21))
+    assert processed.shape == (8, topology.as_nxgraph().number_of_nodes())
+    # Records add up to the totals
+    simulation = VectorSimulation(topology, RandomPassNodeAgent, None,
+            stats_history_size=20)
+    simulation.run(1.0, None, 20)
+    for inode in topology.as_nxgraph().nodes:
+        _, processed = simulation.stats.get_processed_history(inode)
+        assert math.isclose(processed.sum(), simulation.stats.get_processed(inode))
+    for nodea, nodeb in topology.as_nxgraph().edges:
+        _, transferred = simulation.stats.get_non_directed_edge_history(nodea, nodeb)
+        assert math.isclose(transferred.sum(),
+                simulation.stats.get_non_directed_edge_stats(nodea, nodeb))
+
+
+def test_step_advances_time_by_dt():
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=2,
+            n_gates=1,
+            n_nodes=4,
+            images_count={
+                "image 1": 4,
+            },
+            n_overlays=2,
+            image_commands={})
+    for simulation_type in [Simulation, VectorSimulation, EventSimulation]:
+        simulation = simulation_type(topology, RandomPassNodeAgent, None, stats_history_size=4)
+        simulation.run(0.5, None, 2)
+        assert simulation.get_previous_time() == 2.0
+        assert list(simulation.stats.get_history()[0]) == [0.5, 1.0, 1.5, 2.0]
+
+
+def test_event_simulation_delays():
+    """ Serialization delays, queueing for a busy link, and at a busy node """
+
+    class _OnceToNodeAgent(BatchedNodeAgent):
+        """ Gates generate 10 bytes at t=0, switches pass data towards nodes """
+
+        def __init__(self, topology, inode, user_constructor_arg):
+            pass
+
+        def generate_inbound_data(self, simulation, topology, self_as_node_object,
+                    dt, user_arg=None):
+            return 10.0 if simulation.get_previous_time() == 0 else 0.0
+
+        def get_next_hop_batch(self, simulation, topology, neighbors_as_agents,
+                    neighbor_node_ids, neighbor_mask, self_as_node_object, dt,
+                    data_amnts, user_arg=None):
+            is_node = np.array([isinstance(topology.as_nxgraph().nodes[int(i)]["data"],
+                    howlitbe.topology.Node) for i in neighbor_node_ids])
+            return np.argmax(neighbor_mask * (1 + is_node[None, :]), axis=1)
+
+    g1 = howlitbe.topology.Switch(is_gate=True)
+    g2 = howlitbe.topology.Switch(is_gate=True)
+    s = howlitbe.topology.Switch(is_gate=False)
+    n = howlitbe.topology.Node()
+    topology = howlitbe.topology.Topology(nx.Graph())
+    topology.add_edge(g1, s, howlitbe.topology.PhysicalLink(g1, s, bandwidth=80))  # 10 B/s
+    topology.add_edge(g2, s, howlitbe.topology.PhysicalLink(g2, s, bandwidth=80))
+    topology.add_edge(s, n, howlitbe.topology.PhysicalLink(s, n, bandwidth=160))  # 20 B/s
+    simulation = EventSimulation(topology, _OnceToNodeAgent, None, node_processing_rate=5.0)
+    simulation.run(1.0, None, 3)
+    assert simulation.get_pending_count() == 2
+    assert simulation.stats.get_processed(hash(n)) == 0
+    simulation.run(1.0, None, 10)
+
+    # g -> s: 1 s each, in parallel. s -> n: 0.5 s, the second unit waits
+    # for the first one. Processing: 2 s, the second unit waits again
+    assert sorted(simulation.latencies) == [3.5, 5.5]
+    assert simulation.get_pending_count() == 0
+    assert simulation.stats.get_processed(hash(n)) == 20.0
+    assert simulation.stats.get_non_directed_edge_stats(hash(s), hash(n)) == 20.0
+
+    class _CappedAgent(_OnceToNodeAgent):
+        """ Processes 4 bytes per second of a step """
+
+        def calc_processed_data_amnt_bytes_batch(self, simulation, topology, neighbors_as_agents,
+                    neighbor_node_ids, self_as_node_object, dt, data_amnts, user_arg=None):
+            return np.minimum(data_amnts, 4.0 * dt)
+
+    # Agents process over the step, even if processing itself takes no time
+    for rate in [None, 5.0]:
+        simulation = EventSimulation(topology, _CappedAgent, None, node_processing_rate=rate)
+        simulation.run(1.0, None, 10)
+        assert simulation.stats.get_processed(hash(n)) == 8.0
+
+
+def test_event_simulation_skips_idle_time():
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=5,
+            n_gates=2,
+            n_nodes=20,
+            images_count={
+                "image 1": 30,
+            },
+            n_overlays=5,
+            image_commands={})
+    simulation = EventSimulation(topology, RandomPassNodeAgent, None, generation_interval=1e4)
+    simulation.run(1e5, None, 1e6)
+    # 2 gates, 100 generations each. Only a few events per generated unit
+    n_generated = 2 * 100
+    assert simulation.n_events < n_generated * 10
+    assert len(simulation.latencies) + simulation.get_pending_count() == n_generated
+
+
+def test_link_capacity():
+    """
+    Two gates send 8 bytes per step each over a shared link w/ 10 bytes per
+    step capacity. Both step-based engines agree
+    """
+
+    class _TowardsNodeAgent(BatchedNodeAgent):
+
+        def __init__(self, topology, inode, user_constructor_arg):
+            pass
+
+        def generate_inbound_data(self, simulation, topology, self_as_node_object,
+                    dt, user_arg=None):
+            return 8.0 * dt
+
+        def get_next_hop_batch(self, simulation, topology, neighbors_as_agents,
+                    neighbor_node_ids, neighbor_mask, self_as_node_object, dt,
+                    data_amnts, user_arg=None):
+            is_node = np.array([isinstance(topology.as_nxgraph().nodes[int(i)]["data"],
+                    howlitbe.topology.Node) for i in neighbor_node_ids])
+            return np.argmax(neighbor_mask * (1 + is_node[None, :]), axis=1)
+
+    g1 = howlitbe.topology.Switch(is_gate=True)
+    g2 = howlitbe.topology.Switch(is_gate=True)
+    s = howlitbe.topology.Switch(is_gate=False)
+    n = howlitbe.topology.Node()
+    topology = howlitbe.topology.Topology(nx.Graph())
+    topology.add_edge(g1, s, howlitbe.topology.PhysicalLink(g1, s, bandwidth=800))
+    topology.add_edge(g2, s, howlitbe.topology.PhysicalLink(g2, s, bandwidth=800))
+    topology.add_edge(s, n, howlitbe.topology.PhysicalLink(s, n, bandwidth=80))
+    n_steps = 50
+    generated = 2 * 8.0 * n_steps
+
+    simulations = {mode: VectorSimulation(topology, _TowardsNodeAgent, None, link_capacity=mode)
+            for mode in [None, "queue", "drop"]}
+    for simulation in simulations.values():
+        simulation.run(1.0, None, n_steps)
+    stats = {mode: simulation.stats for mode, simulation in simulations.items()}
+    in_flight = {mode: simulation.pending_amount.sum() for mode, simulation in simulations.items()}
+
+    # The scalar engine admits the same units
+    for mode, simulation in simulations.items():
+        scalar = Simulation(topology, _TowardsNodeAgent, None, link_capacity=mode)
+        scalar.run(1.0, None, n_steps)
+        for counter in ["processed", "trasnferred_directed", "backlog_directed", "dropped_directed"]:
+            assert np.array_equal(getattr(scalar.stats, counter), getattr(simulation.stats, counter))
+        assert sum(pd.data_amount_bytes for pd in scalar.pending_data) == in_flight[mode]
+    try:
+        Simulation(topology, _TowardsNodeAgent, None, link_capacity="wait")
+        assert False
+    except ValueError:
+        pass
+
+    assert stats[None].get_non_directed_edge_stats(hash(s), hash(n)) == 16.0 * (n_steps - 1)
+    for mode in ["queue", "drop"]:
+        # A unit may overshoot the capacity, but the overshoot is paid off later
+        assert stats[mode].get_non_directed_edge_stats(hash(s), hash(n)) <= 10.0 * n_steps + 8.0
+        assert stats[mode].get_non_directed_edge_stats(hash(s), hash(n)) >= 10.0 * (n_steps - 2)
+        assert stats[mode].get_non_directed_edge_stats(hash(g1), hash(s)) == 8.0 * n_steps
+    # Data is conserved
+    assert stats["queue"].get_processed(hash(n)) + in_flight["queue"] == generated
+    assert stats["queue"].get_non_directed_edge_backlog(hash(s), hash(n)) > 6.0 * (n_steps - 10)
+    assert stats["queue"].get_non_directed_edge_dropped(hash(s), hash(n)) == 0
+    assert stats["drop"].get_processed(hash(n)) + in_flight["drop"] \
+            + stats["drop"].get_non_directed_edge_dropped(hash(s), hash(n)) == generated
+    assert stats["drop"].get_non_directed_edge_backlog(hash(s), hash(n)) == 0
+
+
+def _make_star_topology():
+    """ Two stars: gate -- switch -- nodes. Units never reach a dead end """
+    topology = howlitbe.topology.Topology(nx.Graph())
+    for _ in range(2):
+        gate = howlitbe.topology.Switch(is_gate=True)
+        switch = howlitbe.topology.Switch(is_gate=False)
+        topology.add_edge(gate, switch, howlitbe.topology.PhysicalLink(gate, switch, bandwidth=1e6))
+        for _ in range(3):
+            node = howlitbe.topology.Node()
+            topology.add_edge(switch, node, howlitbe.topology.PhysicalLink(switch, node,
+                    bandwidth=1e6))
+    return topology
+
+
+def test_checkpoint_resume_is_bit_identical():
+    """ A run restored from a checkpoint in a fresh simulation continues exactly as the original """
+    import howlitbe.misc
+    import tempfile
+
+    class _CountingAgent(RandomPassNodeAgent):
+        """ Stateful: generates more data on each call """
+
+        def __init__(self, topology, inode, user_constructor_arg):
+            self.n_generated = 0
+
+        def generate_inbound_data(self, simulation, topology, self_as_node_object,
+                    dt, user_arg=None):
+            self.n_generated += 1
+            return (1.0 + 0.1 * self.n_generated + random.random()) * dt
+
+        def get_state(self) -> object:
+            return self.n_generated
+
+        def set_state(self, state: object):
+            self.n_generated = state
+
+    topology = _make_star_topology()
+    for engine, kwargs in [(Simulation, dict()), (VectorSimulation, dict(link_capacity="queue")),
+            (EventSimulation, dict(link_latency=0.3))]:
+        howlitbe.misc.seed_random(7)
+        uninterrupted = engine(topology, _CountingAgent, None, stats_history_size=8, **kwargs)
+        uninterrupted.run(1.0, None, 30)
+
+        howlitbe.misc.seed_random(7)
+        interrupted = engine(topology, _CountingAgent, None, stats_history_size=8, **kwargs)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint.npz")
+            # Checkpoints are written after each step, the last one is taken at t=13
+            interrupted.run(1.0, None, 13, checkpoint_path=path, checkpoint_interval=0.0)
+            howlitbe.misc.seed_random(12345)  # The state of a fresh process
+            restored = engine(topology, _CountingAgent, None, stats_history_size=8, **kwargs)
+            restored.load_checkpoint(path)
+        restored.run(1.0, None, 30)
+
+        assert restored.get_previous_time() == uninterrupted.get_previous_time()
+        assert restored.get_pending_count() == uninterrupted.get_pending_count()
+        for name in _SimStats._STATE_ARRAYS:
+            assert np.array_equal(getattr(restored.stats, name), getattr(uninterrupted.stats, name))
+        assert restored.stats.n_recorded == uninterrupted.stats.n_recorded
+        assert [i.n_generated for i in restored.agent_index.values()] \
+                == [i.n_generated for i in uninterrupted.agent_index.values()]
+
+
+def test_checkpoint_on_different_topology():
+    import tempfile
+
+    topologies = [_make_star_topology() for _ in range(2)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "checkpoint.npz")
+        VectorSimulation(topologies[0], RandomPassNodeAgent, None).save_checkpoint(path)
+        try:
+            VectorSimulation(topologies[1], RandomPassNodeAgent, None).load_checkpoint(path)
+            assert False
+        except ValueError:
+            pass
+        try:
+            Simulation(topologies[0], RandomPassNodeAgent, None).load_checkpoint(path)
+            assert False
+        except ValueError:
+            pass
+
+
+def test_shortest_path_agent():
+    """ Data goes straight to the nearest node, and gets processed there """
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=5,
+            n_gates=2,
+            n_nodes=12,
+            images_count={
+                "image 1": 4,
+            },
+            n_overlays=2,
+            image_commands={})
+    index = topology.get_index()
+    table = topology.get_routing_table()
+    gates = np.flatnonzero(index.node_kind == howlitbe.topology.NODE_KIND_GATE)
+    gate_hops = table.distance[:, gates].min(axis=0).astype(int)
+
+    simulations = [engine(topology, ShortestPathNodeAgent, None) for engine in [Simulation,
+            VectorSimulation]]
+    for simulation in simulations:
+        simulation.run(1.0, None, 20)
+    # Units neither wander, nor get stuck on the way
+    assert simulations[1].pending_hops.max() <= gate_hops.max()
+    assert simulations[1].get_pending_count() == gate_hops.sum()  # A unit per gate, and hop
+    assert np.array_equal(simulations[0].stats.processed, simulations[1].stats.processed)
+    assert np.count_nonzero(simulations[1].stats.processed) <= len(gates)
+
+
+def test_topology_change_mid_run():
+    """ The node data goes to is detached for a while, data goes to other nodes meanwhile """
+    topology = _make_star_topology()
+    index = topology.get_index()
+    simulations = [engine(topology, ShortestPathNodeAgent, None, stats_history_size=30)
+            for engine in [Simulation, VectorSimulation]]
+    gate = int(np.flatnonzero(index.node_kind == howlitbe.topology.NODE_KIND_GATE)[0])
+    table = topology.get_routing_table()
+    nearest = int(table.targets[table.get_nearest_target_row(np.array([gate]))[0]])
+    node = index.node_objects[nearest]
+    switch = index.node_objects[table.get_next_hop(gate, nearest)]
+    for t1, change in [(5, lambda: topology.detach_node(node)), (10, lambda: topology.reattach_node(node)),
+            (15, None)]:
+        for simulation in simulations:
+            simulation.run(1.0, None, t1)
+        if change is not None:
+            change()
+    for simulation in simulations:
+        assert simulation.index is topology.get_index()
+        t, processed = simulation.stats.get_processed_history(hash(node))
+        # Units reach the node at t=2, the last one before the detachment is processed at t=6
+        assert np.all(processed[(t > 6) & (t <= 11)] == 0)
+        assert np.all(processed[(t > 2) & ((t <= 6) | (t > 12))] > 0)
+        _, transferred = simulation.stats.get_non_directed_edge_history(hash(switch), hash(node))
+        assert np.all(transferred[(t > 5) & (t <= 10)] == 0)
+    assert np.array_equal(simulations[0].stats.processed, simulations[1].stats.processed)
+    assert np.array_equal(simulations[0].stats.trasnferred_directed,
+            simulations[1].stats.trasnferred_directed)
+
+
+def test_dropped_data_is_accounted():
+    """
+    Units reaching a leaf switch have nowhere to go, and units waiting at a
+    switch cut off by a topology change are discarded. Both are counted, so
+    data is conserved in all engines
+    """
+
+    class _LosslessAgent(BatchedRandomPassNodeAgent):
+
+        def calc_processed_data_amnt_bytes_batch(self, simulation, topology, neighbors_as_agents,
+                    neighbor_node_ids, self_as_node_object, dt, data_amnts, user_arg=None):
+            return data_amnts
+
+    gate = howlitbe.topology.Switch(is_gate=True)
+    switch = howlitbe.topology.Switch(is_gate=False)
+    leaf = howlitbe.topology.Switch(is_gate=False)
+    node = howlitbe.topology.Node()
+    topology = howlitbe.topology.Topology(nx.Graph())
+    topology.add_edge(gate, switch, howlitbe.topology.PhysicalLink(gate, switch, bandwidth=1e6))
+    topology.add_edge(switch, leaf, howlitbe.topology.PhysicalLink(switch, leaf, bandwidth=1e6))
+    topology.add_edge(switch, node, howlitbe.topology.PhysicalLink(switch, node, bandwidth=1e6))
+    in_flight = lambda simulation: sum(pd.data_amount_bytes for pd in simulation.pending_data) \
+            if isinstance(simulation, Simulation) else float(simulation.pending_amount.sum())
+
+    simulations = list()
+    for engine in [Simulation, VectorSimulation]:
+        howlitbe.rng.seed(7)
+        simulations.append(engine(topology, _LosslessAgent, None))
+        simulations[-1].run(1.0, None, 30)
+    for simulation in simulations:
+        assert simulation.stats.get_dropped(hash(leaf)) > 0
+        assert simulation.stats.get_dropped(hash(leaf)) + simulation.stats.get_processed(hash(node)) \
+                + in_flight(simulation) == 30.0
+    assert np.array_equal(simulations[0].stats.dropped, simulations[1].stats.dropped)
+
+    # Units at the switch are discarded, once it is cut off
+    topology.detach_node(switch)
+    for simulation in simulations:
+        at_switch = simulation.stats.get_dropped(hash(switch))
+        simulation.run(1.0, None, 31)
+        assert simulation.stats.get_dropped(hash(switch)) > at_switch
+        assert math.isclose(simulation.stats.dropped.sum() + simulation.stats.processed.sum()
+                + in_flight(simulation), 31.0)
+
+    # Event-driven engine drops at dead ends as well, but does not follow topology changes
+    topology.reattach_node(switch)
+    howlitbe.rng.seed(7)
+    simulation = EventSimulation(topology, _LosslessAgent, None)
+    simulation.run(1.0, None, 30)
+    assert simulation.stats.get_dropped(hash(leaf)) > 0
+    assert simulation.stats.dropped.sum() + simulation.stats.processed.sum() == 30.0 \
+            - sum(i[4] for i in simulation.events if i[2] != _EVENT_GENERATE)
+    topology.detach_node(node)
+    try:
+        simulation.step(1.0, None)
+        assert False
+    except ValueError:
+        pass
@@ -0,0 +1,247 @@
+"""
+Streaming output of `howlitbe.simnet` simulations. A sink receives a record
+after each step (time, amounts processed by each node, and transferred over
+each directed edge during the step, number of pending data units), and
+writes it out, so long runs need neither to keep their history in memory,
+nor to finish for their output to be usable.
+
+Nodes, and edges are indexed the same way `_SimStats` counters are (dense
+nodes, and CSR positions of `howlitbe.topology.TopologyIndex`).
+"""
+
+import howlitbe.topology
+import numpy as np
+import os
+import pathlib
+import time
+
+
+class SimulationSink:
+    """
+    Receives per-step records. `write` gets cumulative counters, and the
+    sink takes care of turning them into per-step amounts
+    """
+
+    def open(self, index: howlitbe.topology.TopologyIndex, processed: np.ndarray = None,
+                transferred: np.ndarray = None):
+        """
+        Called once, before the first record. `processed`, and `transferred`
+        are the counters to start from, non-zero for a resumed run
+        """
+        self.index = index
+        self._previous_processed = np.zeros(index.get_n_nodes(), dtype=np.float64)
+        self._previous_transferred = np.zeros(len(index.indices), dtype=np.float64)
+        if processed is not None:
+            self._previous_processed[:] = processed
+        if transferred is not None:
+            self._previous_transferred[:] = transferred
+
+    def write(self, t: float, processed: np.ndarray, transferred: np.ndarray, n_pending: int):
+        """
+        - processed: cumulative amounts processed, by dense node
+        - transferred: cumulative amounts transferred, by CSR position
+        """
+        processed_step = processed - self._previous_processed
+        transferred_step = transferred - self._previous_transferred
+        self._previous_processed[:] = processed
+        self._previous_transferred[:] = transferred
+        self.write_step(t, processed_step, transferred_step, n_pending)
+
+    def write_step(self, t: float, processed: np.ndarray, transferred: np.ndarray,
+                n_pending: int):
+        """ Same as `write`, but w/ amounts processed, and transferred over the step """
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class NpyChunkSink(SimulationSink):
+    """
+    Buffers up to `chunk_size` records, and writes them as a chunk of `.npy`
+    files (one per column) into `directory`. A chunk is also written once
+    `flush_interval` seconds (wall time) have passed since the previous one,
+    so a slow run leaves its output on disk regularly.
+
+    Chunk files are written under temporary names, and renamed once complete,
+    so a run that has crashed leaves only complete chunks behind. Use
+    `load_npy_chunks` to read them.
+    """
+
+    COLUMNS = ["time", "processed", "transferred", "pending"]
+
+    def __init__(self, directory: str, chunk_size: int = 4096, flush_interval: float = 10.0):
+        self.directory = pathlib.Path(directory)
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.n_chunks = 0
+        self.n_buffered = 0
+
+    def open(self, index: howlitbe.topology.TopologyIndex, processed: np.ndarray = None,
+                transferred: np.ndarray = None):
+        super().open(index, processed, transferred)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.buffers = dict(
+            time=np.zeros(self.chunk_size, dtype=np.float64),
+            processed=np.zeros((self.chunk_size, index.get_n_nodes()), dtype=np.float64),
+            transferred=np.zeros((self.chunk_size, len(index.indices)), dtype=np.float64),
+            pending=np.zeros(self.chunk_size, dtype=np.int64),
+        )
+        # So the columns can be mapped back onto the topology
+        self._save("index", dict(node_ids=index.node_ids, indptr=index.indptr,
+                indices=index.indices))
+        self.n_chunks = len(list(self.directory.glob("time-*.npy")))
+        self.n_buffered = 0
+        self.flushed_at = time.monotonic()
+
+    def _save(self, name: str, arrays: dict):
+        """ Writes `name.npz`, or, if `arrays` is a single array, `name.npy` atomically """
+        if isinstance(arrays, dict):
+            path = self.directory / f"{name}.npz"
+            with open(str(path) + ".partial", 'wb') as f:
+                np.savez(f, **arrays)
+        else:
+            path = self.directory / f"{name}.npy"
+            with open(str(path) + ".partial", 'wb') as f:
+                np.save(f, arrays)
+        os.replace(str(path) + ".partial", path)
+
+    def write_step(self, t: float, processed: np.ndarray, transferred: np.ndarray,
+                n_pending: int):
+        i = self.n_buffered
+        self.buffers["time"][i] = t
+        self.buffers["processed"][i] = processed
+        self.buffers["transferred"][i] = transferred
+        self.buffers["pending"][i] = n_pending
+        self.n_buffered += 1
+        if self.n_buffered == self.chunk_size \
+                or time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.n_buffered > 0:
+            # The time column goes last, chunks are counted by it
+            for column in self.COLUMNS[1:] + self.COLUMNS[:1]:
+                self._save(f"{column}-{self.n_chunks:06d}", self.buffers[column][:self.n_buffered])
+            self.n_chunks += 1
+            self.n_buffered = 0
+        self.flushed_at = time.monotonic()
+
+
+def load_npy_chunks(directory: str) -> dict:
+    """
+    Reads the output of `NpyChunkSink`. Returns {column: [chunk]} w/ the
+    memory-mapped chunks of all complete chunks, in order, and "node_ids",
+    "indptr", "indices" of the topology index. Nothing is read into memory
+    until the chunks are accessed, see `concatenate_chunks`
+    """
+    directory = pathlib.Path(directory)
+    ret = dict(np.load(directory / "index.npz"))
+    chunks = sorted(i.name[len("time-"):-len(".npy")] for i in directory.glob("time-*.npy"))
+    for column in NpyChunkSink.COLUMNS:
+        ret[column] = [np.load(directory / f"{column}-{i}.npy", mmap_mode='r') for i in chunks]
+    return ret
+
+
+def concatenate_chunks(chunks: list, start: int = 0, stop: int = None) -> np.ndarray:
+    """
+    Returns records [start, stop) of a column returned by `load_npy_chunks`
+    as a single array. Only the chunks overlapping the range are read
+    """
+    n_records = sum(len(i) for i in chunks)
+    stop = n_records if stop is None else min(stop, n_records)
+    parts = list()
+    offset = 0
+    for chunk in chunks:
+        if offset < stop and start < offset + len(chunk):
+            parts.append(chunk[max(start - offset, 0):stop - offset])
+        offset += len(chunk)
+    if len(parts) == 0:
+        return np.zeros((0,) + (chunks[0].shape[1:] if len(chunks) else ()))
+    return np.concatenate(parts)
+
+
+class MemorySink(SimulationSink):
+    """ Keeps records in lists. Mostly for testing """
+
+    def open(self, index: howlitbe.topology.TopologyIndex, processed: np.ndarray = None,
+                transferred: np.ndarray = None):
+        super().open(index, processed, transferred)
+        self.records = list()
+
+    def write_step(self, t: float, processed: np.ndarray, transferred: np.ndarray,
+                n_pending: int):
+        self.records.append((t, processed.copy(), transferred.copy(), n_pending))
+
+
+def test_npy_chunk_sink():
+    import howlitbe.simnet
+    import tempfile
+
+    topology = howlitbe.simnet._make_star_topology()
+    simulation = howlitbe.simnet.VectorSimulation(topology,
+            howlitbe.simnet.RandomPassNodeAgent, None, stats_history_size=100)
+    with tempfile.TemporaryDirectory() as directory:
+        sink = NpyChunkSink(directory, chunk_size=16, flush_interval=3600)
+        with sink:
+            simulation.run(1.0, None, 50, sink=sink)
+        assert sink.n_chunks == 4  # 3 complete chunks, and the remainder flushed at the end
+        output = load_npy_chunks(directory)
+        assert all(isinstance(i, np.memmap) for i in output["processed"])
+        columns = {column: concatenate_chunks(output[column]) for column in NpyChunkSink.COLUMNS}
+        # A range spanning chunks
+        assert np.array_equal(concatenate_chunks(output["time"], 10, 40), columns["time"][10:40])
+        assert len(concatenate_chunks(output["processed"], 45)) == 5
+        assert np.array_equal(output["node_ids"], simulation.index.node_ids)
+        del output
+    t, processed, transferred = simulation.stats.get_history()
+    assert np.array_equal(columns["time"], t)
+    assert np.allclose(columns["processed"], processed)
+    assert np.allclose(columns["transferred"], transferred)
+    assert columns["pending"][-1] == simulation.get_pending_count()
+
+
+def test_crashed_run_leaves_output():
+    import howlitbe.simnet
+    import tempfile
+
+    class _Crash(Exception):
+        pass
+
+    class _CrashingSink(NpyChunkSink):
+        def write_step(self, t, processed, transferred, n_pending):
+            if t > 20:
+                raise _Crash()
+            super().write_step(t, processed, transferred, n_pending)
+
+    simulation = howlitbe.simnet.VectorSimulation(howlitbe.simnet._make_star_topology(),
+            howlitbe.simnet.RandomPassNodeAgent, None)
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            simulation.run(1.0, None, 50, sink=_CrashingSink(directory, chunk_size=16))
+        except _Crash:
+            pass
+        assert len(concatenate_chunks(load_npy_chunks(directory)["time"])) == 20
+
+
+def test_sink_in_all_engines():
+    import howlitbe.simnet
+
+    topology = howlitbe.simnet._make_star_topology()
+    for engine in [howlitbe.simnet.Simulation, howlitbe.simnet.VectorSimulation,
+            howlitbe.simnet.EventSimulation]:
+        simulation = engine(topology, howlitbe.simnet.RandomPassNodeAgent, None)
+        sink = MemorySink()
+        simulation.run(1.0, None, 10, sink=sink)
+        assert [i[0] for i in sink.records] == list(np.arange(1.0, 11.0))
+        assert np.isclose(sum(i[1].sum() for i in sink.records), simulation.stats.processed.sum())
+        assert sink.records[-1][3] == simulation.get_pending_count()
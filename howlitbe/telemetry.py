@@ -0,0 +1,424 @@
+"""
+Telemetry of a deployed network. Periodically samples interface counters of
+the links, and CPU/memory usage of the containers of a running
+Containernet/Mininet deployment into a bounded columnar store. The store is
+indexed the same way `howlitbe.simnet` stats are (dense nodes, and CSR
+positions of `TopologyIndex`), so measured link utilization can be compared
+w/ simulated one directly.
+"""
+
+import dataclasses
+import howlitbe.topology
+import numpy as np
+import os
+import threading
+import time
+import tired.logging
+
+
+def parse_net_dev(text: str) -> dict:
+    """
+    Parses /proc/net/dev. Returns {interface: (rx bytes, rx packets, tx bytes,
+    tx packets)}
+    """
+    ret = dict()
+    for line in text.splitlines():
+        if ':' not in line or '|' in line:
+            continue
+        interface, counters = line.split(':', 1)
+        counters = counters.split()
+        ret[interface.strip()] = (int(counters[0]), int(counters[1]), int(counters[8]),
+                int(counters[9]))
+    return ret
+
+
+def parse_cpu_usage(text: str, filename: str) -> float:
+    """
+    Returns CPU time (s) consumed by a cgroup. Supports cgroup v2 "cpu.stat",
+    and cgroup v1 "cpuacct.usage"
+    """
+    if filename == "cpu.stat":
+        for line in text.splitlines():
+            key, value = line.split()
+            if key == "usage_usec":
+                return int(value) / 1e6
+        raise ValueError("No \"usage_usec\" in cpu.stat")
+    elif filename == "cpuacct.usage":
+        return int(text.strip()) / 1e9
+    raise ValueError(f"Unsupported CPU usage file {filename}")
+
+
+def parse_memory_usage(text: str) -> int:
+    """ Parses "memory.current" (v2), or "memory.usage_in_bytes" (v1). Returns bytes """
+    return int(text.strip())
+
+
+def find_cgroup_files(docker_id: str, cgroup_root: str = "/sys/fs/cgroup") -> tuple:
+    """
+    Returns (CPU usage file, memory usage file) of a docker container, or
+    None, if the container's cgroup is not found
+    """
+    candidates = [
+        # v2, systemd driver
+        (os.path.join(cgroup_root, "system.slice", f"docker-{docker_id}.scope", "cpu.stat"),
+                os.path.join(cgroup_root, "system.slice", f"docker-{docker_id}.scope", "memory.current")),
+        # v2, cgroupfs driver
+        (os.path.join(cgroup_root, "docker", docker_id, "cpu.stat"),
+                os.path.join(cgroup_root, "docker", docker_id, "memory.current")),
+        # v1
+        (os.path.join(cgroup_root, "cpuacct", "docker", docker_id, "cpuacct.usage"),
+                os.path.join(cgroup_root, "memory", "docker", docker_id, "memory.usage_in_bytes")),
+    ]
+    for cpu_file, memory_file in candidates:
+        if os.path.exists(cpu_file) and os.path.exists(memory_file):
+            return cpu_file, memory_file
+    return None
+
+
+class TelemetryStore:
+    """
+    Ring buffer of the last `capacity` samples. Counters are stored as
+    sampled (cumulative). Link counters are indexed by CSR positions of the
+    topology index: position of (a, b) holds what has been sent from a to b.
+    Positions that are not monitored stay zero
+    """
+
+    def __init__(self, index: howlitbe.topology.TopologyIndex, capacity: int = 1024):
+        self.index = index
+        self.capacity = capacity
+        n_positions = len(index.indices)
+        n_nodes = index.get_n_nodes()
+        self.time = np.zeros(capacity, dtype=np.float64)
+        self.link_bytes = np.zeros((capacity, n_positions), dtype=np.int64)
+        self.link_packets = np.zeros((capacity, n_positions), dtype=np.int64)
+        self.cpu = np.zeros((capacity, n_nodes), dtype=np.float64)
+        """ CPU time consumed, (s), indexed by dense node """
+        self.memory = np.zeros((capacity, n_nodes), dtype=np.int64)
+        """ Memory used, (B), indexed by dense node """
+        self.container_sent_bytes = np.zeros((capacity, n_nodes), dtype=np.int64)
+        """
+        Sent by containers over their links to switches (not part of the
+        topology), (B), indexed by dense node
+        """
+        self.container_received_bytes = np.zeros((capacity, n_nodes), dtype=np.int64)
+        self.n_recorded = 0
+
+    def next_row(self, t: float) -> int:
+        """ Claims the row for a new sample. Returns the row index """
+        i = self.n_recorded % self.capacity
+        self.time[i] = t
+        self.link_bytes[i] = 0
+        self.link_packets[i] = 0
+        self.cpu[i] = 0
+        self.memory[i] = 0
+        self.container_sent_bytes[i] = 0
+        self.container_received_bytes[i] = 0
+        self.n_recorded += 1
+        return i
+
+    def _get_order(self) -> np.ndarray:
+        n = min(self.n_recorded, self.capacity)
+        return (np.arange(n) + self.n_recorded - n) % self.capacity
+
+    def get_history(self):
+        """
+        Returns (time, link bytes, link packets, cpu, memory) arrays of the
+        retained samples in chronological order
+        """
+        order = self._get_order()
+        return self.time[order], self.link_bytes[order], self.link_packets[order], \
+                self.cpu[order], self.memory[order]
+
+    def get_non_directed_edge_history(self, nodea: int, nodeb: int):
+        """
+        Returns (time, bytes transferred b/w samples) arrays. Unlike
+        `howlitbe.simnet._SimStats`, the first retained sample has no
+        predecessor, so there is one value less than there are samples
+        """
+        order = self._get_order()
+        positions = [self.index.edge_index[(nodea, nodeb)], self.index.edge_index[(nodeb, nodea)]]
+        counters = self.link_bytes[order][:, positions].sum(axis=1)
+        return self.time[order][1:], np.diff(counters)
+
+    def get_non_directed_edge_throughput(self, nodea: int, nodeb: int):
+        """ Returns (time, bytes per second) arrays """
+        t, transferred = self.get_non_directed_edge_history(nodea, nodeb)
+        return t, transferred / np.diff(self.time[self._get_order()])
+
+    def get_cpu_history(self, nodeid: int):
+        """ Returns (time, CPU time consumed b/w samples) arrays, see `get_non_directed_edge_history` """
+        order = self._get_order()
+        return self.time[order][1:], np.diff(self.cpu[order][:, self.index.node_index[nodeid]])
+
+    def get_container_link_history(self, nodeid: int):
+        """
+        Returns (time, bytes sent, bytes received b/w samples) arrays of a
+        container's links to switches, see `get_non_directed_edge_history`
+        """
+        order = self._get_order()
+        column = self.index.node_index[nodeid]
+        return self.time[order][1:], np.diff(self.container_sent_bytes[order][:, column]), \
+                np.diff(self.container_received_bytes[order][:, column])
+
+    def get_memory_history(self, nodeid: int):
+        """ Returns (time, memory used) arrays """
+        order = self._get_order()
+        return self.time[order], self.memory[order][:, self.index.node_index[nodeid]]
+
+
+@dataclasses.dataclass
+class LinkProbe:
+    """ Interface on `nodea` side of the link b/w `nodea`, and `nodeb` """
+
+    nodea: int
+    nodeb: int
+    host: object
+    """ Mininet node the interface is in, /proc/net/dev is read through its `cmd` """
+    interface: str
+
+
+@dataclasses.dataclass
+class ContainerProbe:
+    container: int
+    cpu_file: str
+    memory_file: str
+
+
+class TelemetryCollector:
+    """
+    Samples the probes into `store`, either on demand (`sample`), or
+    periodically on a background thread (`start`, `stop`)
+    """
+
+    def __init__(self, topology: howlitbe.topology.Topology, links: list = None,
+                containers: list = None, capacity: int = 1024, container_links: list = None):
+        """
+        - links: list of `LinkProbe` of the topology's links
+        - containers: list of `ContainerProbe`
+        - capacity: number of samples retained
+        - container_links: list of `LinkProbe` of the links b/w containers
+          (`nodea`), and switches
+        """
+        index = topology.get_index()
+        self.store = TelemetryStore(index, capacity)
+        self.containers = list() if containers is None else containers
+        self.container_nodes = np.array([index.node_index[i.container] for i in self.containers],
+                dtype=np.int64)
+        # /proc/net/dev is read once per mininet node
+        self.hosts = dict()  # {id(host): (host, [interfaces], [forward positions], [backward positions])}
+        for probe in links or list():
+            host, interfaces, forward, backward = self.hosts.setdefault(id(probe.host),
+                    (probe.host, list(), list(), list()))
+            interfaces.append(probe.interface)
+            forward.append(index.edge_index[(probe.nodea, probe.nodeb)])
+            backward.append(index.edge_index[(probe.nodeb, probe.nodea)])
+        self.container_hosts = dict()  # {id(host): (host, [interfaces], [container columns])}
+        for probe in container_links or list():
+            host, interfaces, columns = self.container_hosts.setdefault(id(probe.host),
+                    (probe.host, list(), list()))
+            interfaces.append(probe.interface)
+            columns.append(index.node_index[probe.nodea])
+        self._thread = None
+        self._stop = threading.Event()
+        self._t0 = time.monotonic()
+
+    @staticmethod
+    def from_builder(topology: howlitbe.topology.Topology, builder, capacity: int = 1024,
+                cgroup_root: str = "/sys/fs/cgroup"):
+        """
+        Makes a collector for a network deployed by a `DeploymentBuilder`.
+        Physical links, docker containers, and the links b/w containers, and
+        switches (where container network limits are set) are monitored
+        """
+        index = topology.get_index()
+        dockers = builder.plan.get_sources("docker")
+        links = list()
+        container_links = list()
+        for (nodea, nodeb), name in builder.plan.get_sources("link").items():
+            link = builder.nodemap[name]
+            if not hasattr(link, "intf1"):
+                continue
+            probe = LinkProbe(nodea, nodeb, link.intf1.node, link.intf1.name)
+            if (nodea, nodeb) in index.edge_index:
+                links.append(probe)
+            elif nodea in dockers:
+                container_links.append(probe)
+        containers = list()
+        for container, name in dockers.items():
+            docker_id = getattr(builder.nodemap[name], "did", None)
+            files = None if docker_id is None else find_cgroup_files(docker_id, cgroup_root)
+            if files is None:
+                tired.logging.warning("Unable to find cgroup of", name + ",", "not monitoring it")
+                continue
+            containers.append(ContainerProbe(container, *files))
+        return TelemetryCollector(topology, links, containers, capacity, container_links)
+
+    def sample(self, t: float = None):
+        """ Reads the counters. `t` defaults to seconds since the collector was created """
+        if t is None:
+            t = time.monotonic() - self._t0
+        row = self.store.next_row(t)
+        for host, interfaces, forward, backward in self.hosts.values():
+            counters = parse_net_dev(host.cmd("cat /proc/net/dev"))
+            values = np.array([counters.get(i, (0, 0, 0, 0)) for i in interfaces],
+                    dtype=np.int64).reshape(-1, 4)
+            self.store.link_bytes[row, forward] = values[:, 2]
+            self.store.link_packets[row, forward] = values[:, 3]
+            self.store.link_bytes[row, backward] = values[:, 0]
+            self.store.link_packets[row, backward] = values[:, 1]
+        for host, interfaces, columns in self.container_hosts.values():
+            counters = parse_net_dev(host.cmd("cat /proc/net/dev"))
+            values = np.array([counters.get(i, (0, 0, 0, 0)) for i in interfaces],
+                    dtype=np.int64).reshape(-1, 4)
+            # A container may be linked to several switches
+            np.add.at(self.store.container_sent_bytes[row], columns, values[:, 2])
+            np.add.at(self.store.container_received_bytes[row], columns, values[:, 0])
+        for column, probe in zip(self.container_nodes, self.containers):
+            try:
+                with open(probe.cpu_file, 'r') as f:
+                    self.store.cpu[row, column] = parse_cpu_usage(f.read(),
+                            os.path.basename(probe.cpu_file))
+                with open(probe.memory_file, 'r') as f:
+                    self.store.memory[row, column] = parse_memory_usage(f.read())
+            except FileNotFoundError:
+                pass  # The container is gone
+
+    def _run(self, interval: float):
+        while not self._stop.is_set():
+            t0 = time.monotonic()
+            self.sample()
+            self._stop.wait(max(0.0, interval - (time.monotonic() - t0)))
+
+    def start(self, interval: float = 1.0):
+        """ Starts sampling every `interval` seconds on a background thread """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def _get_fixture(name: str) -> str:
+    return os.path.join(os.path.dirname(__file__), "res", "telemetry", name)
+
+
+def test_parse_fixtures():
+    with open(_get_fixture("proc_net_dev"), 'r') as f:
+        counters = parse_net_dev(f.read())
+    assert set(counters.keys()) == {"lo", "s1-eth1", "s1-eth2", "d12-eth0"}
+    assert counters["s1-eth2"] == (4411023, 3387, 87215990, 62010)
+    assert counters["d12-eth0"] == (12873340, 40117, 98234512, 71203)
+    for name in ["cpu.stat", "cpuacct.usage"]:
+        with open(_get_fixture(name), 'r') as f:
+            assert abs(parse_cpu_usage(f.read(), name) - 8.412375) < 1e-6
+    for name in ["memory.current", "memory.usage_in_bytes"]:
+        with open(_get_fixture(name), 'r') as f:
+            assert parse_memory_usage(f.read()) == 57188352
+
+
+def test_collector():
+    import tempfile
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=2,
+            n_gates=1,
+            n_nodes=2,
+            images_count={
+                "image 1": 2,
+            },
+            n_overlays=2,
+            image_commands={})
+    index = topology.get_index()
+    edge = next(i for i in index.edge_objects if isinstance(i, howlitbe.topology.PhysicalLink))
+    nodea, nodeb = hash(edge.node1), hash(edge.node2)
+    container = next(node for kind, node in zip(index.node_kind, index.node_objects)
+            if kind == howlitbe.topology.NODE_KIND_CONTAINER)
+
+    class _FakeHost:
+        """ Interface counters grow by 1000 B, 10 packets sent, and half as much received each sample """
+
+        def __init__(self):
+            self.n = 0
+
+        def cmd(self, command):
+            self.n += 1
+            return "Inter-|   Receive |  Transmit\n face |bytes packets|bytes packets\n" \
+                    f"eth0: {500 * self.n} {5 * self.n} 0 0 0 0 0 0 {1000 * self.n} {10 * self.n} 0 0 0 0 0 0\n"
+
+    with tempfile.TemporaryDirectory() as directory:
+        cpu_file = os.path.join(directory, "cpu.stat")
+        memory_file = os.path.join(directory, "memory.current")
+        switch = next(node for kind, node in zip(index.node_kind, index.node_objects)
+                if kind == howlitbe.topology.NODE_KIND_SWITCH)
+        collector = TelemetryCollector(topology, [LinkProbe(nodea, nodeb, _FakeHost(), "eth0")],
+                [ContainerProbe(hash(container), cpu_file, memory_file)], capacity=3,
+                container_links=[LinkProbe(hash(container), hash(switch), _FakeHost(), "eth0")])
+        for i in range(5):
+            with open(cpu_file, 'w') as f:
+                f.write(f"usage_usec {i * 250000}\nuser_usec 0\n")
+            with open(memory_file, 'w') as f:
+                f.write(f"{1000 + i}\n")
+            collector.sample(t=float(i) * 2)
+
+    # Bounded: only the last 3 samples are retained
+    t, transferred = collector.store.get_non_directed_edge_history(nodea, nodeb)
+    assert list(t) == [6.0, 8.0]
+    assert list(transferred) == [1500, 1500]
+    _, throughput = collector.store.get_non_directed_edge_throughput(nodeb, nodea)
+    assert list(throughput) == [750.0, 750.0]
+    _, cpu = collector.store.get_cpu_history(hash(container))
+    assert np.allclose(cpu, 0.25)
+    _, memory = collector.store.get_memory_history(hash(container))
+    assert list(memory) == [1002, 1003, 1004]
+    _, link_bytes, _, _, _ = collector.store.get_history()
+    assert link_bytes[-1, index.edge_index[(nodea, nodeb)]] == 5000
+    assert link_bytes[-1, index.edge_index[(nodeb, nodea)]] == 2500
+    _, sent, received = collector.store.get_container_link_history(hash(container))
+    assert list(sent) == [1000, 1000]
+    assert list(received) == [500, 500]
+
+
+def test_collector_from_builder():
+    """ Container-to-switch links are probed along w/ the links of the topology """
+    import howlitbe.containernet
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=2,
+            n_gates=1,
+            n_nodes=2,
+            images_count={
+                "image 1": 3,
+            },
+            n_overlays=2,
+            image_commands={})
+    builder = howlitbe.containernet.DeploymentBuilder()
+    builder.build_from_topology(topology)
+    collector = TelemetryCollector.from_builder(topology, builder)
+    n_container_links = len([i for i in builder.plan.operations if i.kind == "link"
+            and i.source[0] in builder.plan.get_sources("docker")])
+    assert n_container_links > 0
+    assert sum(len(i[1]) for i in collector.container_hosts.values()) == n_container_links
+    assert sum(len(i[1]) for i in collector.hosts.values()) == len([i for i in builder.plan.operations
+            if i.kind == "link"]) - n_container_links
+    collector.sample()
+    # Collectors do not share probes
+    assert TelemetryCollector(topology).hosts == dict()
+
+
+def test_collector_background_sampling():
+    topology = howlitbe.topology.Topology.new_topology_lb22_overlay(n_switches_total=1,
+            n_gates=1,
+            n_nodes=1,
+            images_count={
+                "image 1": 1,
+            },
+            n_overlays=1,
+            image_commands={})
+    collector = TelemetryCollector(topology)
+    collector.start(interval=0.01)
+    time.sleep(0.1)
+    collector.stop()
+    n_recorded = collector.store.n_recorded
+    assert n_recorded > 2
+    time.sleep(0.03)
+    assert collector.store.n_recorded == n_recorded
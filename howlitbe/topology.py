@@ -1,9 +1,14 @@
+import dataclasses
 import ipaddress
+import json
 import math
 import matplotlib
 import matplotlib.pyplot
 import networkx as nx
+import numpy as np
 import os
+import scipy.sparse
+import scipy.sparse.csgraph
 import struct
 import tired.logging
 
@@ -39,6 +44,27 @@ class _Enumeration:
         self.__absolute_identifier = _Enumeration.__absolute_bound
         _Enumeration.__absolute_bound += 1
 
+    @classmethod
+    def _new_restored(cls, identifiers: list, absolute_identifiers: list) -> list:
+        """
+        Creates uninitialized instances w/ given identifiers (e.g. loaded
+        from a snapshot). Counters are advanced, so instances created later
+        do not collide w/ the restored ones.
+        """
+        ret = list()
+        for identifier, absolute_identifier in zip(identifiers, absolute_identifiers):
+            obj = cls.__new__(cls)
+            obj.__identifier = identifier
+            obj.__absolute_identifier = absolute_identifier
+            ret.append(obj)
+        if len(ret):
+            regname = cls.__name__
+            _Enumeration.__bound[regname] = max(_Enumeration.__bound.get(regname, 0),
+                    max(identifiers) + 1)
+            _Enumeration.__absolute_bound = max(_Enumeration.__absolute_bound,
+                    max(absolute_identifiers) + 1)
+        return ret
+
     def get_id(self):
         """ Returns unique id within this type """
         return self.__identifier
@@ -99,7 +125,8 @@ def test_ip4_netmask():
     node = Node()
     tired.logging.debug("node", str(node.get_id()), "ip", str(node.get_ip4_string()), "netmask prefix length",
             str(node.get_ip4_prefixlen()))
-    assert(node.get_ip4_string() == f"10.0.0.{node.get_id() + 1}")
+    # Ids depend on how many nodes other tests have created
+    assert(node.get_ip4_string() == str(ipaddress.ip_address(0x0a000000 + node.get_id() + 1)))
     assert(node.get_ip4_prefixlen() == 8)
 
 
@@ -166,9 +193,10 @@ class Container(_Enumeration):
     def get_string_id(self) -> str:
         """
         From the node id, image id, etc. builds a unique identifier styled after
-        containernet naming scheme.
+        containernet naming scheme. Class-specific ids of `Container`, and
+        `OverlayContainer` overlap, so the global one is used
         """
-        return "d" + str(self.get_id())
+        return "d" + str(hash(self))
         strid = '.'.join(["docker", "n" + str(self.node.get_id()), "c" + str(self.get_id()), self.name])
         strid = ''.join([i if i.isalnum() or i in ".-_" else '.' for i in strid])
         return strid
@@ -210,6 +238,401 @@ def test_enumeration():
     assert(len(id_list) == len(set(id_list)))
 
 
+NODE_KIND_SWITCH = 0
+NODE_KIND_GATE = 1
+NODE_KIND_NODE = 2
+NODE_KIND_CONTAINER = 3
+""" Node kinds, as listed in `TopologyIndex.node_kind` """
+
+
+def get_node_kind(node_data) -> int:
+    if isinstance(node_data, Switch):
+        return NODE_KIND_GATE if node_data.is_gate else NODE_KIND_SWITCH
+    elif isinstance(node_data, Node):
+        return NODE_KIND_NODE
+    elif isinstance(node_data, Container):
+        return NODE_KIND_CONTAINER
+    raise TypeError(f"Unsupported type {node_data.__class__}")
+
+
+class TopologyIndex:
+    """
+    Frozen dense index of a topology. Nodes are enumerated 0..N-1, and edges
+    are enumerated 0..E-1 in the order networkx yields them.
+
+    Adjacency is stored in CSR format: neighbors of node `i` are
+    `indices[indptr[i]:indptr[i + 1]]`, listed in the order networkx yields
+    them. Directed edge (A, B) is addressed by the position of B in the row of
+    A ("CSR position").
+    """
+
+    def __init__(self, graph: nx.Graph, previous: object = None):
+        """
+        - previous: index of the same graph before its edges have changed.
+          Its node part is reused, the set of nodes MUST be the same
+        """
+        # Nodes
+        if previous is not None:
+            self.node_ids = previous.node_ids
+            self.node_objects = previous.node_objects
+            self.node_index = previous.node_index
+            self.node_kind = previous.node_kind
+        else:
+            self.node_ids = np.fromiter(graph.nodes, dtype=np.int64,
+                    count=graph.number_of_nodes())
+            """ hash(node object) for each dense node index """
+            self.node_objects = [graph.nodes[i]["data"] for i in graph.nodes]
+            self.node_index = {inode: i for i, inode in enumerate(graph.nodes)}
+            """ {hash(node object): dense node index} """
+            self.node_kind = np.array([get_node_kind(i) for i in self.node_objects],
+                    dtype=np.int8)
+
+        # Adjacency
+        self.indptr = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+        indices = list()
+        for i, inode in enumerate(graph.nodes):
+            indices.extend(self.node_index[j] for j in graph.adj[inode])
+            self.indptr[i + 1] = len(indices)
+        self.indices = np.array(indices, dtype=np.int64)
+        self.edge_index = dict()
+        """ {(hash(node a), hash(node b)): CSR position of (A, B)} """
+        for i, inode in enumerate(graph.nodes):
+            for k, jnode in enumerate(graph.adj[inode], start=self.indptr[i]):
+                self.edge_index[(inode, jnode)] = int(k)
+
+        # Edges
+        self.edge_objects = [graph.edges[e]["relationship"] for e in graph.edges]
+        self.edges = np.array([(self.node_index[a], self.node_index[b])
+                for a, b in graph.edges], dtype=np.int64).reshape(-1, 2)
+        """ (E, 2) array of dense node indices """
+        self.edge_bps = np.array([i.bps if isinstance(i, PhysicalLink) else np.inf
+                for i in self.edge_objects], dtype=np.float64)
+        """ Link bandwidth, inf for edges that are not physical links (e.g. deployments) """
+        self.csr_edge = np.zeros(len(self.indices), dtype=np.int64)
+        """ Dense edge index for each CSR position """
+        for k, (a, b) in enumerate(graph.edges):
+            self.csr_edge[self.edge_index[(a, b)]] = k
+            self.csr_edge[self.edge_index[(b, a)]] = k
+
+        for i in [self.node_ids, self.node_kind, self.indptr, self.indices,
+                self.edges, self.edge_bps, self.csr_edge]:
+            i.setflags(write=False)
+
+    def get_n_nodes(self) -> int:
+        return len(self.node_ids)
+
+    def get_n_edges(self) -> int:
+        return len(self.edges)
+
+    def get_neighbors(self, i: int) -> np.ndarray:
+        """ Dense indices of the neighbors of node `i` """
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def get_degree(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+
+ROUTING_METRICS = ["hops", "bandwidth"]
+"""
+Path lengths routing tables are built for: number of hops, or the time it
+takes to pass a byte through each link of the path (sum of 8 / bps), [s/B]
+"""
+
+
+class RoutingTable:
+    """
+    Shortest paths over physical links from every node to a set of targets.
+    Rows are targets, columns are dense node indices of the sources:
+
+    - distance[k, i]: path length from node `i` to `targets[k]`, inf if
+      unreachable
+    - next_hop[k, i]: dense index of the neighbor of `i` on the path, -1 if
+      unreachable, or `i` is the target
+    - next_hop_slot[k, i]: same neighbor as an index into the CSR row of `i`,
+      i.e. what `BatchedNodeAgent.get_next_hop_batch` returns
+
+    Since the graph is undirected, a row is the shortest path tree rooted at
+    the target, and the next hop of `i` is its predecessor in the tree.
+    """
+
+    def __init__(self, index: TopologyIndex, metric: str = "hops", targets: np.ndarray = None):
+        """
+        - targets: dense indices of the target nodes. If None, all nodes
+        """
+        if metric not in ROUTING_METRICS:
+            raise ValueError(f"Unsupported routing metric \"{metric}\"")
+        n_nodes = index.get_n_nodes()
+        self.metric = metric
+        self.targets = np.arange(n_nodes, dtype=np.int64) if targets is None \
+                else np.asarray(targets, dtype=np.int64)
+        self.target_row = np.full(n_nodes, -1, dtype=np.int32)
+        """ Row of each dense node index, -1 for nodes that are not targets """
+        self.target_row[self.targets] = np.arange(len(self.targets), dtype=np.int32)
+
+        # Links that are not physical (deployments) do not carry traffic
+        bps = index.edge_bps[index.csr_edge]
+        physical = np.isfinite(bps)
+        rows = np.repeat(np.arange(n_nodes), index.get_degree())
+        weights = np.ones(np.count_nonzero(physical)) if metric == "hops" else 8.0 / bps[physical]
+        graph = scipy.sparse.csr_matrix((weights, (rows[physical], index.indices[physical])),
+                shape=(n_nodes, n_nodes))
+        if len(self.targets) > 0:
+            distance, predecessors = scipy.sparse.csgraph.shortest_path(graph,
+                    directed=False, unweighted=metric == "hops", indices=self.targets,
+                    return_predecessors=True)
+        else:
+            distance = np.zeros((0, n_nodes))
+            predecessors = np.zeros((0, n_nodes), dtype=np.int32)
+        self.distance = distance
+        self.next_hop = np.where(predecessors < 0, -1, predecessors).astype(np.int32)
+
+        # Position of the next hop in the CSR row of the source. Slots are
+        # stored off by one, as sparse matrices do not keep zeros
+        slots = scipy.sparse.csr_matrix((np.arange(len(rows)) - index.indptr[rows] + 1,
+                index.indices, index.indptr), shape=(n_nodes, n_nodes))
+        self.next_hop_slot = np.full(self.next_hop.shape, -1, dtype=np.int32)
+        k, i = np.nonzero(self.next_hop >= 0)
+        if len(k) > 0:
+            self.next_hop_slot[k, i] = np.asarray(slots[i, self.next_hop[k, i]]).ravel() - 1
+
+        for i in [self.targets, self.target_row, self.distance, self.next_hop, self.next_hop_slot]:
+            i.setflags(write=False)
+
+    def get_distance(self, source: int, target: int) -> float:
+        """ Dense indices """
+        return float(self.distance[self.target_row[target], source])
+
+    def get_next_hop(self, source: int, target: int) -> int:
+        """ Dense indices. Returns -1, if there is no next hop """
+        return int(self.next_hop[self.target_row[target], source])
+
+    def get_nearest_target_row(self, sources: np.ndarray) -> np.ndarray:
+        """ Returns the rows of the nearest targets for each source (dense index) """
+        return np.argmin(self.distance[:, sources], axis=0)
+
+
+SNAPSHOT_FORMAT_VERSION = 1
+""" Version of the on-disk format written by `Topology.save` """
+
+_SNAPSHOT_NODE_CLASSES = [Switch, Node, Container, OverlayContainer]
+_SNAPSHOT_EDGE_CLASSES = [PhysicalLink, Deployment]
+
+
+class TopologySnapshot:
+    """
+    Columnar representation of a topology, as stored on disk. A snapshot is a
+    directory holding "meta.json" (format version, class, and string tables),
+    and one .npy file per column. Columns are loaded memory-mapped.
+
+    Node columns are indexed by dense node indices, edge columns -- by dense
+    edge indices (see `TopologyIndex`). Missing values are -1 for integer
+    columns, and NaN for float columns.
+    """
+
+    NODE_COLUMNS = ["node_class", "node_id", "node_hash", "is_gate", "host",
+            "cpufrac", "networkfrac", "hddfrac", "overlay_id", "name", "command",
+            "ip4", "indptr", "indices", "csr_edge"]
+    EDGE_COLUMNS = ["edge_class", "edge_id", "edge_hash", "edges", "bps",
+            "link_node1", "link_node2"]
+
+    def __init__(self, meta: dict, columns: dict):
+        self.meta = meta
+        self.columns = columns
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["columns"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @staticmethod
+    def from_topology(topology) -> object:
+        index = topology.get_index()
+        n_nodes = index.get_n_nodes()
+        names = list()
+        name_index = dict()
+
+        def _string_index(value):
+            if value is None:
+                return -1
+            if value not in name_index:
+                name_index[value] = len(names)
+                names.append(value)
+            return name_index[value]
+
+        def _class_code(obj, classes):
+            if type(obj) not in classes:
+                raise TypeError(f"Unsupported type {obj.__class__}")
+            return classes.index(type(obj))
+
+        def _dense(obj):
+            return -1 if obj is None else index.node_index.get(hash(obj), -1)
+
+        def _column(values, dtype):
+            return np.array(values, dtype=dtype).reshape(-1)
+
+        nodes = index.node_objects
+        containers = [isinstance(i, Container) for i in nodes]
+        columns = dict(
+            node_class=_column([_class_code(i, _SNAPSHOT_NODE_CLASSES) for i in nodes], np.int8),
+            node_id=_column([i.get_id() for i in nodes], np.int64),
+            node_hash=np.array(index.node_ids),
+            is_gate=_column([isinstance(i, Switch) and i.is_gate for i in nodes], bool),
+            host=_column([_dense(i.node) if c else -1 for i, c in zip(nodes, containers)], np.int64),
+            cpufrac=_column([i.cpufrac if c and i.cpufrac is not None else np.nan for i, c in zip(nodes, containers)], np.float64),
+            networkfrac=_column([i.networkfrac if c and i.networkfrac is not None else np.nan for i, c in zip(nodes, containers)], np.float64),
+            hddfrac=_column([i.hddfrac if c and i.hddfrac is not None else np.nan for i, c in zip(nodes, containers)], np.float64),
+            overlay_id=_column([i.overlay_id if isinstance(i, OverlayContainer)
+                    and i.overlay_id is not None else -1 for i in nodes], np.int64),
+            name=_column([_string_index(i.name) if c else -1 for i, c in zip(nodes, containers)], np.int32),
+            command=_column([_string_index(i.command) if c else -1 for i, c in zip(nodes, containers)], np.int32),
+            ip4=_column([i.get_ip4() if isinstance(i, Node) else 0 for i in nodes], np.uint32),
+            indptr=np.array(index.indptr),
+            indices=np.array(index.indices),
+            csr_edge=np.array(index.csr_edge),
+            edge_class=_column([_class_code(i, _SNAPSHOT_EDGE_CLASSES) for i in index.edge_objects], np.int8),
+            edge_id=_column([i.get_id() for i in index.edge_objects], np.int64),
+            edge_hash=_column([hash(i) for i in index.edge_objects], np.int64),
+            edges=np.array(index.edges),
+            bps=_column([i.bps if isinstance(i, PhysicalLink) else np.nan
+                    for i in index.edge_objects], np.float64),
+            link_node1=_column([_dense(i.node1) if isinstance(i, PhysicalLink) else -1
+                    for i in index.edge_objects], np.int64),
+            link_node2=_column([_dense(i.node2) if isinstance(i, PhysicalLink) else -1
+                    for i in index.edge_objects], np.int64),
+        )
+        ip4_network = nodes[int(np.argmax(columns["node_class"] == 1))].get_ip4_network() \
+                if np.any(columns["node_class"] == 1) else None
+        meta = dict(
+            version=SNAPSHOT_FORMAT_VERSION,
+            n_nodes=n_nodes,
+            n_edges=index.get_n_edges(),
+            node_classes=[i.__name__ for i in _SNAPSHOT_NODE_CLASSES],
+            edge_classes=[i.__name__ for i in _SNAPSHOT_EDGE_CLASSES],
+            strings=names,
+            ip4_network=ip4_network,
+        )
+        return TopologySnapshot(meta, columns)
+
+    def save(self, path: str):
+        """
+        Writes the snapshot into directory `path`. "meta.json" is written last,
+        so an interrupted write does not produce a loadable snapshot
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in TopologySnapshot.NODE_COLUMNS + TopologySnapshot.EDGE_COLUMNS:
+            np.save(os.path.join(path, name + ".npy"), self.columns[name])
+        with open(os.path.join(path, "meta.json"), 'w') as f:
+            json.dump(self.meta, f)
+
+    @staticmethod
+    def load(path: str, mmap: bool = True) -> object:
+        with open(os.path.join(path, "meta.json"), 'r') as f:
+            meta = json.load(f)
+        if meta["version"] != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format version {meta['version']}, "
+                    f"expected {SNAPSHOT_FORMAT_VERSION}")
+        columns = {name: np.load(os.path.join(path, name + ".npy"),
+                mmap_mode='r' if mmap else None)
+                for name in TopologySnapshot.NODE_COLUMNS + TopologySnapshot.EDGE_COLUMNS}
+        return TopologySnapshot(meta, columns)
+
+    @staticmethod
+    def _restore_objects(classes: list, class_codes: np.ndarray, ids: np.ndarray,
+                hashes: np.ndarray) -> list:
+        """ Creates uninitialized objects w/ given ids, grouped by class """
+        ret = [None] * len(class_codes)
+        for code, cls in enumerate(classes):
+            selection = np.flatnonzero(class_codes == code)
+            objects = cls._new_restored(np.asarray(ids)[selection].tolist(),
+                    np.asarray(hashes)[selection].tolist())
+            for i, obj in zip(selection.tolist(), objects):
+                ret[i] = obj
+        return ret
+
+    def to_topology(self) -> object:
+        """
+        Restores topology objects w/ their original ids, and the graph w/ the
+        original order of nodes, edges, and neighbors
+        """
+        node_class = np.asarray(self.node_class)
+        strings = self.meta["strings"]
+        nodes = self._restore_objects(_SNAPSHOT_NODE_CLASSES, node_class,
+                self.node_id, self.node_hash)
+        node_hash = np.asarray(self.node_hash).tolist()
+
+        for i in np.flatnonzero(node_class == _SNAPSHOT_NODE_CLASSES.index(Switch)).tolist():
+            nodes[i].is_gate = bool(self.is_gate[i])
+        host = np.asarray(self.host).tolist()
+        cpufrac = np.asarray(self.cpufrac).tolist()
+        networkfrac = np.asarray(self.networkfrac).tolist()
+        hddfrac = np.asarray(self.hddfrac).tolist()
+        overlay_id = np.asarray(self.overlay_id).tolist()
+        name = np.asarray(self.name).tolist()
+        command = np.asarray(self.command).tolist()
+        for i in np.flatnonzero(node_class >= _SNAPSHOT_NODE_CLASSES.index(Container)).tolist():
+            node = nodes[i]
+            node.node = nodes[host[i]] if host[i] >= 0 else None
+            node.cpufrac = None if math.isnan(cpufrac[i]) else cpufrac[i]
+            node.networkfrac = None if math.isnan(networkfrac[i]) else networkfrac[i]
+            node.hddfrac = None if math.isnan(hddfrac[i]) else hddfrac[i]
+            node.name = strings[name[i]] if name[i] >= 0 else None
+            node.command = strings[command[i]] if command[i] >= 0 else None
+            if isinstance(node, OverlayContainer):
+                node.overlay_id = overlay_id[i] if overlay_id[i] >= 0 else None
+
+        ip4_network = self.meta["ip4_network"]
+        if ip4_network is not None and ip4_network != nodes[int(np.argmax(
+                node_class == _SNAPSHOT_NODE_CLASSES.index(Node)))].get_ip4_network():
+            tired.logging.warning(f"The snapshot was taken w/ HWL_IP_NETWORK={ip4_network}, derived IPs will differ")
+
+        link_node1 = np.asarray(self.link_node1).tolist()
+        link_node2 = np.asarray(self.link_node2).tolist()
+        bps = np.asarray(self.bps).tolist()
+        edge_objects = self._restore_objects(_SNAPSHOT_EDGE_CLASSES,
+                np.asarray(self.edge_class), self.edge_id, self.edge_hash)
+        for k, edge in enumerate(edge_objects):
+            if isinstance(edge, PhysicalLink):
+                edge.node1 = nodes[link_node1[k]] if link_node1[k] >= 0 else None
+                edge.node2 = nodes[link_node2[k]] if link_node2[k] >= 0 else None
+                bandwidth = bps[k]
+                edge.bps = int(bandwidth) if float(bandwidth).is_integer() else bandwidth
+
+        # The adjacency is filled row by row, so neighbors are listed in the
+        # original order. Both directions share one attribute dict, as
+        # networkx requires
+        graph = nx.Graph()
+        graph.add_nodes_from((h, {"data": n}) for h, n in zip(node_hash, nodes))
+        edge_attributes = [{"relationship": i} for i in edge_objects]
+        indptr = np.asarray(self.indptr).tolist()
+        indices = np.asarray(self.indices).tolist()
+        csr_edge = np.asarray(self.csr_edge).tolist()
+        adjacency = graph._adj
+        for i, h in enumerate(node_hash):
+            row = adjacency[h]
+            for k in range(indptr[i], indptr[i + 1]):
+                row[node_hash[indices[k]]] = edge_attributes[csr_edge[k]]
+
+        return Topology(graph)
+
+
+TOPOLOGY_CHANGE_KINDS = ["add_node", "remove_node", "add_edge", "remove_edge"]
+
+
+@dataclasses.dataclass
+class TopologyChange:
+    """
+    An entry of the change journal of a `Topology`. Nodes are addressed by
+    hashes. `data` is the node object for node changes, and the relationship
+    (e.g. `PhysicalLink`) for edge changes
+    """
+
+    kind: str
+    nodea: int
+    nodeb: int = None
+    data: object = None
+
+
 class _TopologyRenderState:
 
     def __init__(self):
@@ -228,6 +651,214 @@ class Topology(nx.Graph):
     def __init__(self, graph: nx.Graph):
         self.graph: nx.Graph = graph
         self.render_state = _TopologyRenderState()
+        self._index = None
+        self._edge_stale_index = None
+        """ Index built before edges (but not nodes) have changed, see `get_index` """
+        self._components = None
+        self._routing_tables = dict()
+        self.journal: list[TopologyChange] = list()
+        """ Changes made through the mutation API, in the order they were made """
+        self._detached = dict()
+        """ {hash(node): [(node a, node b, relationship)]} edges removed by `detach_node` """
+
+    def get_index(self) -> TopologyIndex:
+        """
+        Returns dense index of the topology. The index is built lazily, and
+        is rebuilt after the topology gets mutated through `add_edge`, or
+        other mutation methods. As long as only edges change, dense node
+        indices stay the same, and only the adjacency is rebuilt.
+        Mutating the graph returned by `as_nxgraph` directly requires calling
+        `invalidate_index`.
+        """
+        if self._index is None:
+            self._index = TopologyIndex(self.graph, previous=self._edge_stale_index)
+            self._edge_stale_index = None
+        return self._index
+
+    def invalidate_index(self):
+        """ Drops the dense index, and other derived caches """
+        self._index = None
+        self._edge_stale_index = None
+        self._components = None
+        self._routing_tables = dict()
+
+    def _on_node_added(self, inode: int):
+        self._index = None
+        self._edge_stale_index = None
+        self._routing_tables = dict()
+        if self._components is not None:
+            self._components[inode] = {inode}
+
+    def _on_node_removed(self, inode: int):
+        """ The node has no edges by now """
+        self._index = None
+        self._edge_stale_index = None
+        self._routing_tables = dict()
+        if self._components is not None:
+            self._components.pop(inode)
+
+    def _on_edge_changed(self, nodea: int, nodeb: int, added: bool):
+        """ Dense node indices remain valid, components are updated in place """
+        if self._index is not None:
+            self._edge_stale_index = self._index
+            self._index = None
+        self._routing_tables = dict()
+        if self._components is None:
+            return
+        if added:
+            if self._components[nodea] is not self._components[nodeb]:
+                merged = self._components[nodea] | self._components[nodeb]
+                for i in merged:
+                    self._components[i] = merged
+        else:
+            # Only the component the edge belonged to may split
+            for component in nx.connected_components(self.graph.subgraph(self._components[nodea])):
+                for i in component:
+                    self._components[i] = component
+
+    def _record(self, change: TopologyChange):
+        self.journal.append(change)
+        if change.kind == "add_node":
+            self.graph.add_node(change.nodea, data=change.data)
+            self._on_node_added(change.nodea)
+        elif change.kind == "remove_node":
+            self.graph.remove_node(change.nodea)
+            self._on_node_removed(change.nodea)
+        elif change.kind == "add_edge":
+            self.graph.add_edge(change.nodea, change.nodeb, relationship=change.data)
+            self._on_edge_changed(change.nodea, change.nodeb, True)
+        elif change.kind == "remove_edge":
+            self.graph.remove_edge(change.nodea, change.nodeb)
+            self._on_edge_changed(change.nodea, change.nodeb, False)
+        else:
+            raise ValueError(f"Unsupported change kind {change.kind}")
+
+    def get_revision(self) -> int:
+        """ Number of changes made through the mutation API """
+        return len(self.journal)
+
+    def get_changes(self, since_revision: int = 0) -> list:
+        """ Returns changes made after `since_revision`, see `get_revision` """
+        return self.journal[since_revision:]
+
+    def add_node(self, node):
+        """ Adds a node w/o edges. Dense indices of existing nodes do not change """
+        if hash(node) not in self.graph.nodes:
+            self._record(TopologyChange("add_node", hash(node), data=node))
+
+    def remove_edge(self, nodea, nodeb) -> object:
+        """ Removes the edge b/w two node objects. Returns its relationship object """
+        relationship = self.graph.edges[hash(nodea), hash(nodeb)]["relationship"]
+        self._record(TopologyChange("remove_edge", hash(nodea), hash(nodeb), relationship))
+        return relationship
+
+    def detach_node(self, node) -> list:
+        """
+        Removes all the edges of a node, but keeps the node, so dense node
+        indices (and simulations built on them) stay valid. Returns the
+        removed edges as (node a, node b, relationship) tuples. See
+        `reattach_node`
+        """
+        neighbors = [self.graph.nodes[i]["data"] for i in self.graph.adj[hash(node)]]
+        removed = [(node, i, self.remove_edge(node, i)) for i in neighbors]
+        self._detached.setdefault(hash(node), list()).extend(removed)
+        return removed
+
+    def reattach_node(self, node):
+        """
+        Restores the edges removed by `detach_node`, except for those whose
+        other end is no longer in the topology
+        """
+        for nodea, nodeb, relationship in self._detached.pop(hash(node), list()):
+            if hash(nodeb) in self.graph.nodes and not self.graph.has_edge(hash(nodea), hash(nodeb)):
+                self._record(TopologyChange("add_edge", hash(nodea), hash(nodeb), relationship))
+
+    def remove_node(self, node):
+        """
+        Removes a node w/ all its edges. Dense indices of the nodes that
+        follow it change, use `detach_node` to keep them
+        """
+        for i in list(self.graph.adj[hash(node)]):
+            self.remove_edge(node, self.graph.nodes[i]["data"])
+        self._detached.pop(hash(node), None)
+        self._record(TopologyChange("remove_node", hash(node), data=node))
+
+    def detach_container(self, container):
+        """
+        Stops the container: removes its deployment edge. The container node
+        stays (so do dense indices), but is not deployed, see
+        `is_container_deployed`
+        """
+        self.remove_edge(container, container.node)
+
+    def attach_container(self, container, node=None):
+        """
+        Deploys a detached (or new) container on `node`, or, if None, on
+        `container.node`
+        """
+        if node is not None:
+            container.node = node
+        self.add_edge(container, container.node, Deployment())
+
+    def is_container_deployed(self, container) -> bool:
+        """ Whether the container is attached to its node, see `detach_container` """
+        return self.graph.has_edge(hash(container), hash(container.node))
+
+    def get_routing_table(self, metric: str = "hops", targets: str = "nodes") -> RoutingTable:
+        """
+        Returns shortest paths to processing nodes (`targets="nodes"`), or
+        to all nodes (`targets="all"`), see `RoutingTable`. Tables are built
+        lazily, and cached the same way the dense index is
+        """
+        key = (metric, targets)
+        if key not in self._routing_tables:
+            index = self.get_index()
+            if targets == "nodes":
+                target_indices = np.flatnonzero(index.node_kind == NODE_KIND_NODE)
+            elif targets == "all":
+                target_indices = None
+            else:
+                raise ValueError(f"Unsupported routing targets \"{targets}\"")
+            self._routing_tables[key] = RoutingTable(index, metric, target_indices)
+        return self._routing_tables[key]
+
+    def get_node_component(self, inode: int) -> set:
+        """
+        Returns connected component (a set of node hashes) the node belongs
+        to. Components are computed once for all nodes, and cached the same
+        way the dense index is
+        """
+        if self._components is None:
+            self._components = dict()
+            for component in nx.connected_components(self.graph):
+                for i in component:
+                    self._components[i] = component
+        return self._components[inode]
+
+    def get_container_attachments(self) -> dict:
+        """
+        Returns {hash(container): connected component of the node the
+        container is deployed on}, for each deployed container in the
+        topology. Detached containers are omitted
+        """
+        index = self.get_index()
+        return {hash(container): self.get_node_component(hash(container.node))
+                for kind, container in zip(index.node_kind, index.node_objects)
+                if kind == NODE_KIND_CONTAINER and self.is_container_deployed(container)}
+
+    def save(self, path: str):
+        """
+        Saves the topology as a snapshot directory, see `TopologySnapshot`
+        """
+        TopologySnapshot.from_topology(self).save(path)
+
+    @staticmethod
+    def load(path: str):
+        """
+        Loads a topology saved by `save`. Objects get their original ids (and,
+        therefore, derived IPs)
+        """
+        return TopologySnapshot.load(path).to_topology()
 
     def as_nxgraph(self):
         """
@@ -242,11 +873,9 @@ class Topology(nx.Graph):
         return self.graph
 
     def add_edge(self, nodea: Node, nodeb: Node, link_details: PhysicalLink):
-        if hash(nodea) not in self.graph.nodes:
-            self.graph.add_node(hash(nodea), data=nodea)
-        if hash(nodeb) not in self.graph.nodes:
-            self.graph.add_node(hash(nodeb), data=nodeb)
-        self.graph.add_edge(hash(nodea), hash(nodeb), relationship=link_details)
+        self.add_node(nodea)
+        self.add_node(nodeb)
+        self._record(TopologyChange("add_edge", hash(nodea), hash(nodeb), link_details))
 
     def render(self, ax=None, show=True, get_node_label_cb: callable=None,
                 get_edge_label_cb: callable=None):
@@ -296,13 +925,15 @@ class Topology(nx.Graph):
             n_nodes: int,
             images_count: dict,
             n_overlays: int,
-            image_commands: dict = dict()):
+            image_commands: dict = dict(),
+            link_bps: float = 10):
         """
         Generates a virtualized network
         - n_switches_total - total number of switches (including externally-connected ones)
         - n_nodes - number of physical nodes
         - image_count - {image name: number of images}.
         - image_commands: {"image name": "command"} dict. If no custom command is required, just omit the field
+        - link_bps: bandwidth of each physical link
 
         Objects assiociated w/ nodes, and links are put under "data" keyword.
         Containers are linked to nodes
@@ -342,88 +973,74 @@ class Topology(nx.Graph):
                 overlay_id=None,
                 command=None) for _ in range(n_containers)]
 
-        # Distribute containers among overlays (assign overlay types to containers)
-        overlay_map = {o: list() for o in range(n_overlays)}  # {overlay id: list of containers}. Temporary index for fast access
-        c = 0
-        while c < n_containers:
-            # Ensure image diversity (just distribution of image types across overlays)
-            for i in images_count.keys():
-                for o in range(n_overlays):
-                    if images_count[i] > 0 and c < n_containers:
-                        containers[c].overlay_id = o
-                        containers[c].name = i  # Named after the image
-                        containers[c].command = image_commands[i] if i in image_commands else None
-                        images_count[i] -= 1
-                        overlay_map[o].append(containers[c])
-                        c+=1
-
-        # Distribute containers among nodes. Ensure no more than 1 overlay type on each node
-        c = 0
-        while c < n_containers:
-            for o in range(n_overlays):
-                for n in range(n_nodes):
-                    if c < n_containers and len(overlay_map[o]) > 0:
-                        overlay_map[o][-1].node = nodes[n]
-                        overlay_map[o] = overlay_map[o][:-1]  # Remove the last element
-                        c += 1
+        # Distribute containers among overlays (assign overlay types to containers).
+        # Containers are dealt in passes: on each pass, each image (in the order of
+        # `images_count`) takes overlays 0, 1, ..., one container per overlay,
+        # until either the image, or the overlays are exhausted.
+        image_names = list(images_count.keys())
+        image_counts = np.array(list(images_count.values()), dtype=np.int64)
+        n_passes = int(math.ceil(max(image_counts, default=0) / n_overlays))
+        n_per_pass = np.clip(image_counts[None, :]
+                - np.arange(n_passes)[:, None] * n_overlays, 0, n_overlays).ravel()
+        container_image = np.repeat(np.tile(np.arange(len(image_names)), n_passes),
+                n_per_pass)
+        container_overlay = np.arange(n_containers) \
+                - np.repeat(np.cumsum(n_per_pass) - n_per_pass, n_per_pass)
+
+        # Distribute containers among nodes. Ensure no more than 1 overlay type on each node.
+        # Each overlay deals its containers to nodes 0, 1, ... (wrapping around),
+        # starting from the most recently created container.
+        overlay_size = np.bincount(container_overlay, minlength=n_overlays)
+        overlay_order = np.argsort(container_overlay, kind="stable")
+        position = np.empty(n_containers, dtype=np.int64)
+        position[overlay_order] = np.arange(n_containers) \
+                - np.repeat(np.cumsum(overlay_size) - overlay_size, overlay_size)
+        container_node = (overlay_size[container_overlay] - 1 - position) % max(n_nodes, 1)
+
+        for c, container in enumerate(containers):
+            image_name = image_names[container_image[c]]
+            container.overlay_id = int(container_overlay[c])
+            container.name = image_name  # Named after the image
+            container.command = image_commands[image_name] if image_name in image_commands else None
+            container.node = nodes[container_node[c]]
 
         # Connect switches - create tree topology
         g = nx.Graph()
-        # Create switch tree
+        # Create switch tree. The tree is traversed depth-first: each hop-1
+        # switch is followed by (up to) `n_switches_per_hop` of its hop-2 children
         n_hops = 2
         n_switches_per_hop = int(math.ceil(n_switches_total ** (1 / n_hops)))
         if n_switches_per_hop < 1:
             n_switches_per_hop = 1
-        # Initial conditions, counters
-        s = 1
-        switch_stack = [switches[0]]  # Stack containing the last switch for depth-first traverse
-        switch_counter_stack = [n_switches_per_hop]  # Stack of hop counters for depth-first traverse
-        hop = 0
-        while s < n_switches_total:
-            if hop >= n_hops:
-                # Enforce hop ceiling, go one hop down
-                hop-=1
-                switch_counter_stack.pop()
-                switch_stack.pop()
-            else:
-                if switch_counter_stack[-1] > 0:
-                    # Hop is required
-                    node1 = switch_stack[-1]
-                    node2 = switches[s]
-                    g.add_node(hash(node1), data=node1)
-                    g.add_node(hash(node2), data=node2)
-                    link = PhysicalLink(node1=switch_stack[-1], node2=switches[s], bandwidth=10)  # TODO: the bandwidth is wrong
-                    tired.logging.debug(f"Adding link between switches {hash(node1)} and {hash(node2)}")
-                    g.add_edge(hash(node1), hash(node2), relationship=link)
-                    switch_counter_stack[-1] -= 1
-                    switch_counter_stack.append(n_switches_per_hop)
-                    switch_stack.append(switches[s])
-                    s += 1
-                    hop += 1
-                elif hop > 0:
-                    # Exhausted the number of hops, go one hop down
-                    hop -= 1
-                    switch_counter_stack.pop()
-                    switch_stack.pop()
-                else:
-                    tired.logging.error("Unexpected premature stack exhaustion")
-                    raise ValueError
+        s = np.arange(1, n_switches_total)
+        block, offset = np.divmod(s - 1, n_switches_per_hop + 1)
+        if len(block) and block[-1] >= n_switches_per_hop:
+            tired.logging.error("Unexpected premature stack exhaustion")
+            raise ValueError
+        parent = np.where(offset == 0, 0, 1 + block * (n_switches_per_hop + 1))
+        switch_links = [PhysicalLink(node1=switches[p], node2=switches[i], bandwidth=link_bps)
+                for p, i in zip(parent, s)]
+        if n_switches_total > 1:
+            g.add_nodes_from((hash(i), {"data": i}) for i in switches)
+        g.add_edges_from((hash(i.node1), hash(i.node2), {"relationship": i})
+                for i in switch_links)
+        tired.logging.debug(f"Added {len(switch_links)} links between switches")
 
         # Connect nodes to switches
         n_nodes_per_switch = int(math.ceil(n_nodes / n_switches_total))
+        node_switches = [switches[int(n / n_nodes_per_switch)] for n in range(n_nodes)]
+        node_links = [PhysicalLink(node1=nodes[n], node2=node_switches[n], bandwidth=link_bps)
+                for n in range(n_nodes)]
         for n in range(n_nodes):
-            node1 = nodes[n]
-            g.add_node(hash(node1), data=node1)
-            s = int(n / n_nodes_per_switch)
-            switch = switches[s]
-            link=PhysicalLink(node1=nodes[n], node2=switch, bandwidth=10)  # TODO: check the bw, it's wrong
-            g.add_node(hash(switch), data=switch)
-            g.add_edge(hash(node1), hash(switch), relationship=link)
+            g.add_node(hash(nodes[n]), data=nodes[n])
+            g.add_node(hash(node_switches[n]), data=node_switches[n])
+        g.add_edges_from((hash(i.node1), hash(i.node2), {"relationship": i})
+                for i in node_links)
 
         # Store the containers in the topology
-        for c in range(n_containers):
-            g.add_node(hash(containers[c]), data=containers[c])
-            g.add_edge(hash(containers[c]), hash(containers[c].node), relationship=Deployment())
+        g.add_nodes_from((hash(i), {"data": i}) for i in containers)
+        g.add_edges_from((hash(i), hash(i.node), {"relationship": Deployment()})
+                for i in containers)
 
         # Build the object
         ret = Topology(g)
@@ -464,3 +1081,225 @@ def test_lb22_topology_generation():
         elif isinstance(node, Container):
             assert(hash(node) not in cset)
             cset.add(hash(node))
+
+
+def test_topology_index():
+    topology = Topology.new_topology_lb22_overlay(n_switches_total=5,
+            n_gates=2,
+            n_nodes=20,
+            images_count={
+                "image 1": 30,
+            },
+            n_overlays=5,
+            image_commands={})
+    nx_graph = topology.as_nxgraph()
+    index = topology.get_index()
+    assert index is topology.get_index()
+    assert index.get_n_nodes() == nx_graph.number_of_nodes()
+    assert index.get_n_edges() == nx_graph.number_of_edges()
+    for i, inode in enumerate(nx_graph.nodes):
+        node = nx_graph.nodes[inode]["data"]
+        assert index.node_objects[i] is node
+        assert index.node_kind[i] == get_node_kind(node)
+        assert list(index.node_ids[index.get_neighbors(i)]) == list(nx_graph.neighbors(inode))
+    for k, (a, b) in enumerate(nx_graph.edges):
+        assert index.csr_edge[index.edge_index[(a, b)]] == k
+        assert index.csr_edge[index.edge_index[(b, a)]] == k
+        link = nx_graph.edges[a, b]["relationship"]
+        assert index.edge_bps[k] == (link.bps if isinstance(link, PhysicalLink) else np.inf)
+    assert np.count_nonzero(index.node_kind == NODE_KIND_GATE) == 2
+    assert np.count_nonzero(index.node_kind == NODE_KIND_CONTAINER) == 30
+
+    # Mutation invalidates the index
+    s = Switch(is_gate=False)
+    topology.add_edge(index.node_objects[0], s, PhysicalLink(index.node_objects[0], s, bandwidth=1))
+    assert topology.get_index() is not index
+    assert topology.get_index().get_n_nodes() == index.get_n_nodes() + 1
+
+
+def test_lb22_container_assignment():
+    """ Containers are assigned to overlays, and nodes the way the original nested loops did it """
+    images_count = {"image 1": 23, "image 2": 7, "image 3": 12}
+    n_overlays = 4
+    n_nodes = 5
+    topology = Topology.new_topology_lb22_overlay(n_switches_total=3,
+            n_gates=1,
+            n_nodes=n_nodes,
+            images_count=images_count,
+            n_overlays=n_overlays,
+            image_commands={"image 2": "sleep 1"})
+    nx_graph = topology.as_nxgraph()
+    containers = sorted([nx_graph.nodes[i]["data"] for i in nx_graph.nodes
+            if isinstance(nx_graph.nodes[i]["data"], Container)], key=lambda i: i.get_id())
+    nodes = sorted([nx_graph.nodes[i]["data"] for i in nx_graph.nodes
+            if isinstance(nx_graph.nodes[i]["data"], Node)], key=lambda i: i.get_id())
+    assert images_count == {"image 1": 23, "image 2": 7, "image 3": 12}  # Not mutated
+
+    # Reference implementation
+    n_containers = sum(images_count.values())
+    remaining = dict(images_count)
+    expected = [dict() for _ in range(n_containers)]
+    overlay_map = {o: list() for o in range(n_overlays)}
+    c = 0
+    while c < n_containers:
+        for i in remaining.keys():
+            for o in range(n_overlays):
+                if remaining[i] > 0 and c < n_containers:
+                    expected[c]["overlay_id"] = o
+                    expected[c]["name"] = i
+                    remaining[i] -= 1
+                    overlay_map[o].append(expected[c])
+                    c += 1
+    c = 0
+    while c < n_containers:
+        for o in range(n_overlays):
+            for n in range(n_nodes):
+                if c < n_containers and len(overlay_map[o]) > 0:
+                    overlay_map[o][-1]["node"] = nodes[n]
+                    overlay_map[o] = overlay_map[o][:-1]
+                    c += 1
+
+    assert len(containers) == n_containers
+    for container, reference in zip(containers, expected):
+        assert container.overlay_id == reference["overlay_id"]
+        assert container.name == reference["name"]
+        assert container.node is reference["node"]
+        assert container.command == ("sleep 1" if container.name == "image 2" else None)
+
+
+def test_topology_snapshot_round_trip():
+    import tempfile
+    topology = Topology.new_topology_lb22_overlay(n_switches_total=5,
+            n_gates=2,
+            n_nodes=20,
+            images_count={
+                "image 1": 30,
+                "image 2": 10,
+            },
+            n_overlays=5,
+            image_commands={"image 2": "echo wazzup, man"})
+    with tempfile.TemporaryDirectory() as path:
+        topology.save(path)
+        restored = Topology.load(path)
+
+    def _summary(obj):
+        ret = [obj.__class__, obj.get_id(), hash(obj)]
+        if isinstance(obj, Switch):
+            ret += [obj.is_gate]
+        elif isinstance(obj, Node):
+            ret += [obj.get_ip4_string()]
+        elif isinstance(obj, Container):
+            ret += [hash(obj.node), obj.cpufrac, obj.networkfrac, obj.hddfrac,
+                    obj.name, obj.command, obj.overlay_id, obj.get_string_id()]
+        elif isinstance(obj, PhysicalLink):
+            ret += [hash(obj.node1), hash(obj.node2), obj.bps]
+        return ret
+
+    graph = topology.as_nxgraph()
+    restored_graph = restored.as_nxgraph()
+    assert list(graph.nodes) == list(restored_graph.nodes)
+    assert list(graph.edges) == list(restored_graph.edges)
+    for i in graph.nodes:
+        assert _summary(graph.nodes[i]["data"]) == _summary(restored_graph.nodes[i]["data"])
+        assert list(graph.neighbors(i)) == list(restored_graph.neighbors(i))
+    for e in graph.edges:
+        assert _summary(graph.edges[e]["relationship"]) \
+                == _summary(restored_graph.edges[e]["relationship"])
+    # Restored objects do not collide w/ the ones created afterwards
+    assert hash(Node()) not in restored_graph.nodes
+
+
+def test_routing_table():
+    topology = Topology.new_topology_lb22_overlay(n_switches_total=6,
+            n_gates=2,
+            n_nodes=12,
+            images_count={
+                "image 1": 6,
+            },
+            n_overlays=2,
+            image_commands={})
+    index = topology.get_index()
+    table = topology.get_routing_table("hops")
+    assert table is topology.get_routing_table("hops")
+    assert list(index.node_kind[table.targets]) == [NODE_KIND_NODE] * len(table.targets)
+
+    # Containers are reachable over deployments only, which do not carry traffic
+    physical = nx.Graph([e for e in topology.as_nxgraph().edges
+            if isinstance(topology.as_nxgraph().edges[e]["relationship"], PhysicalLink)])
+    for target in table.targets:
+        lengths = nx.single_source_shortest_path_length(physical, int(index.node_ids[target]))
+        for source in range(index.get_n_nodes()):
+            inode = int(index.node_ids[source])
+            assert table.get_distance(source, target) == lengths.get(inode, np.inf)
+            next_hop = table.get_next_hop(source, target)
+            if source == target or inode not in lengths:
+                assert next_hop == -1
+                continue
+            # Following the next hop gets one hop closer
+            assert table.get_distance(next_hop, target) == table.get_distance(source, target) - 1
+            slot = table.next_hop_slot[table.target_row[target], source]
+            assert index.get_neighbors(source)[slot] == next_hop
+
+    weighted = topology.get_routing_table("bandwidth", "all")
+    assert weighted.distance.shape == (index.get_n_nodes(), index.get_n_nodes())
+    for a, b in physical.edges:
+        physical.edges[a, b]["weight"] = 8.0 / topology.as_nxgraph().edges[a, b]["relationship"].bps
+    gate = int(np.flatnonzero(index.node_kind == NODE_KIND_GATE)[0])
+    lengths = nx.single_source_dijkstra_path_length(physical, int(index.node_ids[gate]))
+    for inode, length in lengths.items():
+        assert np.isclose(weighted.get_distance(index.node_index[inode], gate), length)
+
+    # Mutation invalidates the tables
+    s = Switch(is_gate=False)
+    topology.add_edge(index.node_objects[gate], s, PhysicalLink(index.node_objects[gate], s, bandwidth=1))
+    assert topology.get_routing_table("hops") is not table
+
+
+def test_topology_mutation():
+    topology = Topology(nx.Graph())
+    gate = Switch(is_gate=True)
+    switch = Switch(is_gate=False)
+    nodes = [Node() for _ in range(3)]
+    topology.add_edge(gate, switch, PhysicalLink(gate, switch, bandwidth=1))
+    for node in nodes:
+        topology.add_edge(switch, node, PhysicalLink(switch, node, bandwidth=1))
+    container = Container(node=nodes[0], cpufrac=None, networkfrac=None, hddfrac=None,
+            name="image", command=None)
+    topology.attach_container(container)
+    assert [i.kind for i in topology.get_changes(topology.get_revision() - 2)] == ["add_node", "add_edge"]
+    index = topology.get_index()
+    assert topology.get_node_component(hash(nodes[0])) == set(index.node_ids)
+
+    # Edge changes keep dense node indices, and update components in place
+    revision = topology.get_revision()
+    removed = topology.detach_node(switch)
+    assert len(removed) == 4
+    assert [i.kind for i in topology.get_changes(revision)] == ["remove_edge"] * 4
+    detached_index = topology.get_index()
+    assert detached_index is not index and detached_index.node_ids is index.node_ids
+    assert detached_index.get_n_edges() == 1
+    assert topology.get_node_component(hash(switch)) == {hash(switch)}
+    assert topology.get_node_component(hash(container)) == {hash(container), hash(nodes[0])}
+    assert np.all(np.isinf(topology.get_routing_table().distance[:, index.node_index[hash(gate)]]))
+
+    topology.reattach_node(switch)
+    assert topology.get_index().get_n_edges() == 5
+    assert topology.get_node_component(hash(gate)) == set(index.node_ids)
+    assert topology.get_routing_table().get_distance(index.node_index[hash(gate)],
+            index.node_index[hash(nodes[1])]) == 2
+
+    # Migration of a container
+    topology.detach_container(container)
+    assert not topology.is_container_deployed(container)
+    assert hash(container) not in topology.get_container_attachments()
+    topology.attach_container(container, nodes[2])
+    assert topology.is_container_deployed(container)
+    assert topology.get_container_attachments()[hash(container)] == set(index.node_ids)
+    assert topology.as_nxgraph().has_edge(hash(container), hash(nodes[2]))
+    assert not topology.as_nxgraph().has_edge(hash(container), hash(nodes[0]))
+
+    # Removal of a node changes the dense index
+    topology.remove_node(nodes[1])
+    assert topology.get_index().get_n_nodes() == index.get_n_nodes() - 1
+    assert hash(nodes[1]) not in topology.get_index().node_index
+    assert topology.get_changes(topology.get_revision() - 1)[0].kind == "remove_node"
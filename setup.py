@@ -27,7 +27,8 @@ setup(
     ],
     package_data={
         "howlitbe": [
-            "res/*.sh"
+            "res/*.sh",
+            "res/telemetry/*",
         ]
     },
     include_package_data=True,
@@ -0,0 +1,49 @@
+"""
+Measures lb22 overlay topology generation time against the number of
+containers.
+
+Usage: python3 tools/bench_topology.py [--containers 1000 10000 100000]
+"""
+
+import argparse
+import howlitbe.topology
+import time
+
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--containers", type=int, nargs="+", default=[1000, 10000, 100000],
+            help="Numbers of containers to generate topologies for")
+    parser.add_argument("--images", type=int, default=3, help="Number of image types")
+    parser.add_argument("--overlays", type=int, default=20, help="Number of overlays")
+    parser.add_argument("--containers-per-node", type=int, default=10,
+            help="Defines the number of physical nodes")
+    parser.add_argument("--nodes-per-switch", type=int, default=16,
+            help="Defines the number of switches")
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_arguments()
+    print(f"{'containers':>12} {'nodes':>8} {'switches':>8} {'generation, s':>14} {'index, s':>10}")
+    for n_containers in args.containers:
+        n_nodes = max(1, n_containers // args.containers_per_node)
+        n_switches_total = max(1, n_nodes // args.nodes_per_switch)
+        images_count = {f"image {i}": n_containers // args.images for i in range(args.images)}
+        images_count["image 0"] += n_containers - sum(images_count.values())
+
+        t0 = time.perf_counter()
+        topology = howlitbe.topology.Topology.new_topology_lb22_overlay(
+                n_switches_total=n_switches_total,
+                n_gates=1,
+                n_nodes=n_nodes,
+                images_count=images_count,
+                n_overlays=args.overlays)
+        t1 = time.perf_counter()
+        topology.get_index()
+        t2 = time.perf_counter()
+        print(f"{n_containers:>12} {n_nodes:>8} {n_switches_total:>8} {t1 - t0:>14.3f} {t2 - t1:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()